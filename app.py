@@ -1,21 +1,46 @@
 # Importing the main packages
 import streamlit as st
+import logging
+import uuid
 
 
 # Importing customized functions
 from functions.style import css_hacks, page_elements 
 from functions.content import sticky_logo, header_builder, reliability_box_builder, sensor_image_box_builder, spot_selector_builder, last_record_chart_builder, time_series_plot_builder
+from functions.content import trace_sidebar_builder
+from functions.data import frame_store, settings, tenants
+from functions.data.query_context import QueryContext
+from functions.jobs import cache_warmer
+from functions.monitoring import metrics, tracing
+
+
+# Tracing the render time of this rerun, from here to the end of the script
+tracing.start_trace()
 
 
 # Setting the page configuration
 st.set_page_config(page_title='ACOPLAST Brasil',
                    page_icon="images/favicon-acoplast.ico",
                    layout="wide",
-                   initial_sidebar_state="collapsed"
+                   initial_sidebar_state="expanded" if settings.DEBUG_TRACING else "collapsed"
                    )
 
-# Database connection to the data functions
-conn = st.connection("postgresql", type="sql")
+# Client of this session when the process serves several (tenants.toml): the one authenticated by
+# the proxy, or the one of ?cliente=<slug> with its token
+tenant = tenants.get_session_tenant(tenants.load_tenants())
+if tenant is None:
+    st.error('Cliente não encontrado ou acesso não autorizado. Verifique o endereço de acesso.')
+    st.stop()
+
+# Database connection to the data functions, with its own pool per client, and the read replicas
+# for the historical range reads, if any
+conn, replica_conns = tenants.connect_tenant(tenant)
+
+# Preloading the shared caches of every client, once per process and then on a schedule
+cache_warmer.start_warmer()
+
+# Memo of the query results of this rerun, shared by every builder
+query_context = QueryContext(conn, replicas=replica_conns, namespace=tenant['slug'])
 
 # Removing undesired streamlit elements
 css_hacks.remove_streamlit_elements()
@@ -38,9 +63,9 @@ sticky_logo.insert_logo(banner_logo)
 header_builder.insert_data(col_left=header_left,
                            col_center=header_center,
                            col_right=header_right,
-                           client_name='PLATAFORMA CONFIABILIDADE',
-                           code='CÓDIGO: 645205 - MODELO: ACOWLV4T4',
-                           application='APLICAÇÃO: REDUTORES, MOTOREDUTORES & CONTRA RECUO')
+                           client_name=tenant['client_name'],
+                           code=tenant['code'],
+                           application=tenant['application'])
 
 with header:
     st.divider()
@@ -55,10 +80,10 @@ sensor_image_box_builder.show_sensor_image(column=body_left,
 
 spot_id_selected, spot_name_selected = spot_selector_builder.show_spot_selector(column=body_center,
                                                                                 title='Pontos de Monitoramento',
-                                                                                conn=conn)
+                                                                                conn=query_context)
 
 last_record_timestamp_int, last_record_timestamp_datetime, variables_from_spot_df = last_record_chart_builder.show_last_record_chart(column=body_center,
-                                                                                                                                     conn=conn,
+                                                                                                                                     conn=query_context,
                                                                                                                                      spot_id_selected=spot_id_selected)
 
 
@@ -69,4 +94,21 @@ time_series_plot_builder.show_line_plots(column=body_right,
                                          last_record_timestamp_int=last_record_timestamp_int,
                                          variables_from_spot_df=variables_from_spot_df,
                                          spot_name_selected=spot_name_selected,
-                                         conn=conn)
+                                         conn=query_context)
+
+
+spans = tracing.finish_trace()
+
+logging.getLogger('acodata').info('Query memo of the rerun: %s', query_context.stats())
+
+# Process-wide metrics for Prometheus (ACODATA_METRICS_MODE)
+if 'metrics_session_id' not in st.session_state:
+    st.session_state['metrics_session_id'] = uuid.uuid4().hex
+metrics.observe_session(st.session_state['metrics_session_id'])
+metrics.observe_rerun(spans[0]['end'] - spans[0]['start'])
+metrics.export()
+
+if settings.DEBUG_TRACING:
+    trace_sidebar_builder.show_trace_sidebar(spans=spans,
+                                             query_stats=query_context.stats(),
+                                             frame_store_stats=frame_store.get_stats())
@@ -0,0 +1,129 @@
+"""
+Benchmark of the per-variable reads of a spot: sequential, thread pool and async fan-out.
+
+Usage (from the repository root):
+    python -m benchmarks.async_benchmark [--url postgresql+psycopg2://...] [--spot-id 1] [--repeat 20] [--latency-ms 0]
+
+Each round runs the reads of the default page of the spot: the alarms, last record and row
+estimate of every variable, then its last 24 hours. The sequential path runs them one after the
+other, as the builders do with conn.query; the thread pool runs them over ASYNC_POOL_SIZE
+threads; the async path fans them out from the event loop of functions.data.async_engine.
+--latency-ms adds a server-side pause to every query, to emulate the round trip to a remote
+database. Only reads are made.
+
+Every round reads from the database: it measures the cold reads of a spot, the first time any
+session opens it. Later reruns are served from memory in both modes, from the conn.query cache
+with the sync engine and from the frame store with the async one (see QueryContext.prefetch).
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from functions.content import last_record_chart_builder, time_series_plot_builder
+from functions.data import async_engine, database, query_budget, settings
+
+
+def build_spot_queries(engine, spot_id):
+    """
+    Builds the per-variable reads of the default page of a spot.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        spot_id (int): The ID of the spot.
+
+    Returns:
+        list: The SQL queries.
+    """
+    variables_df = pd.read_sql(last_record_chart_builder.query_get_variables_from_spot(spot_id, 'global_data_id', 'global_data_name', 'alarm_critical'), engine)
+    queries = []
+    for global_data_id in variables_df['global_data_id']:
+        last_record_df = pd.read_sql(last_record_chart_builder.query_get_last_record(spot_id, global_data_id), engine)
+        end_timestamp = int(last_record_df['timestamp'].iloc[0])
+        interval_query = time_series_plot_builder.query_interval_timestamps(spot_id, global_data_id, end_timestamp - 24 * 60 * 60, end_timestamp)
+        queries += [last_record_chart_builder.query_variable_name_alarms(spot_id, global_data_id),
+                    last_record_chart_builder.query_get_last_record(spot_id, global_data_id),
+                    query_budget.query_explain(interval_query),
+                    interval_query]
+    return queries
+
+def add_latency(queries, latency_ms):
+    """
+    Makes every query wait on the server before it runs.
+
+    Args:
+        queries (list): The SQL queries.
+        latency_ms (int): The pause in milliseconds.
+
+    Returns:
+        list: The queries, preceded by the pause.
+    """
+    if latency_ms <= 0:
+        return queries
+    return [f'SELECT * FROM (SELECT pg_sleep({latency_ms / 1000})) AS latency, LATERAL ({query.rstrip().rstrip(";")}) AS result'
+            if not query.lstrip().startswith('EXPLAIN') else query
+            for query in queries]
+
+def run_sequential(engine, queries):
+    """Runs the queries one after the other."""
+    return [pd.read_sql(query, engine) for query in queries]
+
+def run_thread_pool(engine, queries, executor):
+    """Runs the queries over a pool of threads."""
+    return list(executor.map(lambda query: pd.read_sql(query, engine), queries))
+
+def run_async(engine, queries):
+    """Runs the queries at once from the event loop."""
+    return async_engine.run_queries(engine, queries)
+
+def time_rounds(run_round, repeat):
+    """
+    Times rounds of reads.
+
+    Args:
+        run_round (callable): Runs one round.
+        repeat (int): The number of timed rounds, after one warm-up round.
+
+    Returns:
+        float: The median duration of a round in milliseconds.
+    """
+    run_round()
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        run_round()
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(durations)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the sequential, thread pool and async reads of a spot.')
+    parser.add_argument('--url', default=None, help='Database URL (defaults to ACODATA_DATABASE_URL or secrets.toml).')
+    parser.add_argument('--spot-id', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--latency-ms', type=int, default=0, help='Server-side pause added to every query.')
+    args = parser.parse_args()
+
+    engine = database.create_engine(url=args.url, pool_size=settings.ASYNC_POOL_SIZE)
+    queries = add_latency(build_spot_queries(engine, args.spot_id), args.latency_ms)
+    print(f'Spot {args.spot_id}: {len(queries)} queries per round, latency {args.latency_ms} ms, '
+          f'pool of {settings.ASYNC_POOL_SIZE} connections')
+
+    threads_before = threading.active_count()
+    results = {'sequential': time_rounds(lambda: run_sequential(engine, queries), args.repeat)}
+    with ThreadPoolExecutor(max_workers=settings.ASYNC_POOL_SIZE) as executor:
+        results['thread pool'] = time_rounds(lambda: run_thread_pool(engine, queries, executor), args.repeat)
+        pool_threads = threading.active_count() - threads_before
+    async_threads_before = threading.active_count()
+    results['async'] = time_rounds(lambda: run_async(engine, queries), args.repeat)
+    async_threads = threading.active_count() - async_threads_before
+
+    threads = {'sequential': 0, 'thread pool': pool_threads, 'async': async_threads}
+    for path, median_ms in results.items():
+        print(f"{path:<12} {median_ms:8.1f} ms  {results['sequential'] / median_ms:5.1f}x  (+{threads[path]} threads)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Micro-benchmark of the figure build time, rebuilding every figure from scratch versus stamping it
+from the templates of figure_factory.
+
+Usage (from the repository root):
+    python -m benchmarks.figure_benchmark [--rows 10080] [--variables 3] [--repeat 50]
+
+The 'scratch' builders are the ones the dashboard used before figure_factory: plotly.express and
+go.Figure with validated update_layout calls. No database is needed.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit  # noqa: F401  Registers the Streamlit plotly theme as the default template, as in the dashboard
+
+from functions.content import figure_payload, last_record_chart_builder, reliability_box_builder, time_series_plot_builder
+
+
+def scratch_line_figure(df, variable_name, alarm_alert, alarm_critical):
+    """
+    Builds the time series figure from scratch.
+
+    Args:
+        df (DataFrame): The values, with the datetime column last.
+        variable_name (str): The name of the variable.
+        alarm_alert (float): The alert threshold.
+        alarm_critical (float): The critical threshold.
+
+    Returns:
+        plotly.graph_objects.Figure: The figure.
+    """
+    x_column = df.columns[-1]
+    fig = px.line(df, x=x_column, y=list(df.columns[:-1]), template=figure_payload.get_layout_template())
+    for alarm, color in ((alarm_alert, 'orange'), (alarm_critical, 'red')):
+        fig.add_shape(type='line', x0=df[x_column].min(), x1=df[x_column].max(), y0=alarm, y1=alarm,
+                      line=dict(color=color, dash='dash'), name=f'Linha Constante ({alarm})')
+    fig.update_layout(title=variable_name, legend_title_text='', xaxis_title='Data e Hora',
+                      yaxis_title=variable_name, height=250)
+    fig.update_traces(hovertemplate=None)
+    fig.update_layout(hovermode='x unified')
+    return figure_payload.compact_figure(fig)
+
+def scratch_last_record_figure(values, names, colors, max_x, alarm_alert, alarm_critical):
+    """
+    Builds the last record bars from scratch.
+
+    Args:
+        values (list): The last values.
+        names (list): The names of the values.
+        colors (list): The colors of the bars.
+        max_x (float): The largest value shown.
+        alarm_alert (float): The alert threshold.
+        alarm_critical (float): The critical threshold.
+
+    Returns:
+        plotly.graph_objects.Figure: The figure.
+    """
+    fig = go.Figure(go.Bar(x=values, y=names, orientation='h', marker_color=colors, text=values,
+                           textposition='outside', insidetextanchor='end', textangle=0, texttemplate='%{text:.3f}'))
+    fig.update_xaxes(range=[0, max_x * 1.4])
+    fig.add_vline(x=alarm_alert, line_dash='dash', line_color='gold')
+    fig.add_vline(x=alarm_critical, line_dash='dash', line_color='red')
+    fig.update_layout(height=(1 + len(names)) * 30)
+    fig.update_layout(showlegend=False)
+    fig.update_layout(margin=dict(t=0, b=0))
+    fig.update_layout(font=dict(size=16, color='black'))
+    fig.update_layout(yaxis=dict(tickfont=dict(size=16, color='black')))
+    return figure_payload.compact_figure(fig)
+
+def scratch_reliability_gauge(reliability):
+    """
+    Builds the reliability gauge from scratch.
+
+    Args:
+        reliability (float): The reliability, between 0 and 1.
+
+    Returns:
+        plotly.graph_objects.Figure: The figure.
+    """
+    fig = go.Figure(go.Indicator(mode='gauge+number', value=reliability * 100,
+                                 domain={'x': [0, 1], 'y': [0, 1]}, gauge={'axis': {'range': [None, 100]}}))
+    fig.update_layout(margin=dict(t=30, b=20, l=40, r=40), height=150, font=dict(size=16, color='black'))
+    fig.update_traces(gauge_axis_tickmode='array', selector=dict(type='indicator'))
+    fig.update_traces(gauge_axis_tickvals=[0, 25, 50, 75, 100], selector=dict(type='indicator'))
+    return fig
+
+def time_build(build, repeat):
+    """
+    Times a figure builder.
+
+    Args:
+        build (callable): Called without arguments to build one figure.
+        repeat (int): The number of timed builds.
+
+    Returns:
+        float: The median build time in milliseconds.
+    """
+    build()  # Warm-up, so the one-off template build is not timed
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        build()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    return float(np.median(timings))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the build time of scratch and templated figures.')
+    parser.add_argument('--rows', type=int, default=7 * 24 * 60, help='Rows of the time series (default: 7 days of minutes).')
+    parser.add_argument('--variables', type=int, default=3, help='Lines per time series figure.')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed builds per figure.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.random((args.rows, args.variables)) * 10, columns=[f'Eixo {index}' for index in range(args.variables)])
+    df['Data e Hora'] = pd.date_range('2024-01-01', periods=args.rows, freq='min')
+    values = list(rng.random(args.variables) * 10)
+    names = list(df.columns[:-1])
+    colors = ['green'] * args.variables
+
+    cases = [('time_series',
+              lambda: scratch_line_figure(df, 'Vibração', 3.0, 5.0),
+              lambda: time_series_plot_builder.plot_dataframe_lines(df, 'Vibração', 3.0, 5.0)),
+             ('last_record',
+              lambda: scratch_last_record_figure(values, names, colors, 10.0, 3.0, 5.0),
+              lambda: last_record_chart_builder.create_last_record_plot(values, names, colors, 10.0, 3.0, 5.0)),
+             ('reliability_gauge',
+              lambda: scratch_reliability_gauge(0.969),
+              lambda: reliability_box_builder.create_reliability_gauge(0.969))]
+
+    rows = []
+    for chart, scratch_build, templated_build in cases:
+        scratch_ms = time_build(scratch_build, args.repeat)
+        templated_ms = time_build(templated_build, args.repeat)
+        rows.append({'chart': chart,
+                     'scratch_ms': round(scratch_ms, 2),
+                     'templated_ms': round(templated_ms, 2),
+                     'speedup': round(scratch_ms / templated_ms, 1)})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
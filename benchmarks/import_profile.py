@@ -0,0 +1,169 @@
+"""
+Profile of the startup of a new process: the import time of each module a page loads, and the
+time to its first render.
+
+Usage (from the repository root):
+    python -m benchmarks.import_profile [--script app.py] [--repeat 5] [--top 25] [--first-render]
+
+The top-level imports of the script are run in fresh interpreters under `python -X importtime`,
+which reports the time of every module imported, by itself ('self') and with the modules it
+imports ('cumulative'). The median of --repeat runs is reported per module, per top-level
+package, and for the modules of this repository. --first-render also times fresh processes
+running the whole script once with Streamlit's AppTest, which needs the database of
+.streamlit/secrets.toml.
+"""
+import argparse
+import ast
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One line of -X importtime: "import time:       self [us] |  cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def get_script_imports(script_path):
+    """
+    Reads the top-level import statements of a script, without running it.
+
+    Args:
+        script_path (str): The path of the script.
+
+    Returns:
+        str: The import statements, one per line.
+    """
+    with open(script_path, encoding='utf-8') as script_file:
+        source = script_file.read()
+    statements = [ast.get_source_segment(source, node) for node in ast.parse(source).body
+                  if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return '\n'.join(statements)
+
+def parse_importtime(output):
+    """
+    Parses the report of `python -X importtime`.
+
+    Args:
+        output (str): The standard error of the interpreter.
+
+    Returns:
+        DataFrame: One row per module imported, with 'module', 'depth', 'self_ms' and 'cumulative_ms'.
+    """
+    rows = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        rows.append({'module': module,
+                     'depth': (len(indent) - 1) // 2,
+                     'self_ms': int(self_us) / 1000,
+                     'cumulative_ms': int(cumulative_us) / 1000})
+    return pd.DataFrame(rows, columns=['module', 'depth', 'self_ms', 'cumulative_ms'])
+
+def profile_imports(code, repeat):
+    """
+    Runs import statements in fresh interpreters under -X importtime.
+
+    Args:
+        code (str): The import statements.
+        repeat (int): The number of interpreters run.
+
+    Returns:
+        DataFrame: The median 'self_ms' and 'cumulative_ms' of each module over the runs, and its
+        'depth' in the import tree, the slowest first.
+        float: The median of the total import time of the runs, in milliseconds.
+    """
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPOSITORY_ROOT,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f'The imports failed:\n{result.stderr[-2000:]}')
+        runs.append(parse_importtime(result.stderr))
+    profile_df = pd.concat(runs).groupby('module').agg(depth=('depth', 'min'),
+                                                       self_ms=('self_ms', 'median'),
+                                                       cumulative_ms=('cumulative_ms', 'median'))
+    total_ms = statistics.median(run_df['self_ms'].sum() for run_df in runs)
+    return profile_df.reset_index().sort_values('cumulative_ms', ascending=False, ignore_index=True), total_ms
+
+def summarize_packages(profile_df):
+    """
+    Adds up the self time of the modules of each top-level package.
+
+    Args:
+        profile_df (DataFrame): The result of profile_imports.
+
+    Returns:
+        DataFrame: One row per package with its 'modules' and 'self_ms', the slowest first.
+    """
+    packages = profile_df['module'].str.split('.').str[0]
+    return (profile_df.groupby(packages)
+                      .agg(modules=('module', 'size'), self_ms=('self_ms', 'sum'))
+                      .rename_axis('package')
+                      .sort_values('self_ms', ascending=False)
+                      .reset_index())
+
+def time_first_render(script_path, repeat, timeout):
+    """
+    Times fresh processes that run a Streamlit script once, from the start of the process to the end of the run.
+
+    Args:
+        script_path (str): The path of the script.
+        repeat (int): The number of processes run.
+        timeout (int): The most seconds a run may take.
+
+    Returns:
+        list: The seconds of each process.
+    """
+    code = ('from streamlit.testing.v1 import AppTest\n'
+            f'app_test = AppTest.from_file({os.path.abspath(script_path)!r}, default_timeout={timeout})\n'
+            'app_test.run()\n'
+            'if app_test.exception:\n'
+            '    raise SystemExit(app_test.exception[0].message)\n')
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], cwd=REPOSITORY_ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f'The first render failed:\n{result.stderr[-2000:]}')
+        seconds.append(time.perf_counter() - start_time)
+    return seconds
+
+def main():
+    parser = argparse.ArgumentParser(description='Profiles the import time and the first render of a new process.')
+    parser.add_argument('--script', default='app.py', help='The Streamlit script profiled (default app.py).')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per measure; the median is reported.')
+    parser.add_argument('--top', type=int, default=25, help='Modules listed, the slowest first.')
+    parser.add_argument('--first-render', action='store_true', help='Also time the first run of the script (needs the database).')
+    parser.add_argument('--timeout', type=int, default=120, help='The most seconds of a first render.')
+    args = parser.parse_args()
+
+    script_path = os.path.join(REPOSITORY_ROOT, args.script)
+    profile_df, total_ms = profile_imports(get_script_imports(script_path), args.repeat)
+    pd.set_option('display.width', 200)
+
+    print(f'Imports of {args.script}: {total_ms:.0f} ms over {len(profile_df)} modules '
+          f'(median of {args.repeat} fresh interpreters)\n')
+    print('Slowest modules (cumulative includes the modules they import):')
+    print(profile_df.head(args.top).to_string(index=False, float_format='{:.1f}'.format))
+    print('\nSelf time per package:')
+    print(summarize_packages(profile_df).head(args.top).to_string(index=False, float_format='{:.1f}'.format))
+    print('\nModules of this repository:')
+    repository_df = profile_df[profile_df['module'].str.match(r'(functions|benchmarks)(\.|$)')]
+    print(repository_df.head(args.top).to_string(index=False, float_format='{:.1f}'.format))
+
+    if args.first_render:
+        seconds = time_first_render(script_path, args.repeat, args.timeout)
+        print(f'\nFirst render of a new process: median {statistics.median(seconds):.2f} s, '
+              f'min {min(seconds):.2f} s, max {max(seconds):.2f} s over {len(seconds)} processes')
+
+
+if __name__ == '__main__':
+    main()
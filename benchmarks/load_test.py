@@ -0,0 +1,501 @@
+"""
+Load test of the dashboard: concurrent operator sessions against a real Streamlit server.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test [--sessions 1,2,4,8,16] [--rounds 3] [--think-seconds 1] [--port 8599]
+
+The dashboard is started with `streamlit run` in a subprocess and each session talks to it as the
+browser does, over the websocket protocol: it sends the rerun requests with its widget states and
+reads the deltas until the script finishes. A round of a session follows an operator: open the
+page, select a spot, switch to a custom range, choose a range of up to --custom-days days, export
+the CSV of a variable (the download button reruns the script, then the file is fetched), and go
+back to the last 24 hours. The levels of --sessions run one after the other on the same server,
+as a process whose load grows.
+
+While a level runs, the RSS of the server and the connections to the database (pg_stat_activity)
+are sampled. A level fails when more than --max-error-rate of its reruns fail (an exception in
+the page, a pool timeout, no answer in --timeout seconds) or its p95 rerun latency exceeds
+--max-p95-seconds; the report gives the first level that fails. The server inherits the
+environment, so settings are compared by running the tool with them set, e.g.
+ACODATA_TENANT_POOL_SIZE=10.
+
+With tenants.toml, sessions must open a client as a browser does: --query-string
+'cliente=<slug>&token=<token>'. Given several times, the sessions of a level are spread over the
+clients in turn, to load several tenant pools at once.
+
+The server reads the database of .streamlit/secrets.toml: point it at a local database seeded
+with spots (e.g. by the ingestion paths), never at production. Needs the websockets package.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import pandas as pd
+import psutil
+import sqlalchemy
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from functions.data import database
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Labels of the widgets of app.py driven by the sessions
+SPOT_SELECTOR_LABEL = 'Pontos de Monitoramento'
+TIME_INTERVAL_LABEL = 'Intervalo de tempo'
+DATE_INTERVAL_LABEL = 'Intervalo entre datas'
+EXPORT_LABEL = 'Baixar aquivo CSV'
+
+CUSTOM_INTERVAL_OPTION = 'Personalizado'
+LAST_24_HOURS_OPTION = '24 horas'
+
+# Format of the dates sent for a date_input
+WIDGET_DATE_FORMAT = '%Y/%m/%d'
+
+SUCCESSFUL_RUN_STATUSES = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_EARLY_FOR_RERUN)
+
+
+class OperatorSession:
+    """
+    A browser tab of the dashboard: its websocket, the widgets of its last run and their states.
+    """
+
+    def __init__(self, base_url, timeout, query_string=''):
+        """
+        Args:
+            base_url (str): The address of the server, as http://host:port.
+            timeout (float): The most seconds a rerun may take.
+            query_string (str): The query string of the page URL, without '?'.
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+        self.query_string = query_string
+        self.websocket = None
+        self.page_script_hash = ''
+        self.widgets = {}
+        self.widget_states = {}
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.base_url.replace('http', 'ws', 1) + '/_stcore/stream',
+                                                  subprotocols=['streamlit'], max_size=None)
+        return None
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+        return None
+
+    async def rerun(self, trigger_id=None):
+        """
+        Reruns the script with the current widget states, and reads its output.
+
+        Args:
+            trigger_id (str): The ID of a button clicked in this rerun, if any.
+
+        Returns:
+            bool: True if the script finished without an exception.
+        """
+        back_msg = BackMsg()
+        client_state = back_msg.rerun_script
+        client_state.query_string = self.query_string
+        client_state.page_script_hash = self.page_script_hash
+        client_state.widget_states.widgets.extend(self.widget_states.values())
+        if trigger_id is not None:
+            trigger = client_state.widget_states.widgets.add()
+            trigger.id = trigger_id
+            trigger.trigger_value = True
+        await self.websocket.send(back_msg.SerializeToString())
+        return await asyncio.wait_for(self.read_run(), timeout=self.timeout)
+
+    async def read_run(self):
+        """
+        Reads the messages of a run until the script finishes, keeping the widgets it rendered.
+
+        Returns:
+            bool: True if the script finished without an exception.
+        """
+        widgets = {}
+        successful = True
+        while True:
+            forward_msg = ForwardMsg()
+            forward_msg.ParseFromString(await self.websocket.recv())
+            message_type = forward_msg.WhichOneof('type')
+            if message_type == 'new_session':
+                self.page_script_hash = self.page_script_hash or forward_msg.new_session.main_script_hash
+            elif message_type == 'delta' and forward_msg.delta.WhichOneof('type') == 'new_element':
+                element = forward_msg.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'exception':
+                    successful = False
+                elif element_type in ('radio', 'date_input', 'download_button'):
+                    widget = getattr(element, element_type)
+                    widgets.setdefault(widget.label, []).append(widget)
+            elif message_type == 'script_finished':
+                successful = successful and forward_msg.script_finished in SUCCESSFUL_RUN_STATUSES
+                break
+        # As in the browser, the widgets no longer on the page drop their state
+        rendered_ids = {widget.id for rendered in widgets.values() for widget in rendered}
+        self.widget_states = {widget_id: state for widget_id, state in self.widget_states.items() if widget_id in rendered_ids}
+        self.widgets = widgets
+        return successful
+
+    def set_radio(self, label, option):
+        """
+        Selects an option of a radio of the last run.
+
+        Args:
+            label (str): The label of the radio.
+            option (str): The option selected.
+
+        Returns:
+            None
+        """
+        radio = self.widgets[label][0]
+        if 'raw_value' in radio.DESCRIPTOR.fields_by_name:
+            # Newer Streamlit versions send the option itself, older ones its index
+            self.widget_states[radio.id] = WidgetState(id=radio.id, string_value=option)
+        else:
+            self.widget_states[radio.id] = WidgetState(id=radio.id, int_value=list(radio.options).index(option))
+        return None
+
+    def set_date_interval(self, label, start_date, end_date):
+        """
+        Sets the interval of a date_input of the last run.
+
+        Args:
+            label (str): The label of the date_input.
+            start_date (datetime.date): The first date of the interval.
+            end_date (datetime.date): The last date of the interval.
+
+        Returns:
+            None
+        """
+        date_input = self.widgets[label][0]
+        dates = [start_date.strftime(WIDGET_DATE_FORMAT), end_date.strftime(WIDGET_DATE_FORMAT)]
+        self.widget_states[date_input.id] = WidgetState(id=date_input.id, string_array_value={'data': dates})
+        return None
+
+    def fetch(self, path):
+        """
+        Downloads a file served by the server, as the browser does after a download button.
+
+        Args:
+            path (str): The path of the file (the url of the download button).
+
+        Returns:
+            int: The number of bytes downloaded.
+        """
+        with urllib.request.urlopen(self.base_url + path, timeout=self.timeout) as response:
+            return len(response.read())
+
+async def run_step(session, step, action, results):
+    """
+    Runs and times a step of a session.
+
+    Args:
+        session (OperatorSession): The session.
+        step (str): The name of the step.
+        action (coroutine): The step, returning whether it succeeded.
+        results (list): The results, where the step is appended.
+
+    Returns:
+        bool: True if the step succeeded.
+    """
+    start_time = time.perf_counter()
+    try:
+        successful = await action
+    except (asyncio.TimeoutError, websockets.exceptions.WebSocketException, urllib.error.URLError, KeyError, ValueError, OSError):
+        successful = False
+    results.append({'step': step, 'seconds': time.perf_counter() - start_time, 'successful': successful})
+    return successful
+
+async def export_variable(session):
+    """
+    Clicks the download button of a variable and downloads its CSV.
+
+    Args:
+        session (OperatorSession): The session.
+
+    Returns:
+        bool: True if the rerun succeeded and the file was downloaded.
+    """
+    download_button = random.choice(session.widgets[EXPORT_LABEL])
+    if not await session.rerun(trigger_id=download_button.id):
+        return False
+    await asyncio.to_thread(session.fetch, download_button.url)
+    return True
+
+async def set_radio_and_rerun(session, label, option):
+    session.set_radio(label, option)
+    return await session.rerun()
+
+async def select_random_spot_and_rerun(session):
+    # The options are read when the step runs, so a page without the selector fails the step
+    return await set_radio_and_rerun(session, SPOT_SELECTOR_LABEL, random.choice(list(session.widgets[SPOT_SELECTOR_LABEL][0].options)))
+
+async def set_date_interval_and_rerun(session, custom_days):
+    # The bounds come as YYYY/MM/DD from older Streamlit versions, YYYY-MM-DD from newer ones
+    max_date = datetime.strptime(session.widgets[DATE_INTERVAL_LABEL][0].max.replace('-', '/'), WIDGET_DATE_FORMAT).date()
+    end_date = max_date - timedelta(days=random.randint(0, custom_days))
+    session.set_date_interval(DATE_INTERVAL_LABEL, end_date - timedelta(days=random.randint(1, custom_days)), end_date)
+    return await session.rerun()
+
+async def run_session(base_url, rounds, think_seconds, custom_days, timeout, results, query_string=''):
+    """
+    Runs the rounds of an operator session.
+
+    A failed step ends the round, since the widgets of the next steps may be missing.
+
+    Args:
+        base_url (str): The address of the server.
+        rounds (int): The number of rounds.
+        think_seconds (float): The most seconds an operator waits between two steps.
+        custom_days (int): The most days of a custom range, and how far back it may end.
+        timeout (float): The most seconds a rerun may take.
+        results (list): The results, where each step is appended.
+        query_string (str): The query string of the page URL, without '?'.
+
+    Returns:
+        None
+    """
+    session = OperatorSession(base_url, timeout, query_string)
+    try:
+        await session.connect()
+        for _ in range(rounds):
+            steps = [('open', lambda: session.rerun()),
+                     ('spot', lambda: select_random_spot_and_rerun(session)),
+                     ('custom', lambda: set_radio_and_rerun(session, TIME_INTERVAL_LABEL, CUSTOM_INTERVAL_OPTION)),
+                     ('range', lambda: set_date_interval_and_rerun(session, custom_days)),
+                     ('export', lambda: export_variable(session)),
+                     ('24h', lambda: set_radio_and_rerun(session, TIME_INTERVAL_LABEL, LAST_24_HOURS_OPTION))]
+            for step, action in steps:
+                if not await run_step(session, step, action(), results):
+                    break
+                await asyncio.sleep(random.uniform(0, think_seconds))
+    except (websockets.exceptions.WebSocketException, OSError):
+        results.append({'step': 'connect', 'seconds': 0.0, 'successful': False})
+    finally:
+        await session.close()
+    return None
+
+def query_database_connections():
+    """
+    Constructs the SQL query that counts the connections to the current database, but its own.
+
+    Returns:
+        str: The SQL query, with the 'connections' and the 'active' ones.
+    """
+    return """SELECT count(*) AS connections, count(*) FILTER (WHERE state = 'active') AS active
+              FROM pg_stat_activity
+              WHERE datname = current_database() AND pid <> pg_backend_pid();"""
+
+def sample_server(server_process, connection):
+    """
+    Measures the RSS of the server and the connections to the database.
+
+    Args:
+        server_process (psutil.Process): The server.
+        connection (sqlalchemy.engine.Connection): The connection of the sampler.
+
+    Returns:
+        dict: The 'rss_mb', 'connections' and 'active' connections.
+    """
+    connections, active = connection.execute(sqlalchemy.text(query_database_connections())).one()
+    return {'rss_mb': server_process.memory_info().rss / 2**20, 'connections': connections, 'active': active}
+
+async def sample_while(server_process, engine, sample_seconds, samples, stop_event):
+    """
+    Samples the server until a level ends.
+
+    Args:
+        server_process (psutil.Process): The server.
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        sample_seconds (float): The seconds between two samples.
+        samples (list): The samples, where each one is appended.
+        stop_event (asyncio.Event): Set when the level ends.
+
+    Returns:
+        None
+    """
+    with engine.connect() as connection:
+        while not stop_event.is_set():
+            samples.append(await asyncio.to_thread(sample_server, server_process, connection))
+            connection.commit()
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=sample_seconds)
+            except asyncio.TimeoutError:
+                pass
+    return None
+
+async def run_level(base_url, server_process, engine, sessions, args):
+    """
+    Runs a level of concurrent sessions.
+
+    Args:
+        base_url (str): The address of the server.
+        server_process (psutil.Process): The server.
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        sessions (int): The number of concurrent sessions.
+        args (argparse.Namespace): The options of the load test.
+
+    Returns:
+        dict: The summary of the level.
+        DataFrame: The steps run, with their 'step', 'seconds' and 'successful'.
+    """
+    results, samples = [], []
+    stop_event = asyncio.Event()
+    sampler = asyncio.create_task(sample_while(server_process, engine, args.sample_seconds, samples, stop_event))
+    start_time = time.perf_counter()
+    await asyncio.gather(*(run_session(base_url, args.rounds, args.think_seconds, args.custom_days, args.timeout, results,
+                                       query_string=args.query_strings[index % len(args.query_strings)])
+                           for index in range(sessions)))
+    elapsed_time = time.perf_counter() - start_time
+    stop_event.set()
+    await sampler
+
+    steps_df = pd.DataFrame(results, columns=['step', 'seconds', 'successful'])
+    samples_df = pd.DataFrame(samples, columns=['rss_mb', 'connections', 'active'])
+    successful_seconds = steps_df.loc[steps_df['successful'], 'seconds']
+    summary = {'sessions': sessions,
+               'steps': len(steps_df),
+               'errors': int((~steps_df['successful']).sum()),
+               'error_rate': (~steps_df['successful']).mean() if len(steps_df) else 1.0,
+               'steps_per_s': len(successful_seconds) / elapsed_time,
+               'p50_s': successful_seconds.quantile(0.5),
+               'p95_s': successful_seconds.quantile(0.95),
+               'max_s': successful_seconds.max(),
+               'db_connections': samples_df['connections'].max(),
+               'db_active': samples_df['active'].max(),
+               'rss_mb': samples_df['rss_mb'].max()}
+    summary['failed'] = bool(summary['error_rate'] > args.max_error_rate or not summary['p95_s'] <= args.max_p95_seconds)
+    return summary, steps_df.assign(sessions=sessions)
+
+def start_server(script, port):
+    """
+    Starts the dashboard in a headless Streamlit server.
+
+    Args:
+        script (str): The path of the script, from the repository root.
+        port (int): The port of the server.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    command = [sys.executable, '-m', 'streamlit', 'run', script,
+               '--server.headless', 'true',
+               '--server.port', str(port),
+               '--server.enableXsrfProtection', 'false',
+               '--server.fileWatcherType', 'none',
+               '--browser.gatherUsageStats', 'false']
+    return subprocess.Popen(command, cwd=REPOSITORY_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_until_healthy(base_url, server, timeout):
+    """
+    Waits for the server to answer its health check.
+
+    Args:
+        base_url (str): The address of the server.
+        server (subprocess.Popen): The server process.
+        timeout (float): The most seconds to wait.
+
+    Returns:
+        None
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'The server exited with code {server.returncode}.')
+        try:
+            with urllib.request.urlopen(base_url + '/_stcore/health', timeout=1):
+                return None
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f'The server did not answer in {timeout} s.')
+
+async def run_load_test(base_url, server, engine, levels, args):
+    """
+    Runs the levels one after the other, after a warm-up session.
+
+    Returns:
+        DataFrame: The summary of each level.
+        DataFrame: The steps of every level.
+    """
+    server_process = psutil.Process(server.pid)
+    # One unmeasured session per client loads the modules and the connection pools of the server
+    for query_string in args.query_strings:
+        warm_up_results = []
+        await run_session(base_url, 1, 0, args.custom_days, args.timeout, warm_up_results, query_string=query_string)
+        if not all(result['successful'] for result in warm_up_results):
+            print(f"The warm-up session with query string {query_string!r} failed: with tenants.toml, give "
+                  "--query-string 'cliente=<slug>&token=<token>'.", flush=True)
+    summaries, steps = [], []
+    for sessions in levels:
+        summary, steps_df = await run_level(base_url, server_process, engine, sessions, args)
+        summaries.append(summary)
+        steps.append(steps_df)
+        print(f'{sessions} sessions: {summary["steps"]} steps, {summary["errors"]} errors, '
+              f'p95 {summary["p95_s"]:.2f} s, {summary["db_connections"]} connections, {summary["rss_mb"]:.0f} MB', flush=True)
+        if summary['failed'] and not args.keep_going:
+            break
+    return pd.DataFrame(summaries), pd.concat(steps, ignore_index=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the dashboard with concurrent operator sessions.')
+    parser.add_argument('--url', default=None, help='Database URL sampled (defaults to ACODATA_DATABASE_URL or secrets.toml).')
+    parser.add_argument('--script', default='app.py', help='The Streamlit script served (default app.py).')
+    parser.add_argument('--port', type=int, default=8599, help='Port of the server started.')
+    parser.add_argument('--sessions', default='1,2,4,8,16', help='Concurrent sessions of each level, comma separated.')
+    parser.add_argument('--rounds', type=int, default=3, help='Rounds of the operator script per session.')
+    parser.add_argument('--think-seconds', type=float, default=1.0, help='Most seconds an operator waits between two steps.')
+    parser.add_argument('--custom-days', type=int, default=7, help='Most days of a custom range, and how far back it may end.')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Most seconds a rerun may take before it counts as failed.')
+    parser.add_argument('--sample-seconds', type=float, default=0.5, help='Seconds between two samples of the server.')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Error rate above which a level fails.')
+    parser.add_argument('--max-p95-seconds', type=float, default=10.0, help='p95 rerun latency above which a level fails.')
+    parser.add_argument('--keep-going', action='store_true', help='Run the next levels after a level fails.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the choices of the sessions.')
+    parser.add_argument('--query-string', action='append', default=None,
+                        help="Query string of the sessions, e.g. 'cliente=<slug>&token=<token>'; repeat it to spread them over clients.")
+    args = parser.parse_args()
+    args.query_strings = [query_string.lstrip('?') for query_string in args.query_string] if args.query_string else ['']
+
+    random.seed(args.seed)
+    levels = [int(sessions) for sessions in args.sessions.split(',')]
+    base_url = f'http://localhost:{args.port}'
+    engine = database.create_engine(url=args.url, pool_size=1)
+    server = start_server(args.script, args.port)
+    try:
+        wait_until_healthy(base_url, server, timeout=60)
+        summary_df, steps_df = asyncio.run(run_load_test(base_url, server, engine, levels, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    pd.set_option('display.width', 200)
+    print('\nLevels (latency of the successful steps, peaks of the samples):')
+    print(summary_df.to_string(index=False, float_format='{:.2f}'.format))
+    print('\np95 seconds per step:')
+    step_p95_df = steps_df[steps_df['successful']].pivot_table(index='sessions', columns='step', values='seconds',
+                                                               aggfunc=lambda seconds: seconds.quantile(0.95))
+    print(step_p95_df.to_string(float_format='{:.2f}'.format))
+
+    failed_df = summary_df[summary_df['failed']]
+    if failed_df.empty:
+        print(f'\nHeld up to {summary_df["sessions"].max()} concurrent sessions.')
+    else:
+        failed = failed_df.iloc[0]
+        print(f'\nFalls over at {failed["sessions"]} concurrent sessions '
+              f'(error rate {failed["error_rate"]:.1%}, p95 {failed["p95_s"]:.2f} s).')
+
+
+if __name__ == '__main__':
+    main()
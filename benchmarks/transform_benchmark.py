@@ -0,0 +1,371 @@
+"""
+Micro-benchmarks of the data transforms that run on every rerun, with a baseline and regression gates.
+
+Usage (from the repository root):
+    python -m benchmarks.transform_benchmark [--rows 1000,10000,100000,1000000,10000000] [--columns 1,10,50]
+                                             [--save-baseline] [--tolerance 0.25]
+
+Each function runs over synthetic frames shaped like the dashboard's: the value columns of a
+variable followed by 'timestamp' (sampled every second), and the one-row last records with their
+alarms. The functions of a whole interval run over every --rows by --columns shape, up to
+--max-cells values; the functions of a single last record only depend on the number of columns.
+A case is timed several times (the fastest run is kept, the least disturbed by the rest of the
+machine), then run once more under tracemalloc for its peak memory.
+
+--save-baseline writes the results to --baseline. Otherwise they are compared with it: a case
+regresses when its time grows by more than --tolerance (and --min-delta-seconds) or its peak
+memory by more than --memory-tolerance (and 1 MB). A regressed case is timed again up to
+--confirm-runs times, keeping its fastest time, before the command exits with status 1, so a
+moment of load on the machine does not fail the gate. Without a baseline the command exits
+with status 2 before running anything, so a checkout without one never passes as no regression;
+--allow-missing-baseline only prints the results instead. No database is needed.
+
+Timings depend on the machine and on the numpy, pandas and plotly versions, so no baseline is
+committed: record it on the machine that runs the gate, with the pinned requirements installed,
+before the change to be measured:
+    python -m benchmarks.transform_benchmark --save-baseline
+Baselines are kept in benchmarks/baselines/, which git ignores.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import plotly
+import streamlit  # noqa: F401  Registers the Streamlit plotly theme as the default template, as in the dashboard
+
+from functions.content import last_record_chart_builder, time_series_plot_builder
+from functions.data import forecasting
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'transform_baseline.json')
+
+START_TIMESTAMP = 1_700_000_000
+ALARM_ALERT = 6.0
+ALARM_CRITICAL = 8.0
+
+
+def make_value_columns(columns):
+    """
+    Names the value columns of a synthetic variable as the tables do.
+
+    Args:
+        columns (int): The number of value columns.
+
+    Returns:
+        list: The names of the columns.
+    """
+    return [f'value_{column}' for column in range(columns)]
+
+def make_interval_df(rows, columns, seed=0):
+    """
+    Creates the raw rows of an interval, as read from a spot variable table.
+
+    Args:
+        rows (int): The number of rows.
+        columns (int): The number of value columns.
+        seed (int): The seed of the random values.
+
+    Returns:
+        DataFrame: The value columns followed by 'timestamp', in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.random((rows, columns)) * 10, columns=make_value_columns(columns))
+    df['timestamp'] = START_TIMESTAMP + np.arange(rows, dtype='int64')
+    return df
+
+def make_text_alias_df(columns):
+    """
+    Creates the text aliases of the value columns, among those of other variables.
+
+    Args:
+        columns (int): The number of value columns.
+
+    Returns:
+        DataFrame: The 'old_name' and 'new_name' of each alias.
+    """
+    old_names = make_value_columns(columns) + [f'other_{alias}' for alias in range(100)]
+    return pd.DataFrame({'old_name': old_names[::-1], 'new_name': [f'Alias de {name}' for name in old_names[::-1]]})
+
+def setup_convert_timestamp_column(rows, columns):
+    return (make_interval_df(rows, columns),)
+
+def setup_clear_empty_columns(rows, columns):
+    df = make_interval_df(rows, columns)
+    # A third of the columns without any value, as columns of sensors that are not installed
+    df.iloc[:, :columns // 3] = np.nan
+    return (df,)
+
+def setup_plot_dataframe_lines(rows, columns):
+    df = time_series_plot_builder.convert_timestamp_column(make_interval_df(rows, columns))
+    return (df, 'Variável', ALARM_ALERT, ALARM_CRITICAL)
+
+def setup_get_new_names(rows, columns):
+    return (make_value_columns(columns), make_text_alias_df(columns))
+
+def make_last_record_df(columns):
+    df = make_interval_df(1, columns)
+    return df
+
+def setup_make_last_record_alarms_df(rows, columns):
+    variable_name_alarms_df = pd.DataFrame({'alias_name': ['Variável'], 'alarm_critical': [ALARM_CRITICAL], 'alarm_alert': [ALARM_ALERT]})
+    return (variable_name_alarms_df, make_last_record_df(columns))
+
+def setup_get_last_record_colors_list(rows, columns):
+    return (make_last_record_df(columns).iloc[0, :-1].tolist(), ALARM_CRITICAL, ALARM_ALERT)
+
+def setup_create_last_record_plot(rows, columns):
+    values = make_last_record_df(columns).iloc[0, :-1].tolist()
+    colors = last_record_chart_builder.get_last_record_colors_list(values, ALARM_CRITICAL, ALARM_ALERT)
+    return (values, make_value_columns(columns), colors, max(values + [ALARM_CRITICAL]), ALARM_ALERT, ALARM_CRITICAL)
+
+def setup_forecast_frames(rows, columns):
+    # The lookback rows of one variable, fitted with the default settings of the panel
+    return ({10: make_interval_df(rows, columns)}, {10: (ALARM_ALERT, ALARM_CRITICAL)}, 'linear', 30 * 86400, 30)
+
+# name: (function, setup(rows, columns) -> arguments, whether the size depends on the rows)
+CASES = {'convert_timestamp_column': (time_series_plot_builder.convert_timestamp_column, setup_convert_timestamp_column, True),
+         'clear_empty_columns': (time_series_plot_builder.clear_empty_columns, setup_clear_empty_columns, True),
+         'plot_dataframe_lines': (time_series_plot_builder.plot_dataframe_lines, setup_plot_dataframe_lines, True),
+         'time_series.get_new_names': (time_series_plot_builder.get_new_names, setup_get_new_names, False),
+         'last_record.get_new_names': (last_record_chart_builder.get_new_names, setup_get_new_names, False),
+         'make_last_record_alarms_df': (last_record_chart_builder.make_last_record_alarms_df, setup_make_last_record_alarms_df, False),
+         'get_last_record_colors_list': (last_record_chart_builder.get_last_record_colors_list, setup_get_last_record_colors_list, False),
+         'create_last_record_plot': (last_record_chart_builder.create_last_record_plot, setup_create_last_record_plot, False),
+         'forecast_frames': (forecasting.forecast_frames, setup_forecast_frames, True)}
+
+
+def list_shapes(depends_on_rows, rows_list, columns_list, max_cells):
+    """
+    Lists the shapes a case runs over.
+
+    Args:
+        depends_on_rows (bool): Whether the case runs over frames of many rows.
+        rows_list (list): The numbers of rows.
+        columns_list (list): The numbers of value columns.
+        max_cells (int): The most values of a frame.
+
+    Returns:
+        list: Tuples (rows, columns).
+    """
+    if not depends_on_rows:
+        return [(1, columns) for columns in columns_list]
+    return [(rows, columns) for rows in rows_list for columns in columns_list if rows * columns <= max_cells]
+
+def time_case(function, setup, rows, columns, repeat, max_seconds):
+    """
+    Times a function on fresh arguments, and measures its peak memory.
+
+    Args:
+        function (callable): The function.
+        setup (callable): Builds the arguments of a call from the shape.
+        rows (int): The number of rows.
+        columns (int): The number of value columns.
+        repeat (int): The most timed calls.
+        max_seconds (float): The timed calls stop once they took this long in total.
+
+    Returns:
+        dict: The fastest and median 'seconds' of the calls, their number and the 'peak_mb' of a call.
+    """
+    timings = []
+    while len(timings) < repeat and sum(timings) < max_seconds:
+        # Some functions change their arguments, so every call gets its own
+        arguments = setup(rows, columns)
+        start_time = time.perf_counter()
+        function(*arguments)
+        timings.append(time.perf_counter() - start_time)
+        del arguments
+
+    arguments = setup(rows, columns)
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(timings),
+            'median_seconds': float(np.median(timings)),
+            'calls': len(timings),
+            'peak_mb': peak_bytes / 2**20}
+
+def run_cases(case_names, rows_list, columns_list, max_cells, repeat, max_seconds):
+    """
+    Runs every case over its shapes.
+
+    Returns:
+        DataFrame: One row per case and shape, with its 'case', 'rows', 'columns' and measures.
+    """
+    results = []
+    for case_name in case_names:
+        function, setup, depends_on_rows = CASES[case_name]
+        for rows, columns in list_shapes(depends_on_rows, rows_list, columns_list, max_cells):
+            result = time_case(function, setup, rows, columns, repeat, max_seconds)
+            results.append({'case': case_name, 'rows': rows, 'columns': columns, **result})
+            print(f'{case_name} {rows}x{columns}: {result["seconds"] * 1000:.3f} ms, {result["peak_mb"]:.1f} MB', flush=True)
+    return pd.DataFrame(results, columns=['case', 'rows', 'columns', 'seconds', 'median_seconds', 'calls', 'peak_mb'])
+
+def get_environment():
+    """
+    Describes the machine and the versions the timings were taken with.
+
+    Returns:
+        dict: The environment.
+    """
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plotly': plotly.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+def save_baseline(results_df, path):
+    """
+    Writes the results as the baseline.
+
+    Args:
+        results_df (DataFrame): The result of run_cases.
+        path (str): The path of the baseline file.
+
+    Returns:
+        None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = {'environment': get_environment(),
+                'results': results_df[['case', 'rows', 'columns', 'seconds', 'peak_mb']].to_dict(orient='records')}
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump(baseline, baseline_file, indent=1)
+    return None
+
+def load_baseline(path):
+    """
+    Reads a baseline file.
+
+    Args:
+        path (str): The path of the baseline file.
+
+    Returns:
+        dict: The 'environment' of the baseline.
+        DataFrame: Its results.
+    """
+    with open(path, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    return baseline['environment'], pd.DataFrame(baseline['results'])
+
+def compare_with_baseline(results_df, baseline_df, tolerance, memory_tolerance, min_delta_seconds):
+    """
+    Flags the cases slower or heavier than in the baseline, past the tolerances.
+
+    Args:
+        results_df (DataFrame): The result of run_cases.
+        baseline_df (DataFrame): The results of the baseline.
+        tolerance (float): The relative time increase allowed.
+        memory_tolerance (float): The relative peak memory increase allowed.
+        min_delta_seconds (float): Time increases below this are never regressions (timer noise).
+
+    Returns:
+        DataFrame: The results with the 'baseline_seconds', 'time_change', 'baseline_peak_mb' and
+        'memory_change' of the shapes in the baseline, and whether they 'regressed'.
+    """
+    compared_df = results_df.merge(baseline_df.rename(columns={'seconds': 'baseline_seconds', 'peak_mb': 'baseline_peak_mb'}),
+                                   on=['case', 'rows', 'columns'], how='left')
+    compared_df['time_change'] = compared_df['seconds'] / compared_df['baseline_seconds'] - 1
+    compared_df['memory_change'] = compared_df['peak_mb'] / compared_df['baseline_peak_mb'] - 1
+    slower = ((compared_df['time_change'] > tolerance)
+              & (compared_df['seconds'] - compared_df['baseline_seconds'] > min_delta_seconds))
+    heavier = ((compared_df['memory_change'] > memory_tolerance)
+               & (compared_df['peak_mb'] - compared_df['baseline_peak_mb'] > 1))
+    compared_df['regressed'] = slower | heavier
+    return compared_df
+
+def confirm_regressions(results_df, baseline_df, confirm_runs, repeat, max_seconds, **tolerances):
+    """
+    Times the regressed cases again, keeping their fastest time, so a disturbed run does not fail the gate.
+
+    Args:
+        results_df (DataFrame): The result of run_cases.
+        baseline_df (DataFrame): The results of the baseline.
+        confirm_runs (int): The most new runs of a regressed case.
+        repeat (int): The most timed calls per run.
+        max_seconds (float): The timed calls of a run stop after this long.
+        **tolerances: The tolerances of compare_with_baseline.
+
+    Returns:
+        DataFrame: The comparison of the results, with the new times of the regressed cases.
+    """
+    compared_df = compare_with_baseline(results_df, baseline_df, **tolerances)
+    for _ in range(confirm_runs):
+        regressed_df = compared_df[compared_df['regressed']]
+        if regressed_df.empty:
+            break
+        for index, case in regressed_df.iterrows():
+            function, setup, _ = CASES[case['case']]
+            result = time_case(function, setup, case['rows'], case['columns'], repeat, max_seconds)
+            results_df.loc[index, 'seconds'] = min(results_df.loc[index, 'seconds'], result['seconds'])
+            results_df.loc[index, 'peak_mb'] = min(results_df.loc[index, 'peak_mb'], result['peak_mb'])
+        compared_df = compare_with_baseline(results_df, baseline_df, **tolerances)
+    return compared_df
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the data transforms, with regression gates.')
+    parser.add_argument('--rows', default='1000,10000,100000,1000000,10000000', help='Rows of the interval frames, comma separated.')
+    parser.add_argument('--columns', default='1,10,50', help='Value columns of the frames, comma separated.')
+    parser.add_argument('--max-cells', type=int, default=20_000_000, help='Most values of an interval frame (rows x columns).')
+    parser.add_argument('--cases', default=','.join(CASES), help='Cases run, comma separated.')
+    parser.add_argument('--repeat', type=int, default=20, help='Most timed calls per case and shape.')
+    parser.add_argument('--max-seconds', type=float, default=2.0, help='Timed calls of a case and shape stop after this long.')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='The baseline file.')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the baseline instead of comparing.')
+    parser.add_argument('--allow-missing-baseline', action='store_true', help='Print the results instead of failing when there is no baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative time increase allowed.')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help='Relative peak memory increase allowed.')
+    parser.add_argument('--min-delta-seconds', type=float, default=0.001, help='Time increases below this are ignored.')
+    parser.add_argument('--confirm-runs', type=int, default=3, help='Most new runs of a regressed case before it fails the gate.')
+    args = parser.parse_args()
+
+    baseline_missing = not args.save_baseline and not os.path.exists(args.baseline)
+    if baseline_missing and not args.allow_missing_baseline:
+        print(f'No baseline at {args.baseline}: run with --save-baseline on this machine first, before the change.')
+        sys.exit(2)
+
+    results_df = run_cases(case_names=args.cases.split(','),
+                           rows_list=[int(rows) for rows in args.rows.split(',')],
+                           columns_list=[int(columns) for columns in args.columns.split(',')],
+                           max_cells=args.max_cells,
+                           repeat=args.repeat,
+                           max_seconds=args.max_seconds)
+    pd.set_option('display.width', 200)
+
+    if args.save_baseline:
+        save_baseline(results_df, args.baseline)
+        print(f'\nBaseline of {len(results_df)} cases written to {args.baseline}')
+        return None
+
+    if baseline_missing:
+        print(f'\nNo baseline at {args.baseline}: nothing compared (--allow-missing-baseline).')
+        return None
+    environment, baseline_df = load_baseline(args.baseline)
+    if environment != get_environment():
+        print(f'\nThe baseline was taken on another environment, timings may not compare: {environment}')
+    compared_df = confirm_regressions(results_df, baseline_df, args.confirm_runs, args.repeat, args.max_seconds,
+                                      tolerance=args.tolerance,
+                                      memory_tolerance=args.memory_tolerance,
+                                      min_delta_seconds=args.min_delta_seconds)
+    print('\nCompared with the baseline:')
+    print(compared_df[['case', 'rows', 'columns', 'seconds', 'baseline_seconds', 'time_change',
+                       'peak_mb', 'baseline_peak_mb', 'memory_change', 'regressed']]
+          .to_string(index=False, float_format='{:.4g}'.format))
+    regressed_df = compared_df[compared_df['regressed']]
+    if not regressed_df.empty:
+        print(f'\n{len(regressed_df)} cases regressed past the tolerance.')
+        sys.exit(1)
+    print('\nNo regression.')
+    return None
+
+
+if __name__ == '__main__':
+    main()
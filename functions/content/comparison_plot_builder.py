@@ -0,0 +1,330 @@
+"""
+Comparison of several series on one chart: the same variable across spots, or several variables of a spot.
+
+Spots sample at their own instants, so the series are aligned on a common time grid by the
+database: each series is averaged into the same buckets, all of them in one UNION ALL query,
+and the buckets are spread into one column per series with a single pivot. The bucket width
+keeps the whole chart within the row budget, so ten spots over weeks stay interactive.
+"""
+import streamlit as st
+from datetime import datetime, timedelta
+import numpy as np
+
+from functions.content import figure_factory, figure_payload, time_series_plot_builder
+from functions.data import query_budget, query_context, settings
+from functions.monitoring import tracing
+
+
+def query_spots_and_variables():
+    """
+    Constructs the SQL query that lists the variables of every spot, with their aliases and thresholds.
+
+    Returns:
+        str: The SQL query.
+    """
+    query = """SELECT alias_variables.spot_id, alias_spots.alias AS spot_alias, alias_variables.global_data_id,
+                      alias_variables.alias_name, alias_variables.alarm_alert, alias_variables.alarm_critical
+               FROM alias_variables
+               JOIN alias_spots ON alias_spots.spot_id = alias_variables.spot_id
+               ORDER BY alias_variables.spot_id, alias_variables.global_data_id;"""
+    return query
+
+def query_common_columns(tables):
+    """
+    Constructs the SQL query that lists the value columns of several spot variable tables.
+
+    Args:
+        tables (list): The names of the tables.
+
+    Returns:
+        str: The SQL query.
+    """
+    table_names = ', '.join(f"'{table}'" for table in tables)
+    query = f"""SELECT table_name, column_name
+                FROM information_schema.columns
+                WHERE table_name IN ({table_names})
+                  AND column_name <> 'timestamp'
+                ORDER BY ordinal_position;"""
+    return query
+
+def query_aligned_series(series, start_timestamp, end_timestamp, bucket_seconds):
+    """
+    Constructs one SQL query that averages every series into the same time buckets.
+
+    Args:
+        series (list): The (spot_id, global_data_id, column) of each series.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        bucket_seconds (int): The width of each bucket in seconds.
+
+    Returns:
+        str: The SQL query, with one row per (series index, bucket start timestamp, average value).
+    """
+    bucket = f'(timestamp / {int(bucket_seconds)}) * {int(bucket_seconds)}'
+    selects = [f"""SELECT {index} AS series, {bucket} AS timestamp, AVG("{column}") AS value
+                   FROM spot_{spot_id}_var_{global_data_id}
+                   WHERE timestamp >= {start_timestamp}
+                     AND timestamp < {end_timestamp}
+                   GROUP BY {bucket}"""
+               for index, (spot_id, global_data_id, column) in enumerate(series)]
+    return '\nUNION ALL\n'.join(selects)
+
+def choose_comparison_bucket_seconds(start_timestamp, end_timestamp, n_series):
+    """
+    Chooses the bucket width of a comparison, sharing the row budget between its series.
+
+    Args:
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        n_series (int): The number of series compared.
+
+    Returns:
+        int: The bucket width in seconds.
+    """
+    return query_budget.choose_bucket_seconds(start_timestamp, end_timestamp,
+                                              row_budget=settings.ROW_BUDGET // max(n_series, 1))
+
+def make_unique_labels(labels, series_ids):
+    """
+    Suffixes the ID of the series to the labels shared by several series, so every series keeps its own column.
+
+    Args:
+        labels (list): The label of each series (spot or variable alias).
+        series_ids (list): The ID of each series (spot_id or global_data_id), in the same order.
+
+    Returns:
+        list: The labels, with ' (<id>)' appended to the ones that are not unique.
+    """
+    return [f'{label} ({series_id})' if labels.count(label) > 1 else label
+            for label, series_id in zip(labels, series_ids)]
+
+def align_series(long_df, labels, start_timestamp, end_timestamp, bucket_seconds):
+    """
+    Spreads the buckets of every series onto the common time grid, one column per series.
+
+    Buckets without samples stay empty, so gaps are drawn as gaps.
+
+    Args:
+        long_df (pandas.DataFrame): The rows of query_aligned_series, with 'series', 'timestamp' and 'value'.
+        labels (list): The unique label of each series, in series index order.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        bucket_seconds (int): The width of each bucket in seconds.
+
+    Returns:
+        pandas.DataFrame: One column per series label, then 'timestamp' (bucket start), one row per bucket.
+    """
+    grid = np.arange((start_timestamp // bucket_seconds) * bucket_seconds, end_timestamp, bucket_seconds, dtype='int64')
+    aligned_df = (long_df.pivot(index='timestamp', columns='series', values='value')
+                         .reindex(index=grid, columns=range(len(labels))))
+    aligned_df.columns = labels
+    aligned_df = aligned_df.rename_axis(index='timestamp', columns=None).reset_index()
+    return aligned_df[labels + ['timestamp']]
+
+@tracing.traced('query')
+def get_aligned_df(conn, series, labels, start_timestamp, end_timestamp):
+    """
+    Retrieves several series aligned on a common time grid, in one query.
+
+    Args:
+        conn: The database connection object.
+        series (list): The (spot_id, global_data_id, column) of each series.
+        labels (list): The label of each series.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        pandas.DataFrame: One column per series label, then 'timestamp'.
+        int: The bucket width in seconds.
+    """
+    bucket_seconds = choose_comparison_bucket_seconds(start_timestamp, end_timestamp, len(series))
+    query = query_aligned_series(series, start_timestamp, end_timestamp, bucket_seconds)
+    long_df = query_context.route_historical(conn).query(query)
+    return align_series(long_df, labels, start_timestamp, end_timestamp, bucket_seconds), bucket_seconds
+
+def get_common_columns(conn, tables):
+    """
+    Returns the value columns present in every one of several spot variable tables, in table order.
+
+    Args:
+        conn: The database connection object.
+        tables (list): The names of the tables.
+
+    Returns:
+        list: The column names.
+    """
+    columns_df = conn.query(query_common_columns(tables))
+    counts = columns_df.groupby('column_name', sort=False)['table_name'].nunique()
+    return [column for column, count in counts.items() if count == len(set(tables))]
+
+@tracing.traced('figure')
+def plot_comparison_lines(df, title, alarm_alert=None, alarm_critical=None):
+    """
+    Creates the comparison chart, one line per series.
+
+    Args:
+        df (pandas.DataFrame): The aligned series, with the datetime 'timestamp' column last.
+        title (str): The title of the chart.
+        alarm_alert (float): The alert threshold shared by every series, or None.
+        alarm_critical (float): The critical threshold shared by every series, or None.
+
+    Returns:
+        plotly.graph_objects.Figure: The chart.
+    """
+    x_values = df['timestamp'].to_numpy()
+    shapes = []
+    if alarm_alert is not None and alarm_critical is not None and len(df):
+        x_min, x_max = df['timestamp'].min(), df['timestamp'].max()
+        shapes = [{'x0': x_min, 'x1': x_max, 'y0': alarm_alert, 'y1': alarm_alert,
+                   'name': f'Linha Constante ({alarm_alert})'},
+                  {'x0': x_min, 'x1': x_max, 'y0': alarm_critical, 'y1': alarm_critical,
+                   'name': f'Linha Constante ({alarm_critical})'}]
+    fig = figure_factory.stamp_figure(
+        'time_series',
+        traces=[{'x': x_values,
+                 'y': df[label].to_numpy(dtype='float64', na_value=np.nan),
+                 'name': label,
+                 'legendgroup': label} for label in df.columns[:-1]],
+        shapes=shapes,
+        layout={'title': {'text': title},
+                'yaxis': {'title': {'text': title}},
+                'height': 450})
+    return figure_payload.compact_figure(fig)
+
+def get_shared_thresholds(variables_df):
+    """
+    Returns the alarm thresholds of a comparison when every series has the same ones.
+
+    Args:
+        variables_df (pandas.DataFrame): The rows of the compared variables, with 'alarm_alert' and 'alarm_critical'.
+
+    Returns:
+        float: The alert threshold, or None if the series differ.
+        float: The critical threshold, or None if the series differ.
+    """
+    if variables_df['alarm_alert'].nunique() == 1 and variables_df['alarm_critical'].nunique() == 1:
+        return variables_df['alarm_alert'].iloc[0], variables_df['alarm_critical'].iloc[0]
+    return None, None
+
+def get_date_interval(column, n_days_ago):
+    """
+    Displays the date interval selector of the comparison.
+
+    Args:
+        column (streamlit.delta_generator.DeltaGenerator): The Streamlit column of the selector.
+        n_days_ago (int): The length in days of the default interval, ending today.
+
+    Returns:
+        int: The start timestamp of the interval.
+        int: The end timestamp of the interval (exclusive), or None while only one date is picked.
+    """
+    today = datetime.now().date()
+    with column:
+        date_interval = st.date_input(label="Intervalo entre datas",
+                                      value=(today - timedelta(days=n_days_ago), today),
+                                      max_value=today)
+    if len(date_interval) < 2:
+        return None, None
+    return time_series_plot_builder.get_timestamps_for_query(date_interval=date_interval,
+                                                             last_record_timestamp_int=None)
+
+@tracing.traced('builder')
+def show_comparison(column, conn):
+    """
+    Displays the comparison selectors and chart: one variable across spots, or several variables of a spot.
+
+    Args:
+        column (streamlit.delta_generator.DeltaGenerator): The Streamlit column of the comparison.
+        conn: The database connection object.
+
+    Returns:
+        None
+    """
+    catalog_df = conn.query(query_spots_and_variables())
+    text_alias_df = time_series_plot_builder.get_text_alias_df(conn=conn)
+    axis_aliases = dict(zip(text_alias_df['old_name'], text_alias_df['new_name']))
+
+    with column:
+        mode = st.radio(label="Comparar",
+                        options=("Mesma variável em vários pontos", "Várias variáveis de um ponto"),
+                        horizontal=True)
+        col_selection, col_axis, col_dates = st.columns([3, 1, 2])
+
+        if mode == "Mesma variável em vários pontos":
+            variable_names = catalog_df.drop_duplicates('global_data_id').set_index('global_data_id')['alias_name']
+            with col_selection:
+                global_data_id = st.selectbox(label="Variável",
+                                              options=variable_names.index.tolist(),
+                                              format_func=lambda option: variable_names[option])
+                variable_df = catalog_df[catalog_df['global_data_id'] == global_data_id]
+                spot_aliases = variable_df.set_index('spot_id')['spot_alias']
+                spot_ids = st.multiselect(label="Pontos",
+                                          options=spot_aliases.index.tolist(),
+                                          default=spot_aliases.index.tolist(),
+                                          format_func=lambda option: spot_aliases[option])
+            selected_df = variable_df[variable_df['spot_id'].isin(spot_ids)]
+            labels = make_unique_labels(selected_df['spot_alias'].tolist(), selected_df['spot_id'].tolist())
+            title = variable_names[global_data_id]
+        else:
+            spot_aliases = catalog_df.drop_duplicates('spot_id').set_index('spot_id')['spot_alias']
+            with col_selection:
+                spot_id = st.selectbox(label="Ponto",
+                                       options=spot_aliases.index.tolist(),
+                                       format_func=lambda option: spot_aliases[option])
+                spot_df = catalog_df[catalog_df['spot_id'] == spot_id]
+                variable_names = spot_df.set_index('global_data_id')['alias_name']
+                global_data_ids = st.multiselect(label="Variáveis",
+                                                 options=variable_names.index.tolist(),
+                                                 default=variable_names.index.tolist(),
+                                                 format_func=lambda option: variable_names[option])
+            selected_df = spot_df[spot_df['global_data_id'].isin(global_data_ids)]
+            labels = make_unique_labels(selected_df['alias_name'].tolist(), selected_df['global_data_id'].tolist())
+            title = spot_aliases[spot_id]
+
+        if selected_df.empty:
+            st.info("Selecione ao menos uma série.")
+            return None
+
+        tables = [f'spot_{spot_id}_var_{global_data_id}'
+                  for spot_id, global_data_id in zip(selected_df['spot_id'], selected_df['global_data_id'])]
+        axis_columns = get_common_columns(conn=conn, tables=tables)
+        if not axis_columns:
+            st.info("As séries selecionadas não têm eixos em comum.")
+            return None
+        with col_axis:
+            axis_column = st.selectbox(label="Eixo",
+                                       options=axis_columns,
+                                       format_func=lambda option: axis_aliases.get(option, option))
+
+        start_timestamp, end_timestamp = get_date_interval(column=col_dates, n_days_ago=7)
+        if start_timestamp is None:
+            return None
+
+        series = [(spot_id, global_data_id, axis_column)
+                  for spot_id, global_data_id in zip(selected_df['spot_id'], selected_df['global_data_id'])]
+        aligned_df, bucket_seconds = get_aligned_df(conn=conn,
+                                                    series=series,
+                                                    labels=labels,
+                                                    start_timestamp=start_timestamp,
+                                                    end_timestamp=end_timestamp)
+        aligned_df = time_series_plot_builder.convert_timestamp_column(aligned_df)
+
+        alarm_alert, alarm_critical = get_shared_thresholds(selected_df)
+        fig = plot_comparison_lines(df=aligned_df,
+                                    title=f"{title} — {axis_aliases.get(axis_column, axis_column)}",
+                                    alarm_alert=alarm_alert,
+                                    alarm_critical=alarm_critical)
+        with tracing.span('st.plotly_chart', 'render'):
+            st.plotly_chart(fig, theme="streamlit", use_container_width=True,
+                            config=time_series_plot_builder.config_to_plot())
+        figure_payload.record_payload('comparison', fig)
+        st.caption(f"Séries alinhadas em {query_budget.format_resolution(bucket_seconds)}.")
+
+        with st.expander("Arquivo para Exportação", expanded=False):
+            aligned_df = aligned_df.rename(columns={'timestamp': axis_aliases.get('timestamp', 'timestamp')})
+            st.dataframe(aligned_df, use_container_width=True)
+            st.download_button(label="Baixar aquivo CSV",
+                               data=aligned_df.to_csv(index=False).encode('utf-8'),
+                               file_name=f'comparacao_{title}.csv',
+                               mime='text/csv')
+    return None
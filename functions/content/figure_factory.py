@@ -0,0 +1,158 @@
+"""
+Builds the figures of the dashboard from templates validated once per process.
+
+Creating a figure through go.Figure, plotly.express and update_layout validates every property
+on every call, which adds up across variables and reruns. Here each chart type is built and
+validated once, kept as a plain dict, and new figures are stamped from a copy of it with only the
+data arrays, the threshold shapes and a few layout fields swapped in. Stamped figures skip
+validation: their inputs come from the database and the templates, never from users.
+"""
+import copy
+
+import plotly.graph_objects as go
+
+from functions.content import figure_payload
+
+figure_templates = {}
+
+
+def build_line_template():
+    """
+    Builds the validated template of the per-variable time series.
+
+    Returns:
+        plotly.graph_objects.Figure: The template, with one line trace and the alert and critical threshold lines.
+    """
+    fig = go.Figure(go.Scatter(mode='lines', showlegend=True),
+                    layout=dict(template=figure_payload.get_layout_template()))
+    fig.add_shape(type='line', line=dict(color='orange', dash='dash'))
+    fig.add_shape(type='line', line=dict(color='red', dash='dash'))
+    fig.update_layout(xaxis_title='Data e Hora',
+                      xaxis_type='date',
+                      legend_title_text='',
+                      legend_tracegroupgap=0,
+                      margin=dict(t=60),
+                      height=250,
+                      hovermode='x unified')
+    return fig
+
+def build_last_record_template():
+    """
+    Builds the validated template of the last record bars.
+
+    Returns:
+        plotly.graph_objects.Figure: The template, with one horizontal bar trace and the alert and critical threshold lines.
+    """
+    fig = go.Figure(go.Bar(orientation='h',
+                           textposition='outside',
+                           insidetextanchor='end',
+                           textangle=0,
+                           texttemplate='%{text:.3f}'))
+    fig.add_vline(x=0, line_dash='dash', line_color='gold')
+    fig.add_vline(x=0, line_dash='dash', line_color='red')
+    fig.update_layout(showlegend=False,
+                      margin=dict(t=0, b=0),
+                      font=dict(size=16, color='black'),
+                      yaxis=dict(tickfont=dict(size=16, color='black')))
+    return fig
+
+def build_reliability_gauge_template():
+    """
+    Builds the validated template of the reliability gauge.
+
+    Returns:
+        plotly.graph_objects.Figure: The template, with one gauge indicator from 0 to 100.
+    """
+    fig = go.Figure(go.Indicator(mode='gauge+number',
+                                 domain={'x': [0, 1], 'y': [0, 1]},
+                                 gauge={'axis': {'range': [None, 100],
+                                                 'tickmode': 'array',
+                                                 'tickvals': [0, 25, 50, 75, 100]}}))
+    fig.update_layout(margin=dict(t=30, b=20, l=40, r=40),
+                      height=150,
+                      font=dict(size=16, color='black'))
+    return fig
+
+def build_spectrum_template():
+    """
+    Builds the validated template of the spectra of a variable.
+
+    Returns:
+        plotly.graph_objects.Figure: The template, with one line trace over a logarithmic density axis.
+    """
+    fig = go.Figure(go.Scatter(mode='lines', showlegend=True),
+                    layout=dict(template=figure_payload.get_layout_template()))
+    fig.update_layout(xaxis_title='Frequência (ciclos/h)',
+                      yaxis_title='Densidade espectral',
+                      yaxis_type='log',
+                      legend_title_text='',
+                      margin=dict(t=30),
+                      height=250,
+                      hovermode='x unified')
+    return fig
+
+TEMPLATE_BUILDERS = {'time_series': build_line_template,
+                     'last_record': build_last_record_template,
+                     'reliability_gauge': build_reliability_gauge_template,
+                     'spectrum': build_spectrum_template}
+
+
+def get_figure_template(chart_type):
+    """
+    Returns the template of a chart type as a dict, building and validating it on first use.
+
+    Args:
+        chart_type (str): One of TEMPLATE_BUILDERS.
+
+    Returns:
+        dict: The template figure, with 'data' and 'layout'.
+    """
+    if chart_type not in figure_templates:
+        figure_templates[chart_type] = TEMPLATE_BUILDERS[chart_type]().to_dict()
+    return figure_templates[chart_type]
+
+def merge_properties(base, overrides):
+    """
+    Merges property overrides into a copy of the template properties, nested dicts included.
+
+    Args:
+        base (dict): The properties of the template.
+        overrides (dict): The properties to set.
+
+    Returns:
+        dict: The merged properties.
+    """
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_properties(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def stamp_figure(chart_type, traces, shapes=(), layout=None, validate=False):
+    """
+    Creates a figure from the template of its chart type.
+
+    Every trace is stamped from the template trace and every shape from the template shape at
+    the same position, so only what differs between figures is passed in.
+
+    Args:
+        chart_type (str): One of TEMPLATE_BUILDERS.
+        traces (list): The properties of each trace (data arrays, name, colors, ...).
+        shapes (list): The properties of each template shape (coordinates, name, ...).
+        layout (dict): The layout properties of this figure (title, height, ranges, ...).
+        validate (bool): Whether to validate the stamped figure. Only needed for untrusted inputs.
+
+    Returns:
+        plotly.graph_objects.Figure: The figure.
+    """
+    template = copy.deepcopy(get_figure_template(chart_type))
+    template_trace = template['data'][0]
+    template_shapes = template['layout'].get('shapes', [])
+    figure_dict = {'data': [merge_properties(template_trace, trace) for trace in traces],
+                   'layout': merge_properties(template['layout'], layout or {})}
+    if template_shapes:
+        figure_dict['layout']['shapes'] = [merge_properties(template_shape, shape)
+                                           for template_shape, shape in zip(template_shapes, shapes)]
+    return go.Figure(figure_dict, _validate=validate)
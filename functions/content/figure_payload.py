@@ -0,0 +1,152 @@
+"""
+Shrinks the figures before they are sent to the browser.
+
+Plotly serializes every trace array into the figure JSON, so on the plant's Wi-Fi the transfer
+of long intervals takes longer than building them. The values are rounded to the precision of
+the sensors and, with plotly >= 6, sent as float32 typed arrays (base64 'bdata' instead of JSON
+number lists). Datetime axes are sent as epoch milliseconds rather than ISO strings, which are
+three times longer and repeated in every trace of the figure.
+"""
+import logging
+
+import numpy as np
+import plotly
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from functions.data import settings
+from functions.monitoring import metrics
+
+# plotly >= 6 sends numpy arrays as typed arrays, keeping their dtype
+TYPED_ARRAYS = int(plotly.__version__.split('.')[0]) >= 6
+
+# Integers up to 2**24 are exact in float32, so values rounded to N decimals below 2**24 / 10**N keep every digit
+FLOAT32_EXACT_LIMIT = 2 ** 24
+
+logger = logging.getLogger('acodata.payload')
+
+layout_template = None
+
+
+def get_layout_template():
+    """
+    Returns the layout template shared by the figures of the dashboard, built once per process.
+
+    The template extends the current default (the Streamlit theme) with the hover label and
+    legend settings common to every chart.
+
+    Returns:
+        plotly.graph_objects.layout.Template: The template.
+    """
+    global layout_template
+    if layout_template is None:
+        template = go.layout.Template(pio.templates[pio.templates.default])
+        template.layout.update(hoverlabel=dict(bgcolor='white', font_size=16),
+                               legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1, title=''))
+        layout_template = template
+    return layout_template
+
+def compact_values(values, decimals):
+    """
+    Converts the values of a trace attribute into the smallest array that keeps their precision.
+
+    Args:
+        values: The values of the attribute (array, list or tuple).
+        decimals (int): The number of decimals kept.
+
+    Returns:
+        numpy.ndarray: The compact values, or None if the values are neither numbers nor datetimes.
+        bool: True if the values are datetimes, converted to epoch milliseconds.
+    """
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64):
+        # Naive datetimes are already in local time, so they are shown as they are on a 'date' axis
+        milliseconds = array.astype('datetime64[ms]').astype('int64').astype('float64')
+        milliseconds[np.isnat(array)] = np.nan
+        return milliseconds, True
+    if not np.issubdtype(array.dtype, np.number) or np.issubdtype(array.dtype, np.complexfloating):
+        return None, False
+    rounded = np.round(array.astype('float64'), decimals)
+    finite = rounded[np.isfinite(rounded)]
+    if TYPED_ARRAYS and (finite.size == 0 or np.abs(finite).max() * 10 ** decimals < FLOAT32_EXACT_LIMIT):
+        return rounded.astype('float32'), False
+    return rounded, False
+
+def compact_figure(fig, decimals=None):
+    """
+    Rounds the x and y arrays of every trace to the sensor precision and shrinks their encoding.
+
+    The hover format of the value axes is set to the same precision, so float32 values are shown
+    exactly as they were rounded.
+
+    Args:
+        fig (plotly.graph_objects.Figure): The figure, changed in place.
+        decimals (int): The number of decimals kept. Defaults to FIGURE_VALUE_DECIMALS.
+
+    Returns:
+        plotly.graph_objects.Figure: The same figure.
+    """
+    if decimals is None:
+        decimals = settings.FIGURE_VALUE_DECIMALS
+    for trace in fig.data:
+        for attribute in ('x', 'y'):
+            values = getattr(trace, attribute, None)
+            if values is None or len(values) == 0:
+                continue
+            compact, is_datetime = compact_values(values, decimals)
+            if compact is None:
+                continue
+            trace[attribute] = compact
+            axis_id = getattr(trace, f'{attribute}axis', None) or attribute
+            axis = fig.layout[axis_id.replace(attribute, f'{attribute}axis', 1)]
+            if is_datetime:
+                axis.type = 'date'
+            elif axis.hoverformat is None:
+                axis.hoverformat = f'.{decimals}~f'
+    return fig
+
+def figure_payload_bytes(fig):
+    """
+    Measures the JSON of a figure, as Streamlit sends it.
+
+    Args:
+        fig (plotly.graph_objects.Figure): The figure.
+
+    Returns:
+        int: The size of the payload in bytes.
+    """
+    return len(pio.to_json(fig, validate=False).encode('utf-8'))
+
+def record_payload(chart, fig):
+    """
+    Logs the payload size of a figure and records it in the metrics.
+
+    The figure is serialized only when the 'acodata.payload' logger shows INFO messages or
+    metrics are enabled, since serializing a long interval costs as much as building it.
+
+    Args:
+        chart (str): The kind of chart ('time_series', 'last_record', 'reliability_gauge', ...).
+        fig (plotly.graph_objects.Figure): The figure.
+
+    Returns:
+        None
+    """
+    if not (logger.isEnabledFor(logging.INFO) or metrics.is_enabled()):
+        return None
+    record_payload_bytes(chart, figure_payload_bytes(fig))
+    return None
+
+def record_payload_bytes(chart, payload_bytes):
+    """
+    Logs the payload size of a chart already serialized (pre-rendered HTML, ...) and records it in the metrics.
+
+    Args:
+        chart (str): The kind of chart.
+        payload_bytes (int): The size of the payload in bytes.
+
+    Returns:
+        None
+    """
+    logger.info('%s figure: %d bytes', chart, payload_bytes)
+    metrics.observe_figure_payload_bytes(chart, payload_bytes)
+    return None
@@ -0,0 +1,57 @@
+"""
+Fleet-wide table of the freshness of the sensors: when each variable sent its last row, and whether it is late.
+"""
+import streamlit as st
+
+from functions.content import last_record_chart_builder
+from functions.data import settings
+from functions.monitoring import freshness, tracing
+
+
+def make_freshness_table(freshness_df):
+    """
+    Formats the fleet-wide freshness check for display.
+
+    Args:
+        freshness_df (DataFrame): The result of freshness.get_fleet_freshness.
+
+    Returns:
+        DataFrame: One row per variable, with Portuguese headers and formatted values.
+    """
+    def format_timestamp(timestamp):
+        if timestamp != timestamp:  # NaN: empty table
+            return '-'
+        return last_record_chart_builder.format_datetime_to_string(last_record_chart_builder.convert_timestamp_to_datetime(int(timestamp)))
+
+    return freshness_df.assign(**{
+        'Ponto': freshness_df['spot_alias'],
+        'Variável': freshness_df['alias_name'],
+        'Último registro': [format_timestamp(timestamp) for timestamp in freshness_df['last_timestamp']],
+        'Intervalo esperado': [f'{seconds:.0f} s' if seconds < 60 else freshness.format_gap(seconds)
+                               for seconds in freshness_df['sample_seconds']],
+        'Sem dados há': [freshness.format_gap(gap_seconds) for gap_seconds in freshness_df['gap_seconds']],
+        'Situação': freshness_df['status'].map(freshness.FRESHNESS_LABELS),
+    })[['Ponto', 'Variável', 'Último registro', 'Intervalo esperado', 'Sem dados há', 'Situação']]
+
+@tracing.traced('builder')
+def show_fleet_freshness(column, conn):
+    """
+    Displays the freshness of every variable of every spot, the most silent first.
+
+    Args:
+        column (streamlit.delta_generator.DeltaGenerator): The Streamlit column of the table.
+        conn: A QueryContext or a Streamlit SQL connection.
+
+    Returns:
+        None
+    """
+    freshness_df = freshness.get_fleet_freshness(conn=conn)
+    with column:
+        status_columns = st.columns(len(freshness.FRESHNESS_LABELS))
+        for status_column, (status, label) in zip(status_columns, freshness.FRESHNESS_LABELS.items()):
+            status_column.metric(label, int((freshness_df['status'] == status).sum()))
+        st.dataframe(make_freshness_table(freshness_df), use_container_width=True, hide_index=True)
+        st.caption(f"Atrasada: {settings.FRESHNESS_LATE_SAMPLES} amostras esperadas sem dados. "
+                   f"Parada: {settings.FRESHNESS_STALE_SAMPLES} amostras. "
+                   f"Verificação refeita a cada {settings.FRESHNESS_TTL_SECONDS} s.")
+    return None
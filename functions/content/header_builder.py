@@ -1,5 +1,8 @@
 import streamlit as st
 
+from functions.monitoring import tracing
+
+
 def insert_acodata_one(column):
     """
     Inserts the ACOdata® logo and tagline into the specified column.
@@ -46,6 +49,7 @@ def insert_code_application(column, code, application):
         st.markdown(f'<h5 style="color:#2A4B80; ">{application}</h5>', unsafe_allow_html=True)
     return None
 
+@tracing.traced('builder')
 def insert_data(col_left, col_center, col_right, client_name, code, application):
     """
     Inserts the ACOdata® logo, client's name, code, and application name into the specified columns.
@@ -1,9 +1,17 @@
 import streamlit as st
+import html
+import math
 import time
 import pandas as pd
-import plotly.graph_objects as go
 from datetime import datetime
 
+from functions.content import figure_factory, figure_payload
+from functions.data import forecasting, query_context, settings
+from functions.monitoring import freshness, tracing
+
+# Last rendered HTML of each (namespace, spot_id, global_data_id), with the inputs it was rendered from
+last_record_html_cache = {}
+
 
 def query_get_variables_from_spot(spot_id, global_data_id_column, global_data_name_column, column_not_null):
     """
@@ -179,6 +187,7 @@ def get_variable_name_alarms(conn, spot_id, global_data_id):
     variable_name_alarms_df, elapsed_time = run_and_time_query(conn=conn, query=query)
     return variable_name_alarms_df, elapsed_time
 
+@tracing.traced('transform')
 def make_last_record_alarms_df(variable_name_alarms_df, last_record_df):
     """
     Concatenates two DataFrames, removing specific columns, to create a DataFrame suitable for plotting.
@@ -208,6 +217,7 @@ def get_last_record_plot_max_x(last_record_alarms_df):
     last_record_plot_max_x = last_record_alarms_df.max().max()
     return last_record_plot_max_x
 
+@tracing.traced('transform')
 def get_last_record_plot_values_df(last_record_df):
     """
     Removes the 'timestamp' column from a DataFrame containing the last record of a global variable.
@@ -244,6 +254,7 @@ def get_last_record_variables_list(last_record_plot_values_df):
     return last_record_variables_list
 
 
+@tracing.traced('transform')
 def get_last_record_colors_list(last_record_values_list, alarm_critical, alarm_alert):
     """
     Associates values in a list to colors based on specified thresholds.
@@ -268,6 +279,7 @@ def get_last_record_colors_list(last_record_values_list, alarm_critical, alarm_a
     return last_record_colors_list
 
 
+@tracing.traced('figure')
 def create_last_record_plot(last_record_values_list, last_record_variables_alias_list, last_record_colors_list, last_record_plot_max_x, alarm_alert, alarm_critical):
     """
     Creates a last record plot using Plotly.
@@ -284,35 +296,101 @@ def create_last_record_plot(last_record_values_list, last_record_variables_alias
         plotly.graph_objs._figure.Figure: A Plotly figure object representing the last record plot.
     """
 
-    fig = go.Figure(go.Bar(
-        x=last_record_values_list,
-        y=last_record_variables_alias_list,
-        orientation='h',
-        marker_color=last_record_colors_list,
-        text=last_record_values_list,  # Use os valores como texto
-        textposition='outside',
-        insidetextanchor='end',
-        textangle=0,
-        texttemplate='%{text:.3f}',# Posicione o texto dentro das barras
-    ))
-    
-    fig.update_xaxes(range=[0, last_record_plot_max_x*1.4])
-    
-    fig.add_vline(x=alarm_alert, line_dash="dash", line_color="gold")
-    fig.add_vline(x=alarm_critical, line_dash="dash", line_color="red")
-
-    fig.update_layout(height=(1+len(last_record_variables_alias_list))*30)
-    fig.update_layout(showlegend=False)
-    fig.update_layout(margin=dict(t=0, b=0))
-    fig.update_layout(font=dict(size=16, color="black"))
-    fig.update_layout(yaxis=dict(tickfont=dict(size=16, color="black")))
+    fig = figure_factory.stamp_figure(
+        'last_record',
+        traces=[{'x': last_record_values_list,
+                 'y': last_record_variables_alias_list,
+                 'marker': {'color': last_record_colors_list},
+                 'text': last_record_values_list}],  # Use os valores como texto
+        shapes=[{'x0': alarm_alert, 'x1': alarm_alert},
+                {'x0': alarm_critical, 'x1': alarm_critical}],
+        layout={'xaxis': {'range': [0, last_record_plot_max_x*1.4]},
+                'height': (1+len(last_record_variables_alias_list))*30})
     
-    return fig
+    return figure_payload.compact_figure(fig)
+
+def format_bar_percent(value, max_x):
+    """
+    Converts a value into its position along the bar axis, which spans from 0 to max_x.
+
+    Args:
+        value (float): The value.
+        max_x (float): The end of the axis.
+
+    Returns:
+        float: The position in percent of the axis, between 0 and 100.
+    """
+    if max_x <= 0:
+        return 0.0
+    return min(max(value / max_x * 100, 0.0), 100.0)
+
+@tracing.traced('figure')
+def create_last_record_html(last_record_values_list, last_record_variables_alias_list, last_record_colors_list, last_record_plot_max_x, alarm_alert, alarm_critical):
+    """
+    Renders the last record bars as plain HTML, with the same layout as create_last_record_plot.
+
+    The bars, the values and the dashed threshold lines are positioned with CSS, so the panel is
+    shown without the Plotly runtime and its payload is a few hundred bytes per variable.
+
+    Args:
+        last_record_values_list (list): List of values to be plotted.
+        last_record_variables_alias_list (list): List of variable aliases corresponding to the values.
+        last_record_colors_list (list): List of colors corresponding to the values.
+        last_record_plot_max_x (float): Maximum x-axis value for the plot.
+        alarm_alert (float): Value indicating the alert threshold.
+        alarm_critical (float): Value indicating the critical threshold.
+
+    Returns:
+        str: The HTML of the bars.
+    """
+    axis_max_x = last_record_plot_max_x * 1.4
+    threshold_lines = ''.join(
+        f'<div style="position:absolute;left:{format_bar_percent(alarm, axis_max_x):.2f}%;top:-4px;bottom:-4px;'
+        f'border-left:2px dashed {color};"></div>'
+        for alarm, color in ((alarm_alert, 'gold'), (alarm_critical, 'red')))
+    rows = []
+    for value, alias, color in zip(last_record_values_list, last_record_variables_alias_list, last_record_colors_list):
+        if value is None or math.isnan(value):
+            bar = ''
+        else:
+            percent = format_bar_percent(value, axis_max_x)
+            bar = (f'<div style="width:{percent:.2f}%;height:100%;background:{color};"></div>'
+                   f'<span style="position:absolute;left:calc({percent:.2f}% + 4px);top:0;line-height:22px;">{value:.3f}</span>')
+        rows.append(f'<div style="white-space:nowrap;">{html.escape(str(alias))}</div>'
+                    f'<div style="position:relative;height:22px;">{bar}{threshold_lines}</div>')
+    return ('<div style="display:grid;grid-template-columns:max-content 1fr;column-gap:8px;row-gap:8px;'
+            'align-items:center;font-size:16px;color:black;margin-bottom:16px;">'
+            + ''.join(rows) + '</div>')
+
+def get_last_record_html(namespace, spot_id, global_data_id, last_record_timestamp_int, **plot_kwargs):
+    """
+    Returns the HTML of the last record bars, rendering it only when the record or its thresholds changed.
+
+    Args:
+        namespace (str): The tenant namespace of the connection, None in single-tenant mode.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        last_record_timestamp_int (int): The timestamp of the last record.
+        **plot_kwargs: The arguments of create_last_record_html.
+
+    Returns:
+        str: The HTML of the bars.
+    """
+    inputs = (last_record_timestamp_int, plot_kwargs['alarm_alert'], plot_kwargs['alarm_critical'],
+              tuple(plot_kwargs['last_record_variables_alias_list']), tuple(plot_kwargs['last_record_values_list']))
+    cache_key = (namespace, spot_id, global_data_id)
+    cached = last_record_html_cache.get(cache_key)
+    if cached is not None and cached[0] == inputs:
+        return cached[1]
+    last_record_html = create_last_record_html(**plot_kwargs)
+    last_record_html_cache[cache_key] = (inputs, last_record_html)
+    return last_record_html
 
 def get_text_alias_df(conn):
     text_alias_df = conn.query('SELECT * FROM text_aliases')
     return text_alias_df
 
+@tracing.traced('transform')
 def get_new_names(last_record_variables_list, text_alias_df):
     """
     Returns the new names corresponding to the values in the provided list.
@@ -338,6 +416,67 @@ def get_new_names(last_record_variables_list, text_alias_df):
     return last_record_variables_alias_list
 
 
+def get_spot_freshness(conn, spot_id):
+    """
+    Returns the variables of a spot that stopped sending data, from the fleet-wide freshness check.
+
+    Args:
+        conn (connection): Database connection.
+        spot_id (int): The ID of the spot.
+
+    Returns:
+        DataFrame: The late and stale variables of the spot, the most silent first.
+    """
+    fleet_freshness_df = freshness.get_fleet_freshness(conn=conn)
+    silent = fleet_freshness_df['status'].isin([freshness.FRESHNESS_LATE, freshness.FRESHNESS_STALE])
+    return fleet_freshness_df[silent & (fleet_freshness_df['spot_id'] == spot_id)]
+
+def format_forecast(forecast, alias, last_record_timestamp_int):
+    """
+    Describes in Portuguese when the trend of a column reaches its alarms.
+
+    Args:
+        forecast (namedtuple): A row of forecasting.get_spot_forecasts.
+        alias (str): The name of the column shown to the operator.
+        last_record_timestamp_int (int): The timestamp of the last record of the variable.
+
+    Returns:
+        str: The description, or None when the trend reaches no alarm within the horizon.
+    """
+    crossings = [f'{label} em {format_datetime_to_string(convert_timestamp_to_datetime(int(timestamp)))} '
+                 f'(+{freshness.format_gap(timestamp - last_record_timestamp_int)})'
+                 for label, timestamp in (('alerta', forecast.alert_timestamp), ('crítico', forecast.critical_timestamp))
+                 if not math.isnan(timestamp)]
+    if not crossings:
+        return None
+    return f'Tendência de {alias}: ' + ', '.join(crossings)
+
+@tracing.traced('builder')
+def show_forecasts(containers, conn, spot_id, variables, text_alias_df):
+    """
+    Displays under the bars of each variable when the trends of its columns reach its alarms.
+
+    Args:
+        containers (dict): The Streamlit container under the bars of each global_data_id.
+        conn (connection): Database connection.
+        spot_id (int): The ID of the spot.
+        variables (dict): The (last_timestamp, alarm_alert, alarm_critical) of each global_data_id.
+        text_alias_df (DataFrame): DataFrame containing text alias information.
+
+    Returns:
+        None
+    """
+    forecasts_df = forecasting.get_spot_forecasts(conn=conn, spot_id=spot_id, variables=variables)
+    aliases = dict(zip(text_alias_df['old_name'], text_alias_df['new_name']))
+    for forecast in forecasts_df.sort_values(['global_data_id', 'column_name']).itertuples(index=False):
+        forecast_text = format_forecast(forecast=forecast,
+                                        alias=aliases.get(forecast.column_name, forecast.column_name),
+                                        last_record_timestamp_int=variables[forecast.global_data_id][0])
+        if forecast_text is not None:
+            containers[forecast.global_data_id].caption(forecast_text)
+    return None
+
+@tracing.traced('builder')
 def show_last_record_chart(column, conn, spot_id_selected):
     """
     Generates and displays last record charts for each global data ID in the provided DataFrame.
@@ -353,6 +492,13 @@ def show_last_record_chart(column, conn, spot_id_selected):
         None
     """
     
+    # With the async engine, the reads of this builder go out in two rounds instead of one after the other
+    query_context.prefetch(conn, ['SELECT * FROM text_aliases',
+                                  query_get_variables_from_spot(spot_id=spot_id_selected,
+                                                                global_data_id_column='global_data_id',
+                                                                global_data_name_column='global_data_name',
+                                                                column_not_null='alarm_critical')])
+
     text_alias_df = get_text_alias_df(conn=conn)
 
     variables_from_spot_df, elapsed_time = variables_from_spot(conn=conn,
@@ -361,7 +507,14 @@ def show_last_record_chart(column, conn, spot_id_selected):
                                                                global_data_name_column='global_data_name',
                                                                column_not_null='alarm_critical')
 
+    query_context.prefetch(conn, [query
+                                  for global_data_id in variables_from_spot_df['global_data_id']
+                                  for query in (query_variable_name_alarms(spot_id=spot_id_selected, global_data_id=global_data_id),
+                                                query_get_last_record(spot_id=spot_id_selected, global_data_id=global_data_id))])
     
+    spot_last_timestamp_int = None
+    forecast_containers = {}
+    forecast_variables = {}
     for global_data_id in variables_from_spot_df['global_data_id']:
         variable_name_alarms_df, elapsed_time = get_variable_name_alarms(conn=conn,
                                                                          spot_id=spot_id_selected,
@@ -374,9 +527,9 @@ def show_last_record_chart(column, conn, spot_id_selected):
         
         last_record_timestamp_int = get_last_record_timestamp(last_record_df=last_record_df)
 
-        last_record_timestamp_datetime = convert_timestamp_to_datetime(last_record_timestamp_int)
-
-        last_record_timestamp_formated = format_datetime_to_string(last_record_timestamp_datetime)
+        # The spot is as recent as its newest variable; silent variables are flagged below
+        if spot_last_timestamp_int is None or last_record_timestamp_int > spot_last_timestamp_int:
+            spot_last_timestamp_int = last_record_timestamp_int
         
         last_record_alarms_df = make_last_record_alarms_df(variable_name_alarms_df=variable_name_alarms_df,
                                                            last_record_df=last_record_df)
@@ -401,17 +554,52 @@ def show_last_record_chart(column, conn, spot_id_selected):
         last_record_variables_alias_list = get_new_names(last_record_variables_list=last_record_variables_list,
                                                          text_alias_df=text_alias_df)
 
-        last_record_plot_fig = create_last_record_plot(last_record_values_list=last_record_values_list,
-                                                       last_record_variables_alias_list=last_record_variables_alias_list,
-                                                       last_record_colors_list=last_record_color_list,
-                                                       last_record_plot_max_x=last_record_plot_max_x,
-                                                       alarm_critical=alarm_critical,
-                                                       alarm_alert=alarm_alert)
+        plot_kwargs = dict(last_record_values_list=last_record_values_list,
+                           last_record_variables_alias_list=last_record_variables_alias_list,
+                           last_record_colors_list=last_record_color_list,
+                           last_record_plot_max_x=last_record_plot_max_x,
+                           alarm_critical=alarm_critical,
+                           alarm_alert=alarm_alert)
         with column:
             st.markdown(f"###### {variable_name}")
-            st.plotly_chart(last_record_plot_fig, use_container_width=True, config = config)
+            if settings.LAST_RECORD_RENDERER == 'html':
+                last_record_html = get_last_record_html(namespace=query_context.get_namespace(conn),
+                                                        spot_id=spot_id_selected,
+                                                        global_data_id=global_data_id,
+                                                        last_record_timestamp_int=last_record_timestamp_int,
+                                                        **plot_kwargs)
+                with tracing.span('st.markdown', 'render'):
+                    st.markdown(last_record_html, unsafe_allow_html=True)
+                figure_payload.record_payload_bytes('last_record_html', len(last_record_html.encode('utf-8')))
+            else:
+                last_record_plot_fig = create_last_record_plot(**plot_kwargs)
+                with tracing.span('st.plotly_chart', 'render'):
+                    st.plotly_chart(last_record_plot_fig, use_container_width=True, config = config)
+                figure_payload.record_payload('last_record', last_record_plot_fig)
+            if settings.FORECAST_ENABLED:
+                # Filled once the trends of every variable of the spot are fitted, in one pass
+                forecast_containers[global_data_id] = st.container()
+                forecast_variables[global_data_id] = (last_record_timestamp_int, alarm_alert, alarm_critical)
+    if forecast_variables:
+        show_forecasts(containers=forecast_containers,
+                       conn=conn,
+                       spot_id=spot_id_selected,
+                       variables=forecast_variables,
+                       text_alias_df=text_alias_df)
+
+    last_record_timestamp_int = spot_last_timestamp_int
+
+    last_record_timestamp_datetime = convert_timestamp_to_datetime(last_record_timestamp_int)
+
+    last_record_timestamp_formated = format_datetime_to_string(last_record_timestamp_datetime)
+
+    spot_freshness_df = get_spot_freshness(conn=conn, spot_id=spot_id_selected)
+
     with column:
-        st.write(f'Atualizado em: {last_record_timestamp_formated}')        
+        st.write(f'Atualizado em: {last_record_timestamp_formated}')
+        for variable in spot_freshness_df.itertuples(index=False):
+            st.warning(f'{variable.alias_name}: sem dados há {freshness.format_gap(variable.gap_seconds)} '
+                       f'({freshness.FRESHNESS_LABELS[variable.status].lower()}).')
             
     return last_record_timestamp_int, last_record_timestamp_datetime, variables_from_spot_df 
     
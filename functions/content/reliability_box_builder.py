@@ -1,7 +1,10 @@
 import streamlit as st
 
-import plotly.graph_objects as go
+from functions.content import figure_factory, figure_payload
+from functions.monitoring import tracing
 
+
+@tracing.traced('figure')
 def create_reliability_gauge(reliability):
     """
     Creates a reliability gauge chart.
@@ -12,24 +15,9 @@ def create_reliability_gauge(reliability):
     Returns:
     plotly.graph_objects.Figure: The reliability gauge chart.
     """
-    # Create a gauge chart
-    reliability_gauge = go.Figure(go.Indicator(
-        mode = "gauge+number",  # Define o modo do indicador como gráfico de gauge com número
-        value = reliability * 100,  # Define o valor do indicador (multiplicando por 100 para exibir como porcentagem)
-        domain = {'x': [0, 1], 'y': [0, 1]},  # Define a posição e o tamanho do indicador no layout
-        gauge = {'axis': {'range': [None, 100]}}  # Define as configurações do medidor (no eixo de 0 a 100)
-        ))
-    
-    # Atualiza o layout do gráfico
-    reliability_gauge.update_layout(
-        margin=dict(t=30, b=20, l=40, r=40),  # Define as margens do gráfico
-        height=150,  # Define a altura do gráfico
-        font=dict(size=16, color="black")  # Define as configurações da fonte
-    )
-    
-    # Define os ticks do eixo do medidor
-    reliability_gauge.update_traces(gauge_axis_tickmode="array", selector=dict(type='indicator'))
-    reliability_gauge.update_traces(gauge_axis_tickvals=[0,25,50,75,100], selector=dict(type='indicator'))
+    reliability_gauge = figure_factory.stamp_figure(
+        'reliability_gauge',
+        traces=[{'value': reliability * 100}])  # Multiplicando por 100 para exibir como porcentagem
     
     return reliability_gauge
 
@@ -74,9 +62,12 @@ def insert_gauge(column, reliability):
     with column:
         reliability_gauge = create_reliability_gauge(reliability=reliability)
         config = {'staticPlot': True}
-        st.plotly_chart(figure_or_data=reliability_gauge, use_container_width=True, config=config)
+        with tracing.span('st.plotly_chart', 'render'):
+            st.plotly_chart(figure_or_data=reliability_gauge, use_container_width=True, config=config)
+        figure_payload.record_payload('reliability_gauge', reliability_gauge)
     return None
 
+@tracing.traced('builder')
 def insert_title_and_gauge(column, title, reliability):
     """
     Insert a title followed by a reliability gauge chart into a Streamlit column.
@@ -1,5 +1,9 @@
 import streamlit as st
 
+from functions.monitoring import tracing
+
+
+@tracing.traced('builder')
 def show_sensor_image(column, image_path):
     with column:
         st.image(image=image_path, use_column_width=True)
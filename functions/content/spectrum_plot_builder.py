@@ -0,0 +1,184 @@
+"""
+Spectral analysis of a vibration variable, shown under its time series.
+
+The spectra and band energies are computed per closed day by the spectra job
+(python -m functions.jobs.spectra) and only read here, so a rerun never runs an FFT: the chart is
+the mean of the stored daily spectra of the days inside the selected interval, averaged by the
+database in a single query.
+"""
+import re
+
+import streamlit as st
+import numpy as np
+from datetime import datetime, timezone
+
+from functions.content import figure_factory, figure_payload
+from functions.data import query_context, settings, spectral_analysis
+from functions.monitoring import tracing
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# The job adds the closed days once a day; an hour is enough for a session to see them
+SPECTRA_CACHE_TTL_SECONDS = 60 * 60
+
+
+def matches_variable_pattern(alias_name, variable_pattern):
+    """
+    Checks whether the alias of a variable matches an ILIKE pattern, as the spectra job selects its variables.
+
+    Args:
+        alias_name (str): The alias of the variable.
+        variable_pattern (str): The ILIKE pattern ('%' any text, '_' any character).
+
+    Returns:
+        bool: True if the variable has spectra.
+    """
+    regex = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in variable_pattern)
+    return re.fullmatch(regex, str(alias_name), flags=re.IGNORECASE | re.DOTALL) is not None
+
+def query_mean_spectrum(spot_id, global_data_id, start_timestamp, end_timestamp):
+    """
+    Constructs the SQL query that averages the stored daily spectra of the days inside an interval.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        str: The SQL query, with one row per column and frequency.
+    """
+    query = f"""SELECT column_name, frequency_cph, AVG(psd) AS psd, COUNT(*) AS days
+                FROM {spectral_analysis.SPECTRA_TABLE}
+                WHERE spot_id = {spot_id}
+                  AND global_data_id = {global_data_id}
+                  AND period_start >= {start_timestamp}
+                  AND period_start <= {end_timestamp - SECONDS_PER_DAY}
+                GROUP BY column_name, frequency_cph
+                ORDER BY column_name, frequency_cph;"""
+    return query
+
+def query_band_energies(spot_id, global_data_id, start_timestamp, end_timestamp):
+    """
+    Constructs the SQL query that reads the stored band energies of the days inside an interval.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        str: The SQL query, with one row per day, column and band.
+    """
+    query = f"""SELECT period_start, column_name, band_low_cph, band_high_cph, energy
+                FROM {spectral_analysis.SPECTRAL_BANDS_TABLE}
+                WHERE spot_id = {spot_id}
+                  AND global_data_id = {global_data_id}
+                  AND period_start >= {start_timestamp}
+                  AND period_start <= {end_timestamp - SECONDS_PER_DAY}
+                  AND windows > 0
+                ORDER BY period_start, column_name, band_low_cph;"""
+    return query
+
+@tracing.traced('query')
+def get_spectra(conn, spot_id, global_data_id, start_timestamp, end_timestamp):
+    """
+    Reads the mean spectrum and the daily band energies of a variable over an interval.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        DataFrame: The mean spectrum ('column_name', 'frequency_cph', 'psd', 'days').
+        DataFrame: The band energies ('period_start', 'column_name', 'band_low_cph', 'band_high_cph', 'energy').
+    """
+    historical_conn = query_context.route_historical(conn)
+    spectrum_df = historical_conn.query(query_mean_spectrum(spot_id, global_data_id, start_timestamp, end_timestamp),
+                                        ttl=SPECTRA_CACHE_TTL_SECONDS)
+    bands_df = historical_conn.query(query_band_energies(spot_id, global_data_id, start_timestamp, end_timestamp),
+                                     ttl=SPECTRA_CACHE_TTL_SECONDS)
+    return spectrum_df, bands_df
+
+@tracing.traced('figure')
+def plot_spectrum_lines(spectrum_df, column_names):
+    """
+    Creates the spectrum chart, one line per column of the variable.
+
+    Args:
+        spectrum_df (DataFrame): The mean spectrum returned by get_spectra.
+        column_names (dict): The display name of each column.
+
+    Returns:
+        plotly.graph_objects.Figure: The chart.
+    """
+    # Not compacted: the densities are far below the decimals kept for the sensor values
+    return figure_factory.stamp_figure(
+        'spectrum',
+        traces=[{'x': column_df['frequency_cph'].to_numpy(dtype='float64'),
+                 'y': column_df['psd'].to_numpy(dtype='float64', na_value=np.nan),
+                 'name': column_names.get(column, column)}
+                for column, column_df in spectrum_df.groupby('column_name', sort=False)])
+
+def pivot_band_energies(bands_df, column_names):
+    """
+    Spreads the band energies into one row per day and column, one column per band.
+
+    Args:
+        bands_df (DataFrame): The band energies returned by get_spectra.
+        column_names (dict): The display name of each column.
+
+    Returns:
+        DataFrame: The table of the band energies.
+    """
+    table_df = bands_df.assign(
+        Dia=[datetime.fromtimestamp(period_start, tz=timezone.utc).date() for period_start in bands_df['period_start']],
+        Eixo=bands_df['column_name'].map(lambda column: column_names.get(column, column)),
+        Banda=[f'{low:g}–{high:g} ciclos/h' for low, high in zip(bands_df['band_low_cph'], bands_df['band_high_cph'])])
+    return table_df.pivot_table(index=['Dia', 'Eixo'], columns='Banda', values='energy', sort=False).reset_index()
+
+@tracing.traced('builder')
+def show_spectrum(conn, spot_id, global_data_id, variable_name, start_timestamp, end_timestamp, text_alias_df, config):
+    """
+    Displays the spectrum and band energies of a vibration variable over the selected interval.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        variable_name (str): The alias of the variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        text_alias_df (DataFrame): The display names of the columns ('old_name', 'new_name').
+        config (dict): The Plotly configuration of the charts of the page.
+
+    Returns:
+        None
+    """
+    if not matches_variable_pattern(variable_name, settings.SPECTRA_VARIABLE_PATTERN):
+        return None
+    with st.expander("Análise espectral", expanded=False):
+        spectrum_df, bands_df = get_spectra(conn=conn,
+                                            spot_id=spot_id,
+                                            global_data_id=global_data_id,
+                                            start_timestamp=start_timestamp,
+                                            end_timestamp=end_timestamp)
+        if spectrum_df.empty:
+            st.caption("Espectro disponível para os dias completos já processados do intervalo.")
+            return None
+        column_names = dict(zip(text_alias_df['old_name'], text_alias_df['new_name']))
+        fig = plot_spectrum_lines(spectrum_df=spectrum_df, column_names=column_names)
+        with tracing.span('st.plotly_chart', 'render'):
+            st.plotly_chart(fig, theme="streamlit", use_container_width=True, config=config)
+        figure_payload.record_payload('spectrum', fig)
+        st.caption(f"Média dos espectros de {int(spectrum_df['days'].max())} dia(s) completo(s) do intervalo.")
+        st.markdown("###### Energia por banda")
+        st.dataframe(pivot_band_energies(bands_df=bands_df, column_names=column_names),
+                     use_container_width=True,
+                     hide_index=True)
+    return None
@@ -1,6 +1,8 @@
 import streamlit as st
 import time
 
+from functions.monitoring import tracing
+
 def insert_title(column, title):
     """
     Inserts a title into the specified column.
@@ -67,6 +69,7 @@ def spot_id_from_alias(df, alias, alias_column, spot_id_column):
 
     
 
+@tracing.traced('builder')
 def show_spot_selector(column, title, conn):
     """
     Displays a spot selector and retrieves the selected spot ID.
@@ -1,5 +1,9 @@
 import streamlit as st
 
+from functions.monitoring import tracing
+
+
+@tracing.traced('builder')
 def insert_logo(container):
     """
     Inserts the logo image and makes it sticky at the top of the page.
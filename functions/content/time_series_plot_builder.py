@@ -1,8 +1,18 @@
 import streamlit as st
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 import pytz
-import plotly.express as px
+
+from functions.content import figure_factory, figure_payload, spectrum_plot_builder
+from functions.data import anomaly_detection, bulk_fetch, downsampling, duckdb_engine, frame_store, parquet_cache, query_budget, query_context, settings, streaming
+from functions.monitoring import metrics, tracing
+
+# Most anomaly markers drawn per chart, the highest scores first
+ANOMALY_MARKER_LIMIT = 1000
+
+# The anomaly job scores new rows every few minutes; markers older than this are read again
+ANOMALIES_CACHE_TTL_SECONDS = 5 * 60
 
 def insert_column_title(column, spot_name_selected):
     """
@@ -158,20 +168,411 @@ def query_interval_timestamps(spot_id, global_data_id, start_timestamp, end_time
             """
     return query
 
-def df_from_query(conn, query):
+def query_table_columns(spot_id, global_data_id):
+    """
+    Constructs a SQL query to retrieve the column names of a spot variable table, in table order.
+
+    Parameters:
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+
+    Returns:
+    - str: The constructed SQL query.
+    """
+    query = f"""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'spot_{spot_id}_var_{global_data_id}'
+            ORDER BY ordinal_position
+            """
+    return query
+
+def query_bucketed_interval_timestamps(spot_id, global_data_id, columns, start_timestamp, end_timestamp, bucket_seconds):
+    """
+    Constructs a SQL query that averages the data of a spot variable into fixed time buckets.
+
+    The columns keep the order of the table, with each bucket represented by its start timestamp.
+
+    Parameters:
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - columns (list): The column names of the table, in table order.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+    - bucket_seconds (int): The width of each bucket in seconds.
+
+    Returns:
+    - str: The constructed SQL query.
+    """
+    bucket = f'(timestamp / {int(bucket_seconds)}) * {int(bucket_seconds)}'
+    selects = ', '.join(f'{bucket} AS timestamp' if column == 'timestamp' else f'AVG("{column}") AS "{column}"'
+                        for column in columns)
+    query = f"""
+            SELECT {selects}
+            FROM spot_{spot_id}_var_{global_data_id}
+            WHERE timestamp >= {start_timestamp}
+            AND timestamp < {end_timestamp}
+            GROUP BY {bucket}
+            ORDER BY timestamp
+            """
+    return query
+
+def df_from_query(conn, query, estimated_rows=None):
     """
     Retrieves data from the database using the provided connection and SQL query.
 
+    Results estimated above BULK_FETCH_ROW_THRESHOLD rows are streamed with COPY and parsed
+    straight into the DataFrame, skipping the row objects built by conn.query.
+
     Parameters:
     - conn: The database connection object.
     - query (str): The SQL query to execute.
+    - estimated_rows (int): The estimated number of rows of the result, or None if unknown.
 
     Returns:
     - pandas.DataFrame: A DataFrame containing the query results.
     """
+    if bulk_fetch.use_bulk_fetch(estimated_rows):
+        return query_context.run_memoized(conn, query, bulk_fetch.df_from_copy)
     query_df = conn.query(query)
     return query_df
 
+@tracing.traced('query')
+def get_interval_df(conn, spot_id, global_data_id, start_timestamp, end_timestamp, last_record_timestamp_int, on_progress=None):
+    """
+    Retrieves the rows of a spot variable within a timestamp interval, from the frame store shared
+    by every session when another session already retrieved them.
+
+    The key includes the timestamp of the last record, so the stored rows are replaced as soon
+    as new data arrives. The returned DataFrame is read-only: its columns may be replaced, not written into.
+
+    Parameters:
+    - conn: The database connection object.
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+    - last_record_timestamp_int (int): The timestamp of the last record, used to tell closed days.
+    - on_progress (callable): Called with the averages so far while the interval is streamed.
+
+    Returns:
+    - pandas.DataFrame: A DataFrame with the rows of the interval.
+    - int: The bucket width in seconds of aggregated rows, or None for raw rows.
+    """
+    store_key = frame_store.interval_key(namespace=query_context.get_namespace(conn),
+                                         spot_id=spot_id,
+                                         global_data_id=global_data_id,
+                                         start_timestamp=start_timestamp,
+                                         end_timestamp=end_timestamp,
+                                         version=last_record_timestamp_int)
+    stored = frame_store.get_frame(store_key)
+    if stored is not None:
+        return stored
+    interval = fetch_interval_df(conn=conn,
+                                 spot_id=spot_id,
+                                 global_data_id=global_data_id,
+                                 start_timestamp=start_timestamp,
+                                 end_timestamp=end_timestamp,
+                                 last_record_timestamp_int=last_record_timestamp_int,
+                                 on_progress=on_progress)
+    frame_store.put_frame(store_key, interval)
+    return frame_store.share_value(interval)
+
+def get_edge_rows_df(conn, spot_id, global_data_id, start_timestamp, end_timestamp):
+    """
+    Retrieves from Postgres the rows of the partial days at the ends of an interval, which the
+    Parquet cache never holds, to be read with its cached whole days.
+
+    Parameters:
+    - conn: The database connection object.
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+
+    Returns:
+    - pandas.DataFrame: The rows of the partial days, or None if they have no rows.
+    """
+    conn = query_context.route_historical(conn)
+    edge_dfs = [df_from_query(conn=conn, query=query_interval_timestamps(spot_id=spot_id,
+                                                                       global_data_id=global_data_id,
+                                                                       start_timestamp=edge_start,
+                                                                       end_timestamp=edge_end))
+                for edge_start, edge_end in parquet_cache.edge_intervals(start_timestamp, end_timestamp)]
+    edge_dfs = [edge_df for edge_df in edge_dfs if not edge_df.empty]
+    if not edge_dfs:
+        return None
+    edges_df = pd.concat(edge_dfs, ignore_index=True)
+    # Columns without any value come back as objects, which DuckDB would read as text
+    return edges_df.astype({column: 'float64' for column in edges_df.columns if edges_df[column].isna().all()})
+
+def fetch_interval_df(conn, spot_id, global_data_id, start_timestamp, end_timestamp, last_record_timestamp_int, on_progress=None):
+    """
+    Retrieves the rows of a spot variable within a timestamp interval, within the row budget.
+
+    When every whole day of the interval is in the local Parquet cache, the rows are read through
+    the in-process analytics engine, and only the partial days at its ends come from Postgres. Otherwise the row count is estimated
+    by the Postgres planner before fetching. Intervals over the row budget are averaged into
+    time buckets, so a session never holds more than ROW_BUDGET rows per variable: by the database,
+    or, when the streaming mode is on, as their raw rows are streamed in chunks, drawing the chart
+    as they arrive. Intervals within the budget are fetched raw, large ones with COPY, and have
+    their closed days added to the cache.
+    Postgres reads go to a read replica when one is configured and healthy.
+
+    Parameters:
+    - conn: The database connection object.
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+    - last_record_timestamp_int (int): The timestamp of the last record, used to tell closed days.
+    - on_progress (callable): Called with the averages so far while the interval is streamed.
+
+    Returns:
+    - pandas.DataFrame: A DataFrame with the rows of the interval.
+    - int: The bucket width in seconds of aggregated rows, or None for raw rows.
+    """
+    bucket_seconds = query_budget.choose_bucket_seconds(start_timestamp, end_timestamp)
+    cache_dir = parquet_cache.namespace_cache_dir(query_context.get_namespace(conn))
+
+    is_cached = duckdb_engine.is_available() and parquet_cache.is_range_cached(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir)
+    metrics.count_cache_request('parquet', is_cached)
+    if is_cached:
+        paths = parquet_cache.partition_paths_for_range(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir)
+        edges_df = get_edge_rows_df(conn, spot_id, global_data_id, start_timestamp, end_timestamp)
+        if query_budget.is_over_budget(duckdb_engine.count_rows(paths, start_timestamp, end_timestamp, edges_df)):
+            return duckdb_engine.bucketed_aggregation(paths, start_timestamp, end_timestamp, bucket_seconds, edges_df), bucket_seconds
+        return duckdb_engine.query_interval(paths, start_timestamp, end_timestamp, edges_df), None
+
+    conn = query_context.route_historical(conn)
+
+    query = query_interval_timestamps(spot_id=spot_id,
+                                      global_data_id=global_data_id,
+                                      start_timestamp=start_timestamp,
+                                      end_timestamp=end_timestamp)
+
+    estimated_rows = query_budget.estimate_query_rows(conn=conn, query=query)
+
+    if query_budget.is_over_budget(estimated_rows):
+        # Streamed, the chart shows the averages so far while the rows arrive, instead of waiting on the database
+        if streaming.use_streaming(estimated_rows):
+            def fetch_streamed(conn, query):
+                chunks = streaming.stream_query_chunks(conn=conn, query=query)
+                return downsampling.downsample_chunks(chunks, bucket_seconds, on_progress=on_progress)
+
+            streamed_df = query_context.run_memoized(conn, query, fetch_streamed)
+            if streamed_df is not None:
+                return streamed_df, bucket_seconds
+
+        columns = df_from_query(conn=conn, query=query_table_columns(spot_id, global_data_id))['column_name'].tolist()
+        query = query_bucketed_interval_timestamps(spot_id=spot_id,
+                                                   global_data_id=global_data_id,
+                                                   columns=columns,
+                                                   start_timestamp=start_timestamp,
+                                                   end_timestamp=end_timestamp,
+                                                   bucket_seconds=bucket_seconds)
+        return df_from_query(conn=conn, query=query), bucket_seconds
+
+    query_df = df_from_query(conn=conn, query=query, estimated_rows=estimated_rows)
+
+    if duckdb_engine.is_available():
+        try:
+            parquet_cache.write_closed_days(query_df, spot_id, global_data_id,
+                                            start_timestamp, end_timestamp, last_record_timestamp_int, cache_dir)
+        except OSError:
+            pass  # The cache is an optimization, the page must render without it
+    return query_df, None
+
+@tracing.traced('query')
+def prefetch_interval_queries(conn, spot_id, global_data_ids, start_timestamp, end_timestamp, last_record_timestamp_int):
+    """
+    Fetches at once, with the async engine, the Postgres reads of the intervals of a spot that
+    get_interval_df will make, so it then finds them in the memo of the rerun.
+
+    Variables already in the frame store or in the Parquet cache are skipped. The row estimates
+    and columns of the others go out in a first round, then the interval queries those estimates
+    lead to. Intervals bound for the COPY or streaming paths are left to get_interval_df.
+
+    Parameters:
+    - conn: The database connection object.
+    - spot_id (int): The ID of the spot.
+    - global_data_ids (list): The IDs of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+    - last_record_timestamp_int (int): The timestamp of the last record.
+
+    Returns:
+    - int: The number of queries fetched.
+    """
+    if not query_context.can_prefetch(conn):
+        return 0
+    namespace = query_context.get_namespace(conn)
+    cache_dir = parquet_cache.namespace_cache_dir(namespace)
+    interval_queries = {}
+    for global_data_id in global_data_ids:
+        store_key = frame_store.interval_key(namespace=namespace,
+                                             spot_id=spot_id,
+                                             global_data_id=global_data_id,
+                                             start_timestamp=start_timestamp,
+                                             end_timestamp=end_timestamp,
+                                             version=last_record_timestamp_int)
+        if frame_store.has_frame(store_key):
+            continue
+        if duckdb_engine.is_available() and parquet_cache.is_range_cached(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir):
+            continue
+        interval_queries[global_data_id] = query_interval_timestamps(spot_id=spot_id,
+                                                                     global_data_id=global_data_id,
+                                                                     start_timestamp=start_timestamp,
+                                                                     end_timestamp=end_timestamp)
+    if not interval_queries:
+        return 0
+
+    conn = query_context.route_historical(conn)
+    fetched = conn.prefetch([query_budget.query_explain(query) for query in interval_queries.values()] +
+                            [query_table_columns(spot_id, global_data_id) for global_data_id in interval_queries])
+
+    bucket_seconds = query_budget.choose_bucket_seconds(start_timestamp, end_timestamp)
+    read_queries = []
+    for global_data_id, query in interval_queries.items():
+        estimated_rows = query_budget.estimate_query_rows(conn=conn, query=query)
+        if query_budget.is_over_budget(estimated_rows):
+            if streaming.use_streaming(estimated_rows):
+                continue
+            columns = conn.query(query_table_columns(spot_id, global_data_id))['column_name'].tolist()
+            read_queries.append(query_bucketed_interval_timestamps(spot_id=spot_id,
+                                                                   global_data_id=global_data_id,
+                                                                   columns=columns,
+                                                                   start_timestamp=start_timestamp,
+                                                                   end_timestamp=end_timestamp,
+                                                                   bucket_seconds=bucket_seconds))
+        elif not bulk_fetch.use_bulk_fetch(estimated_rows):
+            read_queries.append(query)
+    return fetched + conn.prefetch(read_queries)
+
+def percentile_summary_from_df(df, percentiles):
+    """
+    Computes percentiles of every value column of an interval DataFrame.
+
+    Parameters:
+    - df (pandas.DataFrame): The raw rows of the interval.
+    - percentiles (list): The percentiles to compute, between 0 and 1.
+
+    Returns:
+    - pandas.DataFrame: One row per value column, one column per percentile (named 'p50', 'p95', ...).
+    """
+    value_df = df.drop(columns=['timestamp'])
+    summary_df = value_df.quantile(percentiles).T
+    summary_df.columns = [f'p{round(percentile * 100):g}' for percentile in percentiles]
+    summary_df = summary_df.rename_axis('variable').reset_index()
+    return summary_df
+
+def exceedance_counts_from_df(df, alarm_alert, alarm_critical):
+    """
+    Counts the samples of every value column of an interval DataFrame that reach the alarm thresholds.
+
+    Parameters:
+    - df (pandas.DataFrame): The raw rows of the interval.
+    - alarm_alert (float): The threshold value for the alert alarm.
+    - alarm_critical (float): The threshold value for the critical alarm.
+
+    Returns:
+    - pandas.DataFrame: One row per value column with 'samples', 'alert' and 'critical' counts.
+    """
+    value_df = df.drop(columns=['timestamp'])
+    counts_df = pd.DataFrame({'variable': value_df.columns,
+                              'samples': value_df.count().values,
+                              'alert': (value_df >= alarm_alert).sum().values,
+                              'critical': (value_df > alarm_critical).sum().values})
+    return counts_df
+
+@tracing.traced('transform')
+def get_interval_summary(df, spot_id, global_data_id, start_timestamp, end_timestamp, alarm_alert, alarm_critical, bucket_seconds=None, percentiles=(0.5, 0.95, 0.99), cache_dir=None, conn=None):
+    """
+    Computes the percentile summary and the alarm exceedance counts of an interval.
+
+    Intervals whose whole days are cached are summarized by the analytics engine over the raw
+    Parquet files and the rows of their partial days, read through conn, other intervals are summarized from the rows already retrieved. Aggregated rows would give
+    misleading percentiles and counts, so uncached aggregated intervals have no summary.
+
+    Parameters:
+    - df (pandas.DataFrame): The rows of the interval, with empty columns already removed.
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+    - alarm_alert (float): The threshold value for the alert alarm.
+    - alarm_critical (float): The threshold value for the critical alarm.
+    - bucket_seconds (int): The bucket width of aggregated rows, or None for raw rows.
+    - percentiles (tuple): The percentiles to compute, between 0 and 1.
+    - cache_dir (str): The root of the Parquet cache of the tenant. Defaults to the configured one.
+    - conn: The database connection object, which reads the partial days of a cached interval.
+
+    Returns:
+    - pandas.DataFrame: One row per value column with the percentiles and the exceedance counts, or None.
+    """
+    is_cached = duckdb_engine.is_available() and parquet_cache.is_range_cached(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir)
+    if is_cached and (conn is not None or not parquet_cache.edge_intervals(start_timestamp, end_timestamp)):
+        paths = parquet_cache.partition_paths_for_range(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir)
+        edges_df = None if conn is None else get_edge_rows_df(conn, spot_id, global_data_id, start_timestamp, end_timestamp)
+        percentiles_df = duckdb_engine.percentile_summary(paths, start_timestamp, end_timestamp, list(percentiles), edges_df)
+        counts_df = duckdb_engine.exceedance_counts(paths, start_timestamp, end_timestamp, alarm_alert, alarm_critical, edges_df)
+    elif bucket_seconds is not None:
+        return None
+    else:
+        percentiles_df = percentile_summary_from_df(df, list(percentiles))
+        counts_df = exceedance_counts_from_df(df, alarm_alert, alarm_critical)
+
+    summary_df = pd.merge(counts_df, percentiles_df, on='variable', how='inner')
+    summary_df = summary_df[summary_df['variable'].isin(df.columns)]
+    return summary_df
+
+def rename_summary_variables(summary_df, text_alias_df):
+    """
+    Replaces the column names listed in an interval summary by their aliases, ready to be displayed.
+
+    Parameters:
+    - summary_df (pandas.DataFrame): The summary returned by get_interval_summary.
+    - text_alias_df (pandas.DataFrame): A DataFrame with 'old_name' and 'new_name' columns.
+
+    Returns:
+    - pandas.DataFrame: The summary with the variables renamed and Portuguese headers.
+    """
+    aliases = dict(zip(text_alias_df['old_name'], text_alias_df['new_name']))
+    summary_df = summary_df.assign(variable=summary_df['variable'].map(lambda name: aliases.get(name, name)))
+    summary_df = summary_df.rename(columns={'variable': 'Variável',
+                                            'samples': 'Amostras',
+                                            'alert': 'Acima do alerta',
+                                            'critical': 'Acima do crítico'})
+    return summary_df
+
+def show_partial_plot(chart_placeholder, df, text_alias_df, variable_name, alarm_alert, alarm_critical):
+    """
+    Draws the data received so far of a streamed interval, replacing the previous drawing.
+
+    Parameters:
+    - chart_placeholder (streamlit.delta_generator.DeltaGenerator): The st.empty() slot of the chart.
+    - df (pandas.DataFrame): The averages received so far, with an integer 'timestamp' column.
+    - text_alias_df (pandas.DataFrame): A DataFrame with 'old_name' and 'new_name' columns.
+    - variable_name (str): The name of the variable.
+    - alarm_alert (float): The threshold value for the alert alarm.
+    - alarm_critical (float): The threshold value for the critical alarm.
+
+    Returns:
+    - None
+    """
+    partial_df = convert_timestamp_column(clear_empty_columns(df).copy())
+    partial_df.columns = get_new_names(variable_data_old_header=partial_df.columns.tolist(),
+                                       text_alias_df=text_alias_df)
+    fig = plot_dataframe_lines(df=partial_df,
+                               variable_name=variable_name,
+                               alarm_alert=alarm_alert,
+                               alarm_critical=alarm_critical)
+    with tracing.span('st.plotly_chart', 'render', partial=True):
+        chart_placeholder.plotly_chart(fig, theme="streamlit", use_container_width=True, config=config_to_plot())
+    figure_payload.record_payload('time_series_partial', fig)
+    return None
+
+@tracing.traced('transform')
 def convert_timestamp_column(df):
     """
     Converts the 'timestamp' column of a DataFrame to the correct datetime format and timezone.
@@ -190,6 +591,7 @@ def convert_timestamp_column(df):
     return df
 
 
+@tracing.traced('transform')
 def clear_empty_columns(df):
     """
     Removes columns from a DataFrame that contain only NaN values.
@@ -238,6 +640,7 @@ def get_variable_name_alarms(conn, spot_id, global_data_id):
     return variable_name_alarms_df
 
 
+@tracing.traced('transform')
 def get_new_names(variable_data_old_header, text_alias_df):
     """
     Returns the new names corresponding to the values in the provided list.
@@ -266,60 +669,93 @@ def get_text_alias_df(conn):
     text_alias_df = conn.query('SELECT * FROM text_aliases')
     return text_alias_df
 
+def query_anomalies(spot_id, global_data_id, start_timestamp, end_timestamp):
+    """
+    Constructs a SQL query to retrieve the anomalies found by the anomaly job within a given timestamp interval.
 
-def plot_dataframe_lines(df, variable_name, alarm_alert, alarm_critical):
+    Parameters:
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+
+    Returns:
+    - str: The constructed SQL query.
+    """
+    query = f"""
+            SELECT column_name, timestamp, value, score
+            FROM {anomaly_detection.ANOMALIES_TABLE}
+            WHERE spot_id = {spot_id}
+            AND global_data_id = {global_data_id}
+            AND timestamp >= {start_timestamp}
+            AND timestamp < {end_timestamp}
+            ORDER BY ABS(score) DESC
+            LIMIT {ANOMALY_MARKER_LIMIT}
+            """
+    return query
+
+@tracing.traced('query')
+def get_anomalies_df(conn, spot_id, global_data_id, start_timestamp, end_timestamp, text_alias_df):
+    """
+    Retrieves the anomalies of a variable within an interval, ready to be drawn over its time series.
+
+    Parameters:
+    - conn: The database connection object.
+    - spot_id (int): The ID of the spot.
+    - global_data_id (int): The ID of the global data.
+    - start_timestamp (int): The start timestamp of the interval.
+    - end_timestamp (int): The end timestamp of the interval.
+    - text_alias_df (pandas.DataFrame): A DataFrame with 'old_name' and 'new_name' columns.
+
+    Returns:
+    - pandas.DataFrame: The anomalies, with the column names renamed and the 'timestamp' column converted.
+    """
+    anomalies_df = query_context.route_historical(conn).query(query_anomalies(spot_id=spot_id,
+                                                                              global_data_id=global_data_id,
+                                                                              start_timestamp=start_timestamp,
+                                                                              end_timestamp=end_timestamp),
+                                                              ttl=ANOMALIES_CACHE_TTL_SECONDS)
+    anomalies_df = convert_timestamp_column(anomalies_df.copy())
+    new_names = dict(zip(text_alias_df['old_name'], text_alias_df['new_name']))
+    anomalies_df['column_name'] = [new_names.get(column, column) for column in anomalies_df['column_name']]
+    return anomalies_df
+
+
+@tracing.traced('figure')
+def plot_dataframe_lines(df, variable_name, alarm_alert, alarm_critical, anomalies_df=None):
     columns_list = df.columns.to_list()
     x_column = columns_list[-1]
     y_columns = columns_list[:-1]
-    fig = px.line(df, x=x_column, y=y_columns)
-    
-    fig.add_shape(
-        type="line",
-        x0=df[x_column].min(),
-        x1=df[x_column].max(),
-        y0=alarm_alert,
-        y1=alarm_alert,
-        line=dict(color="orange", dash="dash"),
-        name=f'Linha Constante ({alarm_alert})')
+    x_values = df[x_column].to_numpy()
+    x_min = df[x_column].min()
+    x_max = df[x_column].max()
+
+    traces = [{'x': x_values,
+               'y': df[y_column].to_numpy(dtype='float64', na_value=np.nan),
+               'name': y_column,
+               'legendgroup': y_column} for y_column in y_columns]
+    if anomalies_df is not None and len(anomalies_df):
+        traces.append({'x': anomalies_df['timestamp'].to_numpy(),
+                       'y': anomalies_df['value'].to_numpy(dtype='float64'),
+                       'mode': 'markers',
+                       'marker': {'color': 'red', 'symbol': 'x', 'size': 8},
+                       'name': 'Anomalias',
+                       'legendgroup': 'Anomalias',
+                       'text': anomalies_df['column_name'].to_numpy(),
+                       'customdata': anomalies_df['score'].to_numpy(dtype='float64'),
+                       'hovertemplate': '%{text}: %{y} (escore %{customdata:.1f})'})
+
+    fig = figure_factory.stamp_figure(
+        'time_series',
+        traces=traces,
+        shapes=[{'x0': x_min, 'x1': x_max, 'y0': alarm_alert, 'y1': alarm_alert,
+                 'name': f'Linha Constante ({alarm_alert})'},
+                {'x0': x_min, 'x1': x_max, 'y0': alarm_critical, 'y1': alarm_critical,
+                 'name': f'Linha Constante ({alarm_critical})'}],
+        layout={'title': {'text': variable_name},
+                'yaxis': {'title': {'text': variable_name}}})  # Trocar
     
-    fig.add_shape(
-        type="line",
-        x0=df[x_column].min(),
-        x1=df[x_column].max(),
-        y0=alarm_critical,
-        y1=alarm_critical,
-        line=dict(color="red", dash="dash"),
-        name=f'Linha Constante ({alarm_critical})')
-
-    fig.update_layout(legend=dict(
-        orientation="h",
-        yanchor="bottom",
-        y=1.02,
-        xanchor="right",
-        x=1,
-        title=""
-    ))
-
-    
-    fig.update_layout(
-        title=variable_name,
-        xaxis_title='Data e Hora',
-        yaxis_title=variable_name, # Trocar 
-        height=250,
-    )
-    
-    fig.update_traces(hovertemplate=None)
-
-    fig.update_layout(hovermode="x unified")
-        
-    fig.update_layout(
-        hoverlabel=dict(
-            bgcolor="white",
-            font_size=16,
-        )
-    )
-    
-    return fig
+    return figure_payload.compact_figure(fig)
 
 def config_to_plot():
     config = {'displayModeBar': True,
@@ -329,6 +765,7 @@ def config_to_plot():
     return config
 
 
+@tracing.traced('builder')
 def show_line_plots(column, spot_name_selected, last_record_timestamp_datetime, last_record_timestamp_int, variables_from_spot_df, spot_id_selected, conn):
     insert_column_title(column=column, spot_name_selected=spot_name_selected)
 
@@ -350,18 +787,14 @@ def show_line_plots(column, spot_name_selected, last_record_timestamp_datetime,
         start_timestamp, end_timestamp = get_timestamps_for_query(date_interval=date_interval,
                                                                   last_record_timestamp_int=last_record_timestamp_int)
 
+        prefetch_interval_queries(conn=conn,
+                                  spot_id=spot_id_selected,
+                                  global_data_ids=variables_from_spot_df['global_data_id'].tolist(),
+                                  start_timestamp=start_timestamp,
+                                  end_timestamp=end_timestamp,
+                                  last_record_timestamp_int=last_record_timestamp_int)
+
         for global_data_id in variables_from_spot_df['global_data_id']:
-            query = query_interval_timestamps(spot_id=spot_id_selected,
-                                              global_data_id=global_data_id,
-                                              start_timestamp=start_timestamp,
-                                              end_timestamp=end_timestamp)
-            
-            variable_data_df = df_from_query(conn=conn, query=query)
-            
-            variable_data_df = clear_empty_columns(variable_data_df)
-            
-            variable_data_df = convert_timestamp_column(variable_data_df)
-            
             variable_name_alarms_df = get_variable_name_alarms(conn=conn,
                                                                spot_id=spot_id_selected,
                                                                global_data_id= global_data_id)
@@ -373,24 +806,81 @@ def show_line_plots(column, spot_name_selected, last_record_timestamp_datetime,
             
             alarm_alert = variable_name_alarms_df['alarm_alert'].iloc[0]
 
-            variable_data_old_header = variable_data_df.columns.tolist()
-            
             text_alias_df = get_text_alias_df(conn=conn)
+
+            chart_placeholder = st.empty()
+
+            def on_progress(partial_df):
+                show_partial_plot(chart_placeholder=chart_placeholder,
+                                  df=partial_df,
+                                  text_alias_df=text_alias_df,
+                                  variable_name=variable_name,
+                                  alarm_alert=alarm_alert,
+                                  alarm_critical=alarm_critical)
+
+            variable_data_df, bucket_seconds = get_interval_df(conn=conn,
+                                                               spot_id=spot_id_selected,
+                                                               global_data_id=global_data_id,
+                                                               start_timestamp=start_timestamp,
+                                                               end_timestamp=end_timestamp,
+                                                               last_record_timestamp_int=last_record_timestamp_int,
+                                                               on_progress=on_progress)
+            
+            variable_data_df = clear_empty_columns(variable_data_df)
+
+            interval_summary_df = get_interval_summary(df=variable_data_df,
+                                                       spot_id=spot_id_selected,
+                                                       global_data_id=global_data_id,
+                                                       start_timestamp=start_timestamp,
+                                                       end_timestamp=end_timestamp,
+                                                       alarm_alert=alarm_alert,
+                                                       alarm_critical=alarm_critical,
+                                                       bucket_seconds=bucket_seconds,
+                                                       cache_dir=parquet_cache.namespace_cache_dir(query_context.get_namespace(conn)),
+                                                       conn=conn)
+            
+            variable_data_df = convert_timestamp_column(variable_data_df)
+
+            variable_data_old_header = variable_data_df.columns.tolist()
             
             variable_data_new_header = get_new_names(variable_data_old_header=variable_data_old_header,
                                                      text_alias_df=text_alias_df)
             
             variable_data_df.columns = variable_data_new_header
             
+            anomalies_df = None
+            if settings.ANOMALIES_ENABLED:
+                anomalies_df = get_anomalies_df(conn=conn,
+                                                spot_id=spot_id_selected,
+                                                global_data_id=global_data_id,
+                                                start_timestamp=start_timestamp,
+                                                end_timestamp=end_timestamp,
+                                                text_alias_df=text_alias_df)
             
             fig = plot_dataframe_lines(df = variable_data_df,
                                        variable_name=variable_name,
                                        alarm_alert=alarm_alert,
-                                       alarm_critical=alarm_critical)
+                                       alarm_critical=alarm_critical,
+                                       anomalies_df=anomalies_df)
             
             config = config_to_plot()
             
-            st.plotly_chart(fig, theme="streamlit", use_container_width=True, config = config)
+            with tracing.span('st.plotly_chart', 'render'):
+                chart_placeholder.plotly_chart(fig, theme="streamlit", use_container_width=True, config = config)
+            figure_payload.record_payload('time_series', fig)
+
+            if bucket_seconds is not None:
+                st.caption(f"Intervalo extenso: exibindo {query_budget.format_resolution(bucket_seconds)}.")
+
+            if settings.SPECTRA_ENABLED:
+                spectrum_plot_builder.show_spectrum(conn=conn,
+                                                    spot_id=spot_id_selected,
+                                                    global_data_id=global_data_id,
+                                                    variable_name=variable_name,
+                                                    start_timestamp=start_timestamp,
+                                                    end_timestamp=end_timestamp,
+                                                    text_alias_df=text_alias_df,
+                                                    config=config)
                         
             with st.expander("Arquivo para Exportação", expanded=False):
                 st.dataframe(variable_data_df, use_container_width=True)
@@ -400,5 +890,12 @@ def show_line_plots(column, spot_name_selected, last_record_timestamp_datetime,
                     file_name=f'{spot_name_selected}_{variable_name}.csv',
                     mime='text/csv',
                 )
+                st.markdown("###### Resumo do intervalo")
+                if interval_summary_df is None:
+                    st.caption("Resumo disponível apenas para dados brutos.")
+                else:
+                    st.dataframe(rename_summary_variables(summary_df=interval_summary_df, text_alias_df=text_alias_df),
+                                 use_container_width=True,
+                                 hide_index=True)
 
     return None
\ No newline at end of file
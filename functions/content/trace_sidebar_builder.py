@@ -0,0 +1,72 @@
+import streamlit as st
+import json
+import plotly.graph_objects as go
+
+from functions.monitoring import tracing
+
+STAGE_COLORS = {'rerun': '#2A4B80',
+                'builder': '#7F8C8D',
+                'query': '#E67E22',
+                'transform': '#27AE60',
+                'figure': '#8E44AD',
+                'render': '#C0392B'}
+
+
+def create_waterfall_plot(spans_df):
+    """
+    Creates a waterfall chart of the spans of a rerun, one bar per span in start order.
+
+    Args:
+        spans_df (DataFrame): The spans returned by tracing.spans_to_df().
+
+    Returns:
+        plotly.graph_objects.Figure: The waterfall chart.
+    """
+    labels = [f"{'  ' * depth}{index}. {name}" for index, (depth, name) in enumerate(zip(spans_df['depth'], spans_df['name']))]
+    fig = go.Figure(go.Bar(
+        x=spans_df['duration_ms'],
+        base=spans_df['start_ms'],
+        y=labels,
+        orientation='h',
+        marker_color=[STAGE_COLORS.get(stage, 'gray') for stage in spans_df['stage']],
+        customdata=spans_df[['stage', 'details']],
+        hovertemplate='%{y}<br>%{x:.1f} ms (%{customdata[0]})<br>%{customdata[1]}<extra></extra>',
+    ))
+    fig.update_layout(height=max(250, 18 * len(labels)),
+                      margin=dict(t=0, b=0, l=0, r=0),
+                      xaxis_title='ms',
+                      yaxis=dict(autorange='reversed', tickfont=dict(size=10)),
+                      showlegend=False)
+    return fig
+
+def show_trace_sidebar(spans, query_stats, frame_store_stats=None):
+    """
+    Displays the render-time breakdown of the rerun in the sidebar.
+
+    Args:
+        spans (list): The spans returned by tracing.finish_trace().
+        query_stats (dict): The memo counters of the rerun's QueryContext.
+        frame_store_stats (dict): The counters of the process-wide frame store, if shown.
+
+    Returns:
+        None
+    """
+    if not spans:
+        return None
+    spans_df = tracing.spans_to_df(spans)
+    with st.sidebar:
+        st.markdown('##### Tempo de renderização')
+        st.write(f"Rerun: {spans_df['duration_ms'].iloc[0]:.0f} ms — memo de consultas: "
+                 f"{query_stats['hits']} acertos / {query_stats['misses']} faltas")
+        if frame_store_stats is not None:
+            st.write(f"Frames compartilhados: {frame_store_stats['frames']} "
+                     f"({frame_store_stats['bytes'] / 2 ** 20:.1f} de {frame_store_stats['budget_bytes'] / 2 ** 20:.0f} MB) — "
+                     f"{frame_store_stats['hits']} acertos / {frame_store_stats['misses']} faltas / "
+                     f"{frame_store_stats['evictions']} despejos")
+        st.dataframe(tracing.stage_breakdown(spans), use_container_width=True, hide_index=True)
+        st.plotly_chart(create_waterfall_plot(spans_df), use_container_width=True, config={'displaylogo': False})
+        st.download_button(label='Exportar trace (Chrome JSON)',
+                           data=json.dumps(tracing.to_chrome_trace(spans)).encode('utf-8'),
+                           file_name='acodata_trace.json',
+                           mime='application/json')
+    return None
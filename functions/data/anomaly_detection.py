@@ -0,0 +1,218 @@
+"""
+Anomaly detection on the spot variables: rolling z-scores of every column.
+
+Each sample is scored against the samples before it: the distance from the rolling mean in
+rolling standard deviations ('zscore'), or from the rolling median in rolling MADs scaled to
+match a standard deviation on normal data ('robust', which a few outliers in the window do not
+move). The scores catch slow drifts and sudden jumps that stay under the fixed alarm thresholds.
+
+Samples scoring at least the threshold are stored in ANOMALIES_TABLE, and the last timestamp
+scored of each variable in ANOMALY_PROGRESS_TABLE, so functions.jobs.anomalies only reads new
+rows, plus the two windows before them.
+"""
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+ANOMALIES_TABLE = 'spot_anomalies'
+ANOMALY_PROGRESS_TABLE = 'spot_anomaly_progress'
+ANOMALY_METHODS = ('zscore', 'robust')
+
+# Scales a MAD to the standard deviation of normally distributed values
+MAD_TO_STD = 1.4826
+# Values (rows x window samples) of the windows held at once by rolling_median_and_mad
+MAD_BLOCK_CELLS = 2 ** 22
+
+
+def query_create_anomalies_table():
+    """
+    Constructs the SQL that creates the table of the anomalous samples of every column.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""CREATE TABLE IF NOT EXISTS {ANOMALIES_TABLE} (
+                    spot_id integer NOT NULL,
+                    global_data_id integer NOT NULL,
+                    column_name text NOT NULL,
+                    timestamp bigint NOT NULL,
+                    value double precision NOT NULL,
+                    baseline double precision NOT NULL,
+                    score double precision NOT NULL,
+                    PRIMARY KEY (spot_id, global_data_id, timestamp, column_name)
+                );"""
+    return query
+
+def query_create_anomaly_progress_table():
+    """
+    Constructs the SQL that creates the table holding the last timestamp scored of every spot variable.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""CREATE TABLE IF NOT EXISTS {ANOMALY_PROGRESS_TABLE} (
+                    spot_id integer NOT NULL,
+                    global_data_id integer NOT NULL,
+                    last_timestamp bigint NOT NULL,
+                    PRIMARY KEY (spot_id, global_data_id)
+                );"""
+    return query
+
+def create_anomaly_tables(connection):
+    """
+    Creates the anomalies and progress tables if they do not exist.
+
+    Args:
+        connection: A psycopg2 connection.
+
+    Returns:
+        None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query_create_anomalies_table())
+        cursor.execute(query_create_anomaly_progress_table())
+    connection.commit()
+    return None
+
+def rolling_median_and_mad(values, window_samples, min_periods):
+    """
+    Computes the median and the median absolute deviation (MAD) of the window ending at every sample.
+
+    The deviations are taken from the median of the window itself, which a rolling median of the
+    deviations from each sample's own median does not do: on a drifting signal that mixes the
+    medians of older windows in, and inflates the spread. The windows are views of the values,
+    copied in blocks of MAD_BLOCK_CELLS to bound the memory.
+
+    Args:
+        values (ndarray): The values of one column, in timestamp order.
+        window_samples (int): The number of samples of the window.
+        min_periods (int): The number of non-missing values a window needs.
+
+    Returns:
+        tuple: The median and the MAD of each window, arrays like values (NaN below min_periods).
+    """
+    padded = np.concatenate([np.full(window_samples - 1, np.nan), values])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window_samples)
+    median = np.full(len(values), np.nan)
+    mad = np.full(len(values), np.nan)
+    block_rows = max(MAD_BLOCK_CELLS // window_samples, 1)
+    for start in range(0, len(values), block_rows):
+        block = windows[start:start + block_rows]
+        missing = np.isnan(block)
+        valid = (window_samples - np.count_nonzero(missing, axis=1)) >= min_periods
+        if not valid.any():
+            continue
+        block = block[valid]
+        # np.median partitions the whole block at once; np.nanmedian goes row by row, so it is kept for gaps
+        median_function = np.nanmedian if missing[valid].any() else np.median
+        block_median = median_function(block, axis=1)
+        block_mad = median_function(np.abs(block - block_median[:, np.newaxis]), axis=1)
+        median[start:start + block_rows][valid] = block_median
+        mad[start:start + block_rows][valid] = block_mad
+    return median, mad
+
+def rolling_scores(values_df, window_samples, method):
+    """
+    Scores every sample against the window of samples before it, all columns at once.
+
+    Samples with fewer than half a window before them, or whose window has no spread (a
+    constant signal), get no score.
+
+    Args:
+        values_df (DataFrame): The value columns, in timestamp order.
+        window_samples (int): The number of samples of the window.
+        method (str): 'zscore' (mean and standard deviation) or 'robust' (median and MAD).
+
+    Returns:
+        tuple: The scores and the baselines (rolling mean or median), DataFrames like values_df.
+    """
+    if method not in ANOMALY_METHODS:
+        raise ValueError(f'Unknown anomaly method {method!r}, expected one of {ANOMALY_METHODS}.')
+    min_periods = max(window_samples // 2, 2)
+    rolling = values_df.rolling(window_samples, min_periods=min_periods)
+    if method == 'robust':
+        center = pd.DataFrame(index=values_df.index, columns=values_df.columns, dtype='float64')
+        spread = center.copy()
+        for column in values_df.columns:
+            median, mad = rolling_median_and_mad(values_df[column].to_numpy(dtype='float64'), window_samples, min_periods)
+            center[column] = median
+            spread[column] = mad * MAD_TO_STD
+    else:
+        center = rolling.mean()
+        spread = rolling.std()
+    # The window of a sample ends at the sample before it, so an outlier never hides itself
+    baseline = center.shift(1)
+    spread = spread.shift(1)
+    scores = (values_df - baseline) / spread.where(spread > 0)
+    return scores, baseline
+
+def detect_anomalies(history_df, new_df, window_samples, method, threshold):
+    """
+    Finds the anomalous samples of new rows, scored with the rows before them.
+
+    Args:
+        history_df (DataFrame): The last rows already scored (one window gives the scores of a single
+            pass), value columns and 'timestamp'.
+        new_df (DataFrame): The new rows, with the same columns, in timestamp order.
+        window_samples (int): The number of samples of the window.
+        method (str): 'zscore' or 'robust'.
+        threshold (float): The absolute score from which a sample is anomalous.
+
+    Returns:
+        DataFrame: One row per anomalous value, with 'column_name', 'timestamp', 'value', 'baseline' and 'score'.
+    """
+    rows_df = pd.concat([history_df, new_df], ignore_index=True) if len(history_df) else new_df.reset_index(drop=True)
+    value_columns = [column for column in rows_df.columns if column != 'timestamp']
+    values_df = rows_df[value_columns].astype('float64')
+    scores, baseline = rolling_scores(values_df, window_samples, method)
+
+    new_rows = slice(len(rows_df) - len(new_df), len(rows_df))
+    score_values = scores.to_numpy()[new_rows]
+    with np.errstate(invalid='ignore'):
+        row_index, column_index = np.nonzero(np.abs(score_values) >= threshold)
+    return pd.DataFrame({'column_name': np.asarray(value_columns, dtype=object)[column_index],
+                         'timestamp': rows_df['timestamp'].to_numpy()[new_rows][row_index],
+                         'value': values_df.to_numpy()[new_rows][row_index, column_index],
+                         'baseline': baseline.to_numpy()[new_rows][row_index, column_index],
+                         'score': score_values[row_index, column_index]})
+
+def write_anomalies(connection, spot_id, global_data_id, anomalies_df, last_timestamp, page_size=5000):
+    """
+    Stores the anomalies of new rows and moves the progress of the variable past them, in one transaction.
+
+    Args:
+        connection: A psycopg2 connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        anomalies_df (DataFrame): The anomalies returned by detect_anomalies.
+        last_timestamp (int): The last timestamp scored.
+        page_size (int): The number of rows per INSERT statement.
+
+    Returns:
+        None
+    """
+    rows = [(int(spot_id), int(global_data_id), row.column_name, int(row.timestamp), float(row.value), float(row.baseline), float(row.score))
+            for row in anomalies_df.itertuples(index=False)]
+    try:
+        with connection.cursor() as cursor:
+            if rows:
+                execute_values(cursor,
+                               f"""INSERT INTO {ANOMALIES_TABLE}
+                                       (spot_id, global_data_id, column_name, timestamp, value, baseline, score)
+                                   VALUES %s
+                                   ON CONFLICT (spot_id, global_data_id, timestamp, column_name) DO UPDATE SET
+                                       value = EXCLUDED.value,
+                                       baseline = EXCLUDED.baseline,
+                                       score = EXCLUDED.score;""",
+                               rows,
+                               page_size=page_size)
+            cursor.execute(f"""INSERT INTO {ANOMALY_PROGRESS_TABLE} (spot_id, global_data_id, last_timestamp)
+                               VALUES (%s, %s, %s)
+                               ON CONFLICT (spot_id, global_data_id)
+                               DO UPDATE SET last_timestamp = GREATEST({ANOMALY_PROGRESS_TABLE}.last_timestamp, EXCLUDED.last_timestamp);""",
+                           (int(spot_id), int(global_data_id), int(last_timestamp)))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return None
@@ -0,0 +1,265 @@
+"""
+Asyncio engine for the fan-out reads of a spot: every per-variable query at once.
+
+The per-variable reads of a spot (alarms, last records, row estimates, intervals) are issued
+concurrently over a small pool of connections per database, instead of one after the other.
+One event loop thread serves every session of the process, so the fan-out costs no thread per
+query. The connections use the asynchronous mode of psycopg2 (already the driver of the
+dashboard), driven by the event loop through the readiness of their sockets.
+
+Each query has a timeout, after which it is cancelled on the server. Sessions wait through a
+sync bridge that also watches for a new run of the script: when the operator switches spot
+mid-load, the pending queries are cancelled and Streamlit starts the new run right away.
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+from streamlit.runtime.scriptrunner import RerunException, StopException, get_script_run_ctx
+
+from functions.data import settings
+
+# How often a waiting session checks whether the operator asked for a new run
+BRIDGE_POLL_SECONDS = 0.05
+
+loop_lock = threading.Lock()
+engine_state = {'loop': None}
+connection_pools = {}
+
+
+async def wait_until_ready(pg_conn):
+    """
+    Waits, without blocking the event loop, until an asynchronous psycopg2 connection finished its current operation.
+
+    Args:
+        pg_conn: A psycopg2 connection opened with async_=True.
+
+    Returns:
+        None
+
+    Raises:
+        psycopg2.Error: If the operation failed on the server.
+    """
+    loop = asyncio.get_running_loop()
+    file_descriptor = pg_conn.fileno()
+    while True:
+        state = pg_conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return None
+        ready = loop.create_future()
+
+        def set_ready():
+            if not ready.done():
+                ready.set_result(None)
+
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(file_descriptor, set_ready)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(file_descriptor)
+        else:
+            loop.add_writer(file_descriptor, set_ready)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(file_descriptor)
+
+
+class AsyncConnectionPool:
+    """
+    Connections of one database for the event loop, at most `size` of them in use at once.
+
+    Connections are opened on demand and kept for the next queries. A connection whose query
+    failed or was cancelled is closed instead, so the next query never finds it mid-protocol.
+    """
+
+    def __init__(self, connect_args, connect_kwargs, size):
+        """
+        Args:
+            connect_args (list): The positional arguments of psycopg2.connect().
+            connect_kwargs (dict): The keyword arguments of psycopg2.connect().
+            size (int): The most connections in use at once.
+        """
+        self.connect_args = connect_args
+        self.connect_kwargs = connect_kwargs
+        self.semaphore = asyncio.Semaphore(size)
+        self.idle_connections = []
+
+    async def acquire(self):
+        """Returns a connection ready for a query, waiting for a free slot of the pool."""
+        await self.semaphore.acquire()
+        try:
+            while self.idle_connections:
+                pg_conn = self.idle_connections.pop()
+                if not pg_conn.closed:
+                    return pg_conn
+            pg_conn = psycopg2.connect(*self.connect_args, async_=True, **self.connect_kwargs)
+            await wait_until_ready(pg_conn)
+            return pg_conn
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, pg_conn, reusable):
+        """Gives a connection back to the pool, closing it if it cannot serve another query."""
+        if reusable:
+            self.idle_connections.append(pg_conn)
+        elif not pg_conn.closed:
+            pg_conn.close()
+        self.semaphore.release()
+
+    async def fetch_df(self, query):
+        """
+        Runs a query on a connection of the pool.
+
+        Args:
+            query (str): The SQL query.
+
+        Returns:
+            DataFrame: The result of the query.
+        """
+        pg_conn = await self.acquire()
+        reusable = False
+        try:
+            cursor = pg_conn.cursor()
+            cursor.execute(query)
+            try:
+                await wait_until_ready(pg_conn)
+            except asyncio.CancelledError:
+                pg_conn.cancel()  # Stops the query on the server, not only the wait
+                raise
+            columns = [column.name for column in cursor.description]
+            rows = cursor.fetchall()
+            cursor.close()
+            reusable = True
+        finally:
+            self.release(pg_conn, reusable)
+        # coerce_float turns NUMERIC values into floats, as conn.query (pandas.read_sql) does
+        return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+
+def get_event_loop():
+    """
+    Returns the event loop of the engine, started in a daemon thread once per process.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running event loop.
+    """
+    with loop_lock:
+        if engine_state['loop'] is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='acodata-async', daemon=True).start()
+            engine_state['loop'] = loop
+        return engine_state['loop']
+
+def get_pool(engine):
+    """
+    Returns the pool of the database of a SQLAlchemy engine, created on first use.
+
+    Only called from the event loop, which owns the pools.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the Streamlit connection.
+
+    Returns:
+        AsyncConnectionPool: The pool.
+    """
+    if engine.url not in connection_pools:
+        # The same psycopg2.connect() arguments SQLAlchemy uses, so the pool reaches the same database
+        connect_args, connect_kwargs = engine.dialect.create_connect_args(engine.url)
+        connection_pools[engine.url] = AsyncConnectionPool(connect_args, connect_kwargs, settings.ASYNC_POOL_SIZE)
+    return connection_pools[engine.url]
+
+async def fetch_all(engine, queries, timeout_seconds):
+    """
+    Runs queries concurrently, cancelling the others as soon as one fails.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the Streamlit connection.
+        queries (list): The SQL queries.
+        timeout_seconds (float): The timeout of each query.
+
+    Returns:
+        list: The DataFrame of each query, in order.
+
+    Raises:
+        TimeoutError: If a query did not finish within its timeout.
+    """
+    pool = get_pool(engine)
+    tasks = [asyncio.ensure_future(asyncio.wait_for(pool.fetch_df(query), timeout_seconds)) for query in queries]
+    try:
+        return await asyncio.gather(*tasks)
+    except asyncio.TimeoutError as error:
+        raise TimeoutError(f'A query took longer than {timeout_seconds} s and was cancelled.') from error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def get_yield_check(ctx):
+    """
+    Returns the check that raises Streamlit's rerun or stop exception when a new run was requested.
+
+    Streamlit >= 1.37 exposes it as ScriptRunContext.yield_check. Older versions (the pinned 1.29)
+    only expose the requests queue of the session, which is read the way the script runner reads it
+    at its own yield points.
+
+    Args:
+        ctx (ScriptRunContext): The context of the current script run, or None outside of a run.
+
+    Returns:
+        callable: The check, or None when there is no run to watch.
+    """
+    if ctx is None:
+        return None
+    yield_check = getattr(ctx, 'yield_check', None)
+    if yield_check is not None:
+        return yield_check
+    script_requests = getattr(ctx, 'script_requests', None)
+    if script_requests is None:
+        return None
+
+    def check_script_requests():
+        request = script_requests.on_scriptrunner_yield()
+        if request is None:
+            return None
+        # ScriptRequestType moved modules across versions; its member names did not
+        if request.type.name == 'RERUN':
+            raise RerunException(request.rerun_data)
+        raise StopException()
+
+    return check_script_requests
+
+def run_queries(engine, queries, timeout_seconds=None):
+    """
+    Runs queries concurrently on the event loop of the engine, waiting for them from the calling thread.
+
+    While waiting, a session checks every BRIDGE_POLL_SECONDS whether Streamlit asked for a new
+    run (the operator switched spot): the queries are then cancelled and Streamlit's rerun
+    exception is raised, as it would be at the next Streamlit call of the script.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the Streamlit connection.
+        queries (list): The SQL queries.
+        timeout_seconds (float): The timeout of each query. Defaults to ASYNC_QUERY_TIMEOUT_SECONDS.
+
+    Returns:
+        list: The DataFrame of each query, in order.
+    """
+    if timeout_seconds is None:
+        timeout_seconds = settings.ASYNC_QUERY_TIMEOUT_SECONDS
+    loop = get_event_loop()
+    future = asyncio.run_coroutine_threadsafe(fetch_all(engine, queries, timeout_seconds), loop)
+    yield_check = get_yield_check(get_script_run_ctx(suppress_warning=True))
+    try:
+        while True:
+            done, _ = concurrent.futures.wait([future], timeout=BRIDGE_POLL_SECONDS)
+            if done:
+                return future.result()
+            if yield_check is not None:
+                yield_check()
+    finally:
+        future.cancel()
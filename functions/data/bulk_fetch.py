@@ -0,0 +1,85 @@
+import io
+
+import pandas as pd
+
+from functions.data import settings
+
+try:
+    import pyarrow.csv as pyarrow_csv
+except ImportError:  # Without pyarrow the CSV is parsed by the pandas C engine
+    pyarrow_csv = None
+
+
+def query_copy_to_stdout(query):
+    """
+    Wraps a SELECT query into a COPY that streams its result as CSV.
+
+    Args:
+        query (str): The SELECT query, without a trailing semicolon.
+
+    Returns:
+        str: The COPY query.
+    """
+    return f'COPY ({query.strip().rstrip(";")}) TO STDOUT WITH (FORMAT csv, HEADER true)'
+
+def use_bulk_fetch(estimated_rows):
+    """
+    Checks whether a result is large enough to be worth the COPY path.
+
+    Args:
+        estimated_rows (int): The estimated number of rows, or None if unknown.
+
+    Returns:
+        bool: True if the result should be fetched with COPY.
+    """
+    return estimated_rows is not None and estimated_rows > settings.BULK_FETCH_ROW_THRESHOLD
+
+def df_from_csv_buffer(buffer):
+    """
+    Parses a CSV buffer into a DataFrame, with pyarrow when available.
+
+    Args:
+        buffer (io.BytesIO): The CSV data, with a header line.
+
+    Returns:
+        DataFrame: The parsed data.
+    """
+    if pyarrow_csv is not None:
+        return pyarrow_csv.read_csv(buffer).to_pandas()
+    return pd.read_csv(buffer)
+
+def copy_to_buffer(conn, query):
+    """
+    Runs a query through COPY ... TO STDOUT on a raw psycopg2 connection taken from the pool.
+
+    Args:
+        conn: The Streamlit SQL connection to the database.
+        query (str): The SELECT query, without a trailing semicolon.
+
+    Returns:
+        io.BytesIO: The CSV result, rewound to the start.
+    """
+    buffer = io.BytesIO()
+    raw_connection = conn.engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor()
+        cursor.copy_expert(query_copy_to_stdout(query), buffer)
+        cursor.close()
+        raw_connection.commit()
+    finally:
+        raw_connection.close()  # Returns the connection to the pool
+    buffer.seek(0)
+    return buffer
+
+def df_from_copy(conn, query):
+    """
+    Retrieves the result of a query as a DataFrame through COPY, without per-row Python objects.
+
+    Args:
+        conn: The Streamlit SQL connection to the database.
+        query (str): The SELECT query, without a trailing semicolon.
+
+    Returns:
+        DataFrame: The result of the query.
+    """
+    return df_from_csv_buffer(copy_to_buffer(conn=conn, query=query))
@@ -0,0 +1,62 @@
+import sqlalchemy
+import toml
+from sqlalchemy.engine import URL
+
+from functions.data import settings
+
+
+def get_connection_secrets(name='postgresql', secrets_path=None):
+    """
+    Reads the parameters of a named connection from the Streamlit secrets file.
+
+    Args:
+        name (str): The name of the connection, as given to st.connection().
+        secrets_path (str): The path of secrets.toml. Defaults to the configured SECRETS_PATH.
+
+    Returns:
+        dict: The parameters of the [connections.<name>] section.
+    """
+    if secrets_path is None:
+        secrets_path = settings.SECRETS_PATH
+    secrets = toml.load(secrets_path)
+    return secrets['connections'][name]
+
+def database_url_from_secrets(connection_secrets):
+    """
+    Builds the SQLAlchemy URL of a connection the same way st.connection(type="sql") does.
+
+    Args:
+        connection_secrets (dict): The parameters of the connection ('url', or 'dialect', 'host', ...).
+
+    Returns:
+        sqlalchemy.engine.URL: The database URL.
+    """
+    if 'url' in connection_secrets:
+        return sqlalchemy.engine.make_url(connection_secrets['url'])
+    driver = connection_secrets.get('driver')
+    return URL.create(drivername=connection_secrets['dialect'] + (f'+{driver}' if driver else ''),
+                      username=connection_secrets.get('username'),
+                      password=connection_secrets.get('password'),
+                      host=connection_secrets.get('host'),
+                      port=int(connection_secrets['port']) if 'port' in connection_secrets else None,
+                      database=connection_secrets.get('database'),
+                      query=connection_secrets.get('query', {}))
+
+def create_engine(name='postgresql', url=None, **kwargs):
+    """
+    Creates a SQLAlchemy engine for the commands that run outside Streamlit.
+
+    The URL is taken, in order, from the argument, from ACODATA_DATABASE_URL or from the
+    Streamlit secrets file, so the commands reach the same database as the dashboard.
+
+    Args:
+        name (str): The name of the connection in secrets.toml.
+        url (str): An explicit database URL.
+        **kwargs: Extra arguments for sqlalchemy.create_engine().
+
+    Returns:
+        sqlalchemy.engine.Engine: The engine.
+    """
+    if url is None:
+        url = settings.DATABASE_URL or database_url_from_secrets(get_connection_secrets(name))
+    return sqlalchemy.create_engine(url, **kwargs)
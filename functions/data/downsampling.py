@@ -0,0 +1,78 @@
+import pandas as pd
+
+
+def aggregate_chunk(chunk_df, bucket_seconds):
+    """
+    Reduces a chunk of raw rows to per-bucket sums and sample counts.
+
+    Args:
+        chunk_df (DataFrame): Raw rows with an integer 'timestamp' column.
+        bucket_seconds (int): The width of each bucket in seconds.
+
+    Returns:
+        tuple: The sums and the counts of every value column, both indexed by bucket start.
+    """
+    buckets = (chunk_df['timestamp'] // bucket_seconds) * bucket_seconds
+    grouped = chunk_df.drop(columns=['timestamp']).groupby(buckets.rename('timestamp'))
+    return grouped.sum(), grouped.count()
+
+def merge_partials(partial, chunk_partial):
+    """
+    Merges the per-bucket sums and counts of a new chunk into the accumulated ones.
+
+    Buckets split across two chunks are combined, so the merged result is the same as
+    aggregating all rows at once.
+
+    Args:
+        partial (tuple): The accumulated sums and counts, or None before the first chunk.
+        chunk_partial (tuple): The sums and counts of the new chunk.
+
+    Returns:
+        tuple: The merged sums and counts.
+    """
+    if partial is None:
+        return chunk_partial
+    sums_df = pd.concat([partial[0], chunk_partial[0]]).groupby(level=0).sum()
+    counts_df = pd.concat([partial[1], chunk_partial[1]]).groupby(level=0).sum()
+    return sums_df, counts_df
+
+def partial_to_df(partial):
+    """
+    Turns accumulated sums and counts into a DataFrame of bucket averages.
+
+    Args:
+        partial (tuple): The accumulated sums and counts.
+
+    Returns:
+        DataFrame: The averages of every value column, with the bucket start as the last
+        column 'timestamp', like the rows of a spot variable table.
+    """
+    sums_df, counts_df = partial
+    means_df = sums_df / counts_df.where(counts_df > 0)
+    means_df = means_df.sort_index().reset_index()
+    return means_df[[column for column in means_df.columns if column != 'timestamp'] + ['timestamp']]
+
+def downsample_chunks(chunks, bucket_seconds, on_progress=None):
+    """
+    Averages a stream of raw chunks into fixed time buckets, one chunk at a time.
+
+    Memory stays at one chunk plus one row per bucket, whatever the size of the stream.
+    The averages so far are reported each time a new chunk arrives, so the caller draws
+    every intermediate state once and the final state only from the returned result.
+
+    Args:
+        chunks (iterable): The DataFrames of raw rows, each with an integer 'timestamp' column.
+        bucket_seconds (int): The width of each bucket in seconds.
+        on_progress (callable): Called with the averages so far before merging each new chunk.
+
+    Returns:
+        DataFrame: The averages of the whole stream, or None if the stream was empty.
+    """
+    partial = None
+    for chunk_df in chunks:
+        if partial is not None and on_progress is not None:
+            on_progress(partial_to_df(partial))
+        partial = merge_partials(partial, aggregate_chunk(chunk_df, bucket_seconds))
+    if partial is None:
+        return None
+    return partial_to_df(partial)
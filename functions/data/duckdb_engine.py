@@ -0,0 +1,205 @@
+import importlib.util
+
+from functions.data import settings
+from functions.monitoring import tracing
+
+# DuckDB is optional, without it every query goes to Postgres. It is only imported by the first
+# query on the Parquet cache: most reruns never read it, and the import is a sizeable part of the
+# startup of a new process (see benchmarks.import_profile)
+DUCKDB_INSTALLED = importlib.util.find_spec('duckdb') is not None
+
+# Name under which the rows of the partial days of an interval are visible to a query
+EDGE_ROWS_TABLE = 'edge_rows'
+
+
+def is_available():
+    """
+    Checks whether the in-process analytics engine can be used.
+
+    Returns:
+        bool: True if DuckDB is installed and enabled in the settings.
+    """
+    return DUCKDB_INSTALLED and settings.ANALYTICS_ENGINE == 'duckdb'
+
+def quote_identifier(name):
+    """
+    Quotes a column name to be used in a DuckDB query.
+
+    Args:
+        name (str): The column name.
+
+    Returns:
+        str: The quoted column name.
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def parquet_source(paths, edges_df=None):
+    """
+    Builds the table expression reading a list of Parquet files.
+
+    Args:
+        paths (list): The paths of the Parquet files.
+        edges_df (DataFrame): Rows read from Postgres to add to the files (the partial days at the
+            ends of an interval), registered by run_query as EDGE_ROWS_TABLE. None for the files alone.
+
+    Returns:
+        str: The read_parquet() table expression.
+    """
+    files = ', '.join("'" + path.replace("'", "''") + "'" for path in paths)
+    source = f'read_parquet([{files}], union_by_name=true)'
+    if edges_df is None:
+        return source
+    return f'(SELECT * FROM {source} UNION ALL BY NAME SELECT * FROM {EDGE_ROWS_TABLE})'
+
+@tracing.traced('query', name='duckdb')
+def run_query(query, parameters=None, edges_df=None):
+    """
+    Executes a query on a fresh in-memory DuckDB connection.
+
+    Args:
+        query (str): The SQL query to be executed.
+        parameters (list): The values of the query placeholders.
+        edges_df (DataFrame): Rows registered as EDGE_ROWS_TABLE for the query, or None.
+
+    Returns:
+        DataFrame: The result of the query as a pandas DataFrame.
+    """
+    import duckdb
+
+    with duckdb.connect() as con:
+        if edges_df is not None:
+            con.register(EDGE_ROWS_TABLE, edges_df)
+        return con.execute(query, parameters or []).df()
+
+def get_value_columns(paths, edges_df=None):
+    """
+    Lists the value columns (every column except 'timestamp') of the cached files.
+
+    Args:
+        paths (list): The paths of the Parquet files.
+        edges_df (DataFrame): Rows read from Postgres to add to the files, or None.
+
+    Returns:
+        list: The names of the value columns, in table order.
+    """
+    schema_df = run_query(f'DESCRIBE SELECT * FROM {parquet_source(paths, edges_df)}', edges_df=edges_df)
+    return [name for name in schema_df['column_name'] if name != 'timestamp']
+
+def query_interval(paths, start_timestamp, end_timestamp, edges_df=None):
+    """
+    Retrieves the raw rows of an interval from the cached files.
+
+    Args:
+        paths (list): The paths of the Parquet files of the whole days of the interval.
+        edges_df (DataFrame): The rows of its partial days, read from Postgres, or None.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        DataFrame: The rows of the interval, with the same columns as the Postgres table.
+    """
+    query = f"""SELECT *
+                FROM {parquet_source(paths, edges_df)}
+                WHERE timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp"""
+    return run_query(query, [start_timestamp, end_timestamp], edges_df)
+
+def count_rows(paths, start_timestamp, end_timestamp, edges_df=None):
+    """
+    Counts the cached rows of an interval.
+
+    Args:
+        paths (list): The paths of the Parquet files of the whole days of the interval.
+        edges_df (DataFrame): The rows of its partial days, read from Postgres, or None.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        int: The number of rows of the interval.
+    """
+    query = f"""SELECT COUNT(*) AS rows
+                FROM {parquet_source(paths, edges_df)}
+                WHERE timestamp >= ? AND timestamp < ?"""
+    return int(run_query(query, [start_timestamp, end_timestamp], edges_df)['rows'].iloc[0])
+
+def bucketed_aggregation(paths, start_timestamp, end_timestamp, bucket_seconds, edges_df=None):
+    """
+    Averages the rows of an interval into fixed time buckets.
+
+    Args:
+        paths (list): The paths of the Parquet files of the whole days of the interval.
+        edges_df (DataFrame): The rows of its partial days, read from Postgres, or None.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        bucket_seconds (int): The width of each bucket in seconds.
+
+    Returns:
+        DataFrame: One row per bucket, with the value columns averaged and the bucket start as 'timestamp'.
+    """
+    value_columns = get_value_columns(paths, edges_df)
+    averages = ', '.join(f'AVG({quote_identifier(name)}) AS {quote_identifier(name)}' for name in value_columns)
+    bucket = f'(timestamp // {int(bucket_seconds)}) * {int(bucket_seconds)}'
+    query = f"""SELECT {averages}, {bucket} AS timestamp
+                FROM {parquet_source(paths, edges_df)}
+                WHERE timestamp >= ? AND timestamp < ?
+                GROUP BY {bucket}
+                ORDER BY timestamp"""
+    return run_query(query, [start_timestamp, end_timestamp], edges_df)
+
+def percentile_summary(paths, start_timestamp, end_timestamp, percentiles, edges_df=None):
+    """
+    Computes percentiles of every value column over an interval.
+
+    Args:
+        paths (list): The paths of the Parquet files of the whole days of the interval.
+        edges_df (DataFrame): The rows of its partial days, read from Postgres, or None.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        percentiles (list): The percentiles to compute, between 0 and 1.
+
+    Returns:
+        DataFrame: One row per value column, one column per percentile (named 'p50', 'p95', ...).
+    """
+    value_columns = get_value_columns(paths, edges_df)
+    selects = []
+    for name in value_columns:
+        quantiles = ', '.join(f'QUANTILE_CONT({quote_identifier(name)}, {float(percentile)}) AS p{round(percentile * 100):g}'
+                              for percentile in percentiles)
+        selects.append(f"""SELECT '{name.replace("'", "''")}' AS variable, {quantiles}
+                           FROM source""")
+    query = f"""WITH source AS (SELECT * FROM {parquet_source(paths, edges_df)}
+                                WHERE timestamp >= ? AND timestamp < ?)
+                {' UNION ALL '.join(selects)}"""
+    return run_query(query, [start_timestamp, end_timestamp], edges_df)
+
+def exceedance_counts(paths, start_timestamp, end_timestamp, alarm_alert, alarm_critical, edges_df=None):
+    """
+    Counts the samples of every value column that reach the alarm thresholds over an interval.
+
+    The thresholds follow the colors of the last record panel: values above the critical alarm
+    are critical, values from the alert alarm up are alerts.
+
+    Args:
+        paths (list): The paths of the Parquet files of the whole days of the interval.
+        edges_df (DataFrame): The rows of its partial days, read from Postgres, or None.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        alarm_alert (float): The threshold value for the alert alarm.
+        alarm_critical (float): The threshold value for the critical alarm.
+
+    Returns:
+        DataFrame: One row per value column with 'samples', 'alert' and 'critical' counts.
+    """
+    value_columns = get_value_columns(paths, edges_df)
+    selects = []
+    for name in value_columns:
+        column = quote_identifier(name)
+        selects.append(f"""SELECT '{name.replace("'", "''")}' AS variable,
+                                  COUNT({column}) AS samples,
+                                  COUNT(*) FILTER (WHERE {column} >= {float(alarm_alert)}) AS alert,
+                                  COUNT(*) FILTER (WHERE {column} > {float(alarm_critical)}) AS critical
+                           FROM source""")
+    query = f"""WITH source AS (SELECT * FROM {parquet_source(paths, edges_df)}
+                                WHERE timestamp >= ? AND timestamp < ?)
+                {' UNION ALL '.join(selects)}"""
+    return run_query(query, [start_timestamp, end_timestamp], edges_df)
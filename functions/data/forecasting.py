@@ -0,0 +1,281 @@
+"""
+Time-to-threshold forecasting of the spot variables: when each column will reach its alarms.
+
+A trend is fitted to the last FORECAST_LOOKBACK_HOURS of every column of every variable of a spot
+at once: the columns are stacked into one matrix padded with NaN, so the fits are a handful of
+NumPy operations over the matrix whatever the number of columns. 'linear' fits a straight line by
+iteratively reweighted least squares with Huber weights, which a few spikes do not tilt;
+'exponential' fits the same robust line to the logarithm of the values, for columns growing by a
+rate (columns with values at or below zero are not fitted). The trend is extended from the last
+sample to alarm_alert and alarm_critical, and a crossing is reported when it reaches a threshold
+the column is still under within FORECAST_HORIZON_DAYS.
+
+The thresholds are upper limits, as in the last record panel: a column falling away from them is
+never forecast to cross. The fits of a spot are kept in forecast_cache until one of its variables
+gets a new last record, so every session showing the spot shares them.
+"""
+import numpy as np
+import pandas as pd
+
+from functions.data import bulk_fetch, query_context, settings
+from functions.monitoring import metrics, tracing
+
+FORECAST_MODELS = ('linear', 'exponential')
+
+# Reweighting passes of the robust fit, and the Huber constant in robust standard deviations
+HUBER_ITERATIONS = 5
+HUBER_K = 1.345
+
+# Scales a MAD to the standard deviation of normally distributed values
+MAD_TO_STD = 1.4826
+
+FORECAST_COLUMNS = ['global_data_id', 'column_name', 'samples', 'last_value', 'fitted_value',
+                    'slope_per_day', 'alert_timestamp', 'critical_timestamp']
+
+# Last fits of each (namespace, spot_id), with the inputs they were computed from
+forecast_cache = {}
+
+
+def query_get_lookback_rows(spot_id, global_data_id, last_timestamp, lookback_seconds):
+    """
+    Constructs the SQL query that reads the rows of a variable over the lookback before its last record.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        last_timestamp (int): The timestamp of the last record of the variable.
+        lookback_seconds (int): The length of the lookback.
+
+    Returns:
+        str: The SQL query.
+    """
+    query = f"""SELECT *
+                FROM spot_{spot_id}_var_{global_data_id}
+                WHERE timestamp > {int(last_timestamp) - int(lookback_seconds)}
+                  AND timestamp <= {int(last_timestamp)}
+                ORDER BY timestamp"""
+    return query
+
+def stack_columns(frames):
+    """
+    Stacks the value columns of many variables into matrices, one row per column, padded with NaN.
+
+    Args:
+        frames (dict): The lookback rows of each global_data_id, value columns and 'timestamp', in timestamp order.
+
+    Returns:
+        list: The (global_data_id, column_name) of each row of the matrices.
+        ndarray: The times of the samples, in seconds before the last row of their variable.
+        ndarray: The values of the samples.
+        ndarray: The timestamp of the last row of the variable of each row.
+    """
+    blocks = []
+    for global_data_id, df in frames.items():
+        value_columns = [column for column in df.columns if column != 'timestamp']
+        if df.empty or not value_columns:
+            continue
+        timestamps = df['timestamp'].to_numpy(dtype='float64')
+        values = df[value_columns].to_numpy(dtype='float64', na_value=np.nan).T
+        blocks.append((global_data_id, value_columns, timestamps, values))
+
+    keys = [(global_data_id, column) for global_data_id, value_columns, _, _ in blocks for column in value_columns]
+    samples = max((len(timestamps) for _, _, timestamps, _ in blocks), default=0)
+    times = np.full((len(keys), samples), np.nan)
+    values = np.full((len(keys), samples), np.nan)
+    last_timestamps = np.empty(len(keys))
+    row = 0
+    for _, value_columns, block_timestamps, block_values in blocks:
+        rows = slice(row, row + len(value_columns))
+        times[rows, :len(block_timestamps)] = block_timestamps - block_timestamps[-1]
+        values[rows, :len(block_timestamps)] = block_values
+        last_timestamps[rows] = block_timestamps[-1]
+        row += len(value_columns)
+    return keys, times, values, last_timestamps
+
+def fit_weighted_lines(times, values, weights):
+    """
+    Fits one weighted least squares line per row of the matrices.
+
+    Args:
+        times (ndarray): The times of the samples, 0 where there is no sample.
+        values (ndarray): The values of the samples, 0 where there is no sample.
+        weights (ndarray): The weight of each sample, 0 where there is no sample.
+
+    Returns:
+        ndarray: The slope of each row, NaN when its samples do not span any time.
+        ndarray: The value of the line of each row at time 0.
+    """
+    # The weighted sums of each row, without the temporary matrices of the products
+    weight_sums = weights.sum(axis=1)
+    weighted_times = weights * times
+    time_sums = weighted_times.sum(axis=1)
+    value_sums = np.einsum('ij,ij->i', weights, values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        time_spreads = np.einsum('ij,ij->i', weighted_times, times) - time_sums * time_sums / weight_sums
+        covariances = np.einsum('ij,ij->i', weighted_times, values) - time_sums * value_sums / weight_sums
+        slopes = covariances / np.where(time_spreads > 0, time_spreads, np.nan)
+        return slopes, (value_sums - slopes * time_sums) / weight_sums
+
+def row_medians(matrix, counts):
+    """
+    Returns the median of the first values of each row, all rows at once.
+
+    Args:
+        matrix (ndarray): The values, with the values of each row that count sorting last (NaN or inf) after them.
+        counts (ndarray): The number of values that count in each row.
+
+    Returns:
+        ndarray: The median of each row, NaN for the rows without values.
+    """
+    sorted_matrix = np.sort(matrix, axis=1)
+    rows = np.arange(len(matrix))
+    lower = sorted_matrix[rows, np.maximum((counts - 1) // 2, 0)]
+    upper = sorted_matrix[rows, counts // 2]
+    return np.where(counts > 0, (lower + upper) / 2, np.nan)
+
+def fit_robust_trends(times, values, iterations=HUBER_ITERATIONS):
+    """
+    Fits a robust line to every row of the matrices at once, by iteratively reweighted least squares.
+
+    After each fit, the samples further from the line than HUBER_K robust standard deviations of
+    the residuals (their MAD) are weighted down in proportion to their distance.
+
+    Args:
+        times (ndarray): The times of the samples, NaN where there is no sample.
+        values (ndarray): The values of the samples, NaN where there is no sample.
+        iterations (int): The number of reweighting passes.
+
+    Returns:
+        ndarray: The slope of each row.
+        ndarray: The value of the line of each row at time 0.
+        ndarray: The number of samples of each row.
+    """
+    valid = ~np.isnan(times) & ~np.isnan(values)
+    times = np.where(valid, times, 0.0)
+    values = np.where(valid, values, 0.0)
+    weights = valid.astype('float64')
+    samples = valid.sum(axis=1)
+    slopes, levels = fit_weighted_lines(times, values, weights)
+    for _ in range(iterations):
+        residuals = np.abs(values - levels[:, None] - slopes[:, None] * times)
+        # The padding sorts after the samples, so the median of each row is read at its own middle
+        scales = row_medians(np.where(valid, residuals, np.inf), samples) * MAD_TO_STD * HUBER_K
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distances = residuals / scales[:, None]
+            # A row whose residuals are mostly zero (scale 0) keeps only the samples on its line
+            weights = np.where(valid, np.where(distances > 1, 1 / distances, 1.0), 0.0)
+        slopes, levels = fit_weighted_lines(times, values, weights)
+    return slopes, levels, samples
+
+def project_crossings(slopes, levels, last_values, thresholds, horizon_seconds):
+    """
+    Extends the trends to a threshold of each row.
+
+    Args:
+        slopes (ndarray): The slope of the trend of each row, per second.
+        levels (ndarray): The value of the trend of each row at its last sample.
+        last_values (ndarray): The last value of each row.
+        thresholds (ndarray): The threshold of each row, in the units of the trends.
+        horizon_seconds (float): The crossings further away are not reported.
+
+    Returns:
+        ndarray: The seconds from the last sample to the crossing of each row, NaN when the row
+        already reached its threshold, does not rise towards it, or reaches it after the horizon.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        seconds = (thresholds - levels) / slopes
+        crossing = (slopes > 0) & (last_values < thresholds) & (seconds <= horizon_seconds)
+    return np.where(crossing, np.maximum(seconds, 0.0), np.nan)
+
+@tracing.traced('transform')
+def forecast_frames(frames, alarms, model, horizon_seconds, min_samples):
+    """
+    Forecasts when every column of many variables reaches its alarms, in one batched fit.
+
+    Args:
+        frames (dict): The lookback rows of each global_data_id, value columns and 'timestamp', in timestamp order.
+        alarms (dict): The (alarm_alert, alarm_critical) of each global_data_id.
+        model (str): 'linear' or 'exponential'.
+        horizon_seconds (float): The crossings further away are not reported.
+        min_samples (int): The columns with fewer samples are not forecast.
+
+    Returns:
+        DataFrame: One row per column, with its 'global_data_id', 'column_name', 'samples',
+        'last_value', 'fitted_value' (the trend at the last sample), 'slope_per_day' (the change
+        per day of the value, or of its logarithm for 'exponential'), and the unix timestamps at
+        which the trend reaches each alarm, 'alert_timestamp' and 'critical_timestamp' (NaN when
+        it does not within the horizon).
+    """
+    if model not in FORECAST_MODELS:
+        raise ValueError(f'Unknown forecast model {model!r}, expected one of {FORECAST_MODELS}.')
+    keys, times, values, last_timestamps = stack_columns(frames)
+    if not keys:
+        return pd.DataFrame(columns=FORECAST_COLUMNS)
+
+    # The last value of each row sits at time 0, the end of its padded samples
+    last_values = values[np.arange(len(keys)), np.maximum((~np.isnan(times)).sum(axis=1) - 1, 0)]
+    alert_thresholds = np.array([alarms[global_data_id][0] for global_data_id, _ in keys], dtype='float64')
+    critical_thresholds = np.array([alarms[global_data_id][1] for global_data_id, _ in keys], dtype='float64')
+    if model == 'exponential':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            positive = ~(values <= 0).any(axis=1)
+            values = np.where(positive[:, None], np.log(values), np.nan)
+            last_values = np.log(last_values)
+            alert_thresholds = np.log(np.where(alert_thresholds > 0, alert_thresholds, np.nan))
+            critical_thresholds = np.log(np.where(critical_thresholds > 0, critical_thresholds, np.nan))
+
+    slopes, levels, samples = fit_robust_trends(times, values)
+    slopes = np.where(samples >= min_samples, slopes, np.nan)
+    alert_seconds = project_crossings(slopes, levels, last_values, alert_thresholds, horizon_seconds)
+    critical_seconds = project_crossings(slopes, levels, last_values, critical_thresholds, horizon_seconds)
+    if model == 'exponential':
+        levels = np.exp(levels)
+        last_values = np.exp(last_values)
+    return pd.DataFrame({'global_data_id': [global_data_id for global_data_id, _ in keys],
+                         'column_name': [column for _, column in keys],
+                         'samples': samples,
+                         'last_value': last_values,
+                         'fitted_value': np.where(np.isnan(slopes), np.nan, levels),
+                         'slope_per_day': slopes * 86400,
+                         'alert_timestamp': last_timestamps + alert_seconds,
+                         'critical_timestamp': last_timestamps + critical_seconds},
+                        columns=FORECAST_COLUMNS)
+
+def get_spot_forecasts(conn, spot_id, variables):
+    """
+    Forecasts when every column of the variables of a spot reaches its alarms, reusing the fits
+    until a variable gets a new last record or its alarms change.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+        spot_id (int): The ID of the spot.
+        variables (dict): The (last_timestamp, alarm_alert, alarm_critical) of each global_data_id of the spot.
+
+    Returns:
+        DataFrame: The forecasts of forecast_frames.
+    """
+    variables = {int(global_data_id): (int(last_timestamp),) + tuple(None if pd.isna(alarm) else float(alarm) for alarm in alarms)
+                 for global_data_id, (last_timestamp, *alarms) in variables.items()}
+    inputs = (tuple(sorted(variables.items())), settings.FORECAST_MODEL, settings.FORECAST_LOOKBACK_HOURS,
+              settings.FORECAST_HORIZON_DAYS, settings.FORECAST_MIN_SAMPLES)
+    cache_key = (query_context.get_namespace(conn), spot_id)
+    cached = forecast_cache.get(cache_key)
+    metrics.count_cache_request('forecast', cached is not None and cached[0] == inputs)
+    if cached is not None and cached[0] == inputs:
+        return cached[1]
+
+    # The rows end at the last records read from the primary, which a lagging replica may not have yet
+    primary_conn = query_context.route_primary(conn)
+    lookback_seconds = settings.FORECAST_LOOKBACK_HOURS * 3600
+    frames = {global_data_id: query_context.run_memoized(primary_conn,
+                                                         query_get_lookback_rows(spot_id, global_data_id, last_timestamp, lookback_seconds),
+                                                         bulk_fetch.df_from_copy)
+              for global_data_id, (last_timestamp, _, _) in variables.items()}
+    forecasts_df = forecast_frames(frames=frames,
+                                   alarms={global_data_id: (np.nan if alert is None else alert, np.nan if critical is None else critical)
+                                           for global_data_id, (_, alert, critical) in variables.items()},
+                                   model=settings.FORECAST_MODEL,
+                                   horizon_seconds=settings.FORECAST_HORIZON_DAYS * 86400,
+                                   min_samples=settings.FORECAST_MIN_SAMPLES)
+    forecast_cache[cache_key] = (inputs, forecasts_df)
+    return forecasts_df
@@ -0,0 +1,191 @@
+"""
+Process-wide store of the interval frames, shared by every session and tenant of the process.
+
+Frames are kept in least-recently-used order within FRAME_STORE_BUDGET_MB, so the memory held
+by the dashboard stays flat however many sessions and tenants it serves: a frame read by ten
+sessions is held once. Keys start with the tenant namespace, so tenants share the budget but
+never each other's frames.
+
+Stored frames are read-only. Their arrays are frozen when stored, and every reader gets its own
+frame object over the shared arrays, so a session may rename or replace columns of what it got,
+while writing into the values raises instead of changing the frames of the other sessions.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from functions.data import settings
+from functions.monitoring import metrics
+
+store_lock = threading.Lock()
+stored_frames = OrderedDict()
+store_state = {'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'rejections': 0}
+
+
+def interval_key(namespace, spot_id, global_data_id, start_timestamp, end_timestamp, version):
+    """
+    Builds the key of the frame of a spot variable over a window.
+
+    The window alone sets the bucket width of the frame (raw rows within the row budget, the
+    buckets of query_budget.choose_bucket_seconds otherwise), so it is not part of the key.
+
+    Args:
+        namespace (str): The slug of the tenant, or None in single-tenant mode.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the window.
+        end_timestamp (int): The end timestamp of the window.
+        version (int): The timestamp of the last record, so frames are replaced as soon as new data arrives.
+
+    Returns:
+        tuple: The key.
+    """
+    return (namespace, int(spot_id), int(global_data_id), int(start_timestamp), int(end_timestamp), version)
+
+def frame_size_bytes(value):
+    """
+    Estimates the memory held by a stored value.
+
+    Args:
+        value: A DataFrame, or a tuple or list holding DataFrames and scalars.
+
+    Returns:
+        int: The size in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (tuple, list)):
+        return sum(frame_size_bytes(item) for item in value)
+    return 64
+
+def freeze_value(value):
+    """
+    Makes the arrays of the DataFrames of a value read-only, in place.
+
+    Args:
+        value: A DataFrame, or a tuple or list holding DataFrames and scalars.
+
+    Returns:
+        The same value.
+    """
+    if isinstance(value, pd.DataFrame):
+        # The block arrays are what every frame handed out shares; pandas has no public access to them
+        for block in value._mgr.blocks:
+            if isinstance(block.values, np.ndarray):
+                block.values.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            freeze_value(item)
+    return value
+
+def share_value(value):
+    """
+    Returns a copy of a stored value for one reader, with new frame objects over the shared arrays.
+
+    Args:
+        value: A DataFrame, or a tuple holding DataFrames and scalars.
+
+    Returns:
+        The copy of the value.
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        return tuple(share_value(item) for item in value)
+    return value
+
+def get_budget_bytes():
+    """
+    Returns the memory budget of the store.
+
+    Returns:
+        int: The budget in bytes.
+    """
+    return settings.FRAME_STORE_BUDGET_MB * 1024 * 1024
+
+def has_frame(key):
+    """
+    Checks whether a value is stored, without counting a lookup.
+
+    Args:
+        key (tuple): The key of the value, as built by interval_key().
+
+    Returns:
+        bool: True if the value is in the store.
+    """
+    with store_lock:
+        return key in stored_frames
+
+def get_frame(key):
+    """
+    Returns a stored value, marking it as the most recently used.
+
+    Args:
+        key (tuple): The key of the value, as built by interval_key().
+
+    Returns:
+        The stored value, read-only, or None if it is not in the store.
+    """
+    with store_lock:
+        stored = stored_frames.get(key)
+        if stored is None:
+            store_state['misses'] += 1
+        else:
+            store_state['hits'] += 1
+            stored_frames.move_to_end(key)
+    metrics.count_cache_request('frame_store', stored is not None)
+    if stored is None:
+        return None
+    return share_value(stored[0])
+
+def put_frame(key, value):
+    """
+    Stores a value, evicting the least recently used values beyond the budget.
+
+    Values larger than the whole budget are not stored. The arrays of the value become
+    read-only, so the caller must not write into it afterwards either.
+
+    Args:
+        key (tuple): The key of the value, as built by interval_key().
+        value: A DataFrame, or a tuple holding DataFrames and scalars.
+
+    Returns:
+        bool: True if the value was stored.
+    """
+    size_bytes = frame_size_bytes(value)
+    budget_bytes = get_budget_bytes()
+    if size_bytes > budget_bytes:
+        with store_lock:
+            store_state['rejections'] += 1
+        return False
+    freeze_value(value)
+    evictions = 0
+    with store_lock:
+        if key in stored_frames:
+            store_state['bytes'] -= stored_frames.pop(key)[1]
+        stored_frames[key] = (value, size_bytes)
+        store_state['bytes'] += size_bytes
+        while store_state['bytes'] > budget_bytes:
+            _, (_, evicted_bytes) = stored_frames.popitem(last=False)
+            store_state['bytes'] -= evicted_bytes
+            evictions += 1
+        store_state['evictions'] += evictions
+        stored_count, stored_bytes = len(stored_frames), store_state['bytes']
+    metrics.observe_frame_store(stored_count, stored_bytes, evictions)
+    return True
+
+def get_stats():
+    """
+    Returns the counters of the store since the process started.
+
+    Returns:
+        dict: The 'frames' and 'bytes' held, the 'budget_bytes', and the 'hits', 'misses',
+        'evictions' and 'rejections' (values larger than the budget) counted.
+    """
+    with store_lock:
+        stats = dict(store_state)
+        stats['frames'] = len(stored_frames)
+    stats['budget_bytes'] = get_budget_bytes()
+    return stats
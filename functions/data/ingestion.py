@@ -0,0 +1,412 @@
+import io
+import multiprocessing
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from functions.data import database
+
+LATEST_RECORDS_TABLE = 'spot_latest_records'
+HOURLY_ROLLUPS_TABLE = 'spot_hourly_rollups'
+ROLLUP_SECONDS = 60 * 60
+
+# Column names and registered variables of each table, read once per process and again when a
+# batch names a variable or column they do not have (added since they were read)
+table_metadata_cache = {}
+
+
+def query_create_latest_records_table():
+    """
+    Constructs the SQL that creates the table holding the last timestamp of every spot variable.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""CREATE TABLE IF NOT EXISTS {LATEST_RECORDS_TABLE} (
+                    spot_id integer NOT NULL,
+                    global_data_id integer NOT NULL,
+                    timestamp bigint NOT NULL,
+                    PRIMARY KEY (spot_id, global_data_id)
+                );"""
+    return query
+
+def query_create_hourly_rollups_table():
+    """
+    Constructs the SQL that creates the table of hourly rollups (count, sum, min, max) of every column.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""CREATE TABLE IF NOT EXISTS {HOURLY_ROLLUPS_TABLE} (
+                    spot_id integer NOT NULL,
+                    global_data_id integer NOT NULL,
+                    column_name text NOT NULL,
+                    bucket bigint NOT NULL,
+                    samples bigint NOT NULL,
+                    value_sum double precision NOT NULL,
+                    value_min double precision NOT NULL,
+                    value_max double precision NOT NULL,
+                    PRIMARY KEY (spot_id, global_data_id, column_name, bucket)
+                );"""
+    return query
+
+def query_backfill_latest_record(spot_id, global_data_id):
+    """
+    Constructs the SQL that seeds the latest record of a spot variable from its table.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""INSERT INTO {LATEST_RECORDS_TABLE} (spot_id, global_data_id, timestamp)
+                SELECT {spot_id}, {global_data_id}, MAX(timestamp)
+                FROM spot_{spot_id}_var_{global_data_id}
+                HAVING MAX(timestamp) IS NOT NULL
+                ON CONFLICT (spot_id, global_data_id)
+                DO UPDATE SET timestamp = GREATEST({LATEST_RECORDS_TABLE}.timestamp, EXCLUDED.timestamp);"""
+    return query
+
+def create_ingestion_tables(connection):
+    """
+    Creates the latest records and hourly rollups tables if they do not exist.
+
+    Args:
+        connection: A psycopg2 connection.
+
+    Returns:
+        None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query_create_latest_records_table())
+        cursor.execute(query_create_hourly_rollups_table())
+    connection.commit()
+    return None
+
+def query_spot_variable_ids(spot_id):
+    """
+    Constructs the SQL that lists the variables registered for a spot.
+
+    Args:
+        spot_id (int): The ID of the spot.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f'SELECT global_data_id FROM spot_{spot_id}_variables;'
+
+def query_table_columns(spot_id, global_data_id):
+    """
+    Constructs the SQL that lists the columns of a spot variable table, in table order.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+
+    Returns:
+        str: The SQL query.
+    """
+    query = f"""SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name = 'spot_{spot_id}_var_{global_data_id}'
+                ORDER BY ordinal_position;"""
+    return query
+
+def get_table_metadata(cursor, spot_id, global_data_id, refresh=False):
+    """
+    Returns the registered variables of a spot and the columns of one of its tables.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        refresh (bool): Whether to read them again even if they are cached.
+
+    Returns:
+        set: The IDs of the variables registered in spot_{id}_variables.
+        list: The columns of spot_{id}_var_{gid}, in table order.
+    """
+    key = (spot_id, global_data_id)
+    if refresh or key not in table_metadata_cache:
+        cursor.execute(query_spot_variable_ids(spot_id))
+        variable_ids = {int(row[0]) for row in cursor.fetchall()}
+        cursor.execute(query_table_columns(spot_id, global_data_id))
+        table_columns = [row[0] for row in cursor.fetchall()]
+        table_metadata_cache[key] = (variable_ids, table_columns)
+    return table_metadata_cache[key]
+
+def is_metadata_stale(batch_df, global_data_id, variable_ids, table_columns):
+    """
+    Checks whether a batch names a variable or columns missing from the cached table metadata.
+
+    Args:
+        batch_df (DataFrame): The rows to be written.
+        global_data_id (int): The ID of the global variable.
+        variable_ids (set): The cached IDs of the variables registered in spot_{id}_variables.
+        table_columns (list): The cached columns of spot_{id}_var_{gid}.
+
+    Returns:
+        bool: True if the metadata should be read again before validating the batch.
+    """
+    if int(global_data_id) not in variable_ids:
+        return True
+    return any(column not in table_columns for column in batch_df.columns)
+
+def validate_batch(batch_df, spot_id, global_data_id, variable_ids, table_columns):
+    """
+    Checks a batch of rows against the variables of the spot and the columns of its table.
+
+    Args:
+        batch_df (DataFrame): The rows to be written, with a 'timestamp' column in unix seconds.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        variable_ids (set): The IDs of the variables registered in spot_{id}_variables.
+        table_columns (list): The columns of spot_{id}_var_{gid}, in table order.
+
+    Returns:
+        DataFrame: The batch with the columns in table order, integer timestamps and float values.
+
+    Raises:
+        ValueError: If the variable is not registered or the batch does not fit the table.
+    """
+    if int(global_data_id) not in variable_ids:
+        raise ValueError(f"Variable {global_data_id} is not registered in spot_{spot_id}_variables.")
+    if 'timestamp' not in batch_df.columns:
+        raise ValueError("Batch must have a 'timestamp' column.")
+    unknown_columns = [column for column in batch_df.columns if column not in table_columns]
+    if unknown_columns:
+        raise ValueError(f"Columns {unknown_columns} do not exist in spot_{spot_id}_var_{global_data_id}.")
+    if batch_df['timestamp'].isna().any():
+        raise ValueError("Batch has rows without timestamp.")
+
+    columns = [column for column in table_columns if column in batch_df.columns]
+    valid_df = batch_df[columns].copy()
+    try:
+        valid_df['timestamp'] = valid_df['timestamp'].astype('int64')
+        for column in columns:
+            if column != 'timestamp':
+                valid_df[column] = pd.to_numeric(valid_df[column]).astype('float64')
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Batch has non numeric values: {e}")
+    return valid_df
+
+def make_rollup_rows(batch_df, spot_id, global_data_id, rollup_seconds=ROLLUP_SECONDS):
+    """
+    Reduces a batch to the rollup rows (count, sum, min, max per column and bucket) it adds.
+
+    The rows are sorted by key, so concurrent writers always lock the rollups in the same order.
+
+    Args:
+        batch_df (DataFrame): The validated rows.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        rollup_seconds (int): The width of the rollup buckets in seconds.
+
+    Returns:
+        list: Tuples (spot_id, global_data_id, column_name, bucket, samples, value_sum, value_min, value_max).
+    """
+    long_df = batch_df.melt(id_vars=['timestamp'], var_name='column_name', value_name='value').dropna()
+    long_df['bucket'] = (long_df['timestamp'] // rollup_seconds) * rollup_seconds
+    rollup_df = long_df.groupby(['column_name', 'bucket'])['value'].agg(['count', 'sum', 'min', 'max']).reset_index()
+    return [(int(spot_id), int(global_data_id), row.column_name, int(row.bucket),
+             int(row.count), float(row.sum), float(row.min), float(row.max))
+            for row in rollup_df.itertuples(index=False)]
+
+def copy_rows(cursor, table, batch_df):
+    """
+    Writes rows to a table with COPY FROM STDIN.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        table (str): The name of the table.
+        batch_df (DataFrame): The validated rows.
+
+    Returns:
+        None
+    """
+    buffer = io.StringIO()
+    batch_df.to_csv(buffer, header=False, index=False, na_rep='')
+    buffer.seek(0)
+    columns = ', '.join(f'"{column}"' for column in batch_df.columns)
+    cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    return None
+
+def insert_values(cursor, table, batch_df, page_size=5000):
+    """
+    Writes rows to a table with multi-row INSERT statements.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        table (str): The name of the table.
+        batch_df (DataFrame): The validated rows.
+        page_size (int): The number of rows per INSERT statement.
+
+    Returns:
+        None
+    """
+    columns = ', '.join(f'"{column}"' for column in batch_df.columns)
+    rows = batch_df.astype(object).where(batch_df.notna(), None).itertuples(index=False, name=None)
+    execute_values(cursor, f'INSERT INTO {table} ({columns}) VALUES %s', list(rows), page_size=page_size)
+    return None
+
+def upsert_latest_record(cursor, spot_id, global_data_id, timestamp):
+    """
+    Moves the latest record of a spot variable forward, never backward.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        timestamp (int): The newest timestamp of the batch.
+
+    Returns:
+        None
+    """
+    cursor.execute(f"""INSERT INTO {LATEST_RECORDS_TABLE} (spot_id, global_data_id, timestamp)
+                       VALUES (%s, %s, %s)
+                       ON CONFLICT (spot_id, global_data_id)
+                       DO UPDATE SET timestamp = GREATEST({LATEST_RECORDS_TABLE}.timestamp, EXCLUDED.timestamp);""",
+                   (int(spot_id), int(global_data_id), int(timestamp)))
+    return None
+
+def upsert_rollups(cursor, rollup_rows, page_size=5000):
+    """
+    Adds the rollup rows of a batch to the hourly rollups.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        rollup_rows (list): The rows returned by make_rollup_rows.
+        page_size (int): The number of rows per INSERT statement.
+
+    Returns:
+        None
+    """
+    execute_values(cursor,
+                   f"""INSERT INTO {HOURLY_ROLLUPS_TABLE}
+                           (spot_id, global_data_id, column_name, bucket, samples, value_sum, value_min, value_max)
+                       VALUES %s
+                       ON CONFLICT (spot_id, global_data_id, column_name, bucket) DO UPDATE SET
+                           samples = {HOURLY_ROLLUPS_TABLE}.samples + EXCLUDED.samples,
+                           value_sum = {HOURLY_ROLLUPS_TABLE}.value_sum + EXCLUDED.value_sum,
+                           value_min = LEAST({HOURLY_ROLLUPS_TABLE}.value_min, EXCLUDED.value_min),
+                           value_max = GREATEST({HOURLY_ROLLUPS_TABLE}.value_max, EXCLUDED.value_max);""",
+                   rollup_rows,
+                   page_size=page_size)
+    return None
+
+def write_batch(connection, spot_id, global_data_id, batch_df, method='copy'):
+    """
+    Validates and writes a batch of rows to spot_{id}_var_{gid} in one transaction.
+
+    The latest record and the hourly rollups of the variable are updated in the same
+    transaction, so readers never see rows without their rollups or the other way around.
+
+    Args:
+        connection: A psycopg2 connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        batch_df (DataFrame): The rows to be written, with a 'timestamp' column in unix seconds.
+        method (str): 'copy' for COPY FROM STDIN or 'values' for multi-row INSERT statements.
+
+    Returns:
+        int: The number of rows written.
+
+    Raises:
+        ValueError: If the batch does not fit the table or the method is unknown.
+    """
+    if method not in ('copy', 'values'):
+        raise ValueError("Method must be 'copy' or 'values'.")
+    if batch_df.empty:
+        return 0
+    table = f'spot_{spot_id}_var_{global_data_id}'
+    try:
+        with connection.cursor() as cursor:
+            variable_ids, table_columns = get_table_metadata(cursor, spot_id, global_data_id)
+            if is_metadata_stale(batch_df, global_data_id, variable_ids, table_columns):
+                variable_ids, table_columns = get_table_metadata(cursor, spot_id, global_data_id, refresh=True)
+            valid_df = validate_batch(batch_df, spot_id, global_data_id, variable_ids, table_columns)
+            if method == 'copy':
+                copy_rows(cursor, table, valid_df)
+            else:
+                insert_values(cursor, table, valid_df)
+            upsert_latest_record(cursor, spot_id, global_data_id, valid_df['timestamp'].max())
+            upsert_rollups(cursor, make_rollup_rows(valid_df, spot_id, global_data_id))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return len(valid_df)
+
+def ingest_batches(engine, batches, method='copy'):
+    """
+    Writes a sequence of batches through one pooled connection.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        batches (iterable): Tuples (spot_id, global_data_id, batch_df).
+        method (str): 'copy' or 'values'.
+
+    Returns:
+        int: The number of rows written.
+    """
+    rows_written = 0
+    connection = engine.raw_connection()
+    try:
+        for spot_id, global_data_id, batch_df in batches:
+            rows_written += write_batch(connection, spot_id, global_data_id, batch_df, method=method)
+    finally:
+        connection.close()
+    return rows_written
+
+# Engine of each writer process, created by init_writer_process
+writer_engine = None
+
+def init_writer_process(url):
+    """
+    Creates the database engine of a writer process.
+
+    Args:
+        url (str): The database URL.
+
+    Returns:
+        None
+    """
+    global writer_engine
+    writer_engine = database.create_engine(url=url, pool_size=1)
+    return None
+
+def write_batch_in_writer_process(batch, method):
+    """
+    Writes one batch with the engine of the current writer process.
+
+    Args:
+        batch (tuple): The spot_id, global_data_id and batch_df.
+        method (str): 'copy' or 'values'.
+
+    Returns:
+        int: The number of rows written.
+    """
+    return ingest_batches(writer_engine, [batch], method=method)
+
+def ingest_batches_parallel(url, batches, processes, method='copy'):
+    """
+    Writes batches from several writer processes, each with its own connection.
+
+    Batches of different variables go to different tables and never wait for each other.
+    Batches of the same variable only meet on the latest record and rollup rows, which are
+    upserted in key order, so concurrent writers cannot deadlock.
+
+    Args:
+        url (str): The database URL.
+        batches (list): Tuples (spot_id, global_data_id, batch_df).
+        processes (int): The number of writer processes.
+        method (str): 'copy' or 'values'.
+
+    Returns:
+        int: The number of rows written.
+    """
+    with multiprocessing.Pool(processes=processes, initializer=init_writer_process, initargs=(url,)) as pool:
+        rows_written = pool.starmap(write_batch_in_writer_process, [(batch, method) for batch in batches])
+    return sum(rows_written)
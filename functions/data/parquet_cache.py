@@ -0,0 +1,188 @@
+import os
+import math
+
+from functions.data import settings
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def table_cache_dir(spot_id, global_data_id, cache_dir=None):
+    """
+    Returns the directory holding the cached days of a spot variable table.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        cache_dir (str): The root of the Parquet cache. Defaults to the configured one.
+
+    Returns:
+        str: The path of the directory of the table.
+    """
+    if cache_dir is None:
+        cache_dir = settings.PARQUET_CACHE_DIR
+    return os.path.join(cache_dir, f'spot_{spot_id}_var_{global_data_id}')
+
+def day_of_timestamp(timestamp):
+    """
+    Returns the index of the UTC day containing a unix timestamp.
+
+    Args:
+        timestamp (int): The unix timestamp in seconds.
+
+    Returns:
+        int: The number of whole days since the unix epoch.
+    """
+    return int(timestamp) // SECONDS_PER_DAY
+
+def namespace_cache_dir(namespace):
+    """
+    Returns the root of the Parquet cache of a tenant.
+
+    Args:
+        namespace (str): The slug of the tenant, or None in single-tenant mode.
+
+    Returns:
+        str: The root of the cache of the tenant.
+    """
+    if namespace is None:
+        return settings.PARQUET_CACHE_DIR
+    return os.path.join(settings.PARQUET_CACHE_DIR, namespace)
+
+def day_partition_path(spot_id, global_data_id, day, cache_dir=None):
+    """
+    Returns the path of the Parquet file of one cached day.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        day (int): The index of the UTC day.
+        cache_dir (str): The root of the Parquet cache. Defaults to the configured one.
+
+    Returns:
+        str: The path of the Parquet file.
+    """
+    return os.path.join(table_cache_dir(spot_id, global_data_id, cache_dir), f'day_{day}.parquet')
+
+def whole_days_in_interval(start_timestamp, end_timestamp):
+    """
+    Lists the UTC days fully contained in the half-open interval [start_timestamp, end_timestamp).
+
+    Args:
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        list: The indexes of the days.
+    """
+    first_day = math.ceil(start_timestamp / SECONDS_PER_DAY)
+    last_day = end_timestamp // SECONDS_PER_DAY - 1
+    return list(range(first_day, last_day + 1))
+
+def edge_intervals(start_timestamp, end_timestamp):
+    """
+    Lists the parts of an interval outside its whole UTC days, which are never cached.
+
+    The page builds its intervals from local midnights, so they start and end within a UTC day:
+    those partial days are read from Postgres, and only the whole days from the cache.
+
+    Args:
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+
+    Returns:
+        list: The (start_timestamp, end_timestamp) of each non-empty part, in order.
+    """
+    days = whole_days_in_interval(start_timestamp, end_timestamp)
+    if not days:
+        return [(start_timestamp, end_timestamp)] if end_timestamp > start_timestamp else []
+    edges = [(start_timestamp, days[0] * SECONDS_PER_DAY), ((days[-1] + 1) * SECONDS_PER_DAY, end_timestamp)]
+    return [(edge_start, edge_end) for edge_start, edge_end in edges if edge_end > edge_start]
+
+def partition_paths_for_range(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir=None):
+    """
+    Lists the Parquet files of the whole days of an interval, whether they exist or not.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        cache_dir (str): The root of the Parquet cache. Defaults to the configured one.
+
+    Returns:
+        list: The paths of the Parquet files, one per day.
+    """
+    return [day_partition_path(spot_id, global_data_id, day, cache_dir)
+            for day in whole_days_in_interval(start_timestamp, end_timestamp)]
+
+def is_range_cached(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir=None):
+    """
+    Checks whether every whole day of an interval is present in the local cache.
+
+    The rows of the partial days at its ends (see edge_intervals) are still read from Postgres.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        cache_dir (str): The root of the Parquet cache. Defaults to the configured one.
+
+    Returns:
+        bool: True if the interval has whole days, all of them cached.
+    """
+    paths = partition_paths_for_range(spot_id, global_data_id, start_timestamp, end_timestamp, cache_dir)
+    return len(paths) > 0 and all(os.path.exists(path) for path in paths)
+
+def closed_days_in_interval(start_timestamp, end_timestamp, last_record_timestamp):
+    """
+    Lists the days fully contained in an interval that are old enough to be cached.
+
+    A day is closed when it ends at least PARQUET_CACHE_SETTLE_SECONDS before the last record,
+    so rows arriving late from the collectors are not left out of the cache.
+
+    Args:
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        last_record_timestamp (int): The timestamp of the last record of the spot.
+
+    Returns:
+        list: The indexes of the closed days.
+    """
+    settled_timestamp = last_record_timestamp - settings.PARQUET_CACHE_SETTLE_SECONDS
+    return [day for day in whole_days_in_interval(start_timestamp, end_timestamp)
+            if (day + 1) * SECONDS_PER_DAY <= settled_timestamp]
+
+def write_closed_days(df, spot_id, global_data_id, start_timestamp, end_timestamp, last_record_timestamp, cache_dir=None):
+    """
+    Stores the closed days of a freshly queried interval in the local cache.
+
+    Days already cached are left untouched. Each file is written to a temporary path and
+    renamed, so concurrent sessions never read a partial file.
+
+    Args:
+        df (DataFrame): The raw rows of the interval, with an integer 'timestamp' column.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        last_record_timestamp (int): The timestamp of the last record of the spot.
+        cache_dir (str): The root of the Parquet cache. Defaults to the configured one.
+
+    Returns:
+        int: The number of days written.
+    """
+    if df.empty:
+        return 0
+    days_written = 0
+    for day in closed_days_in_interval(start_timestamp, end_timestamp, last_record_timestamp):
+        path = day_partition_path(spot_id, global_data_id, day, cache_dir)
+        if os.path.exists(path):
+            continue
+        day_mask = (df['timestamp'] >= day * SECONDS_PER_DAY) & (df['timestamp'] < (day + 1) * SECONDS_PER_DAY)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        df.loc[day_mask].to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, path)
+        days_written += 1
+    return days_written
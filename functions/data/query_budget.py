@@ -0,0 +1,111 @@
+import json
+import math
+
+from functions.data import settings
+
+# Bucket widths offered when an interval must be aggregated, from the finest to the coarsest
+RESOLUTIONS_SECONDS = [60, 5 * 60, 10 * 60, 15 * 60, 30 * 60,
+                       60 * 60, 2 * 60 * 60, 6 * 60 * 60, 12 * 60 * 60, 24 * 60 * 60]
+
+
+def query_explain(query):
+    """
+    Wraps a query so the database returns its plan, with the row estimate, instead of its rows.
+
+    Args:
+        query (str): The SQL query to be estimated.
+
+    Returns:
+        str: The EXPLAIN query.
+    """
+    return f'EXPLAIN (FORMAT JSON) {query}'
+
+def plan_rows_from_explain_df(explain_df):
+    """
+    Extracts the planner row estimate from the result of an EXPLAIN (FORMAT JSON) query.
+
+    Args:
+        explain_df (DataFrame): The single cell result of the EXPLAIN query.
+
+    Returns:
+        int: The number of rows the planner expects the query to return.
+    """
+    plan = explain_df.iloc[0, 0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def estimate_query_rows(conn, query):
+    """
+    Estimates the number of rows of a query from the Postgres planner, without running it.
+
+    The estimate comes from the statistics of the timestamp index, so it costs a planning
+    step instead of a scan.
+
+    Args:
+        conn: The connection to the database.
+        query (str): The SQL query to be estimated.
+
+    Returns:
+        int: The estimated number of rows.
+    """
+    explain_df = conn.query(query_explain(query))
+    return plan_rows_from_explain_df(explain_df)
+
+def is_over_budget(estimated_rows, row_budget=None):
+    """
+    Checks whether an estimated result is too large to be fetched raw.
+
+    Args:
+        estimated_rows (int): The estimated number of rows.
+        row_budget (int): The row budget. Defaults to the configured ROW_BUDGET.
+
+    Returns:
+        bool: True if the result must be aggregated.
+    """
+    if row_budget is None:
+        row_budget = settings.ROW_BUDGET
+    return estimated_rows > row_budget
+
+def choose_bucket_seconds(start_timestamp, end_timestamp, row_budget=None):
+    """
+    Chooses the finest bucket width that keeps an aggregated interval within the row budget.
+
+    Aggregation returns at most one row per bucket, so the result never exceeds the budget,
+    whatever the sampling rate of the sensors.
+
+    Args:
+        start_timestamp (int): The start timestamp of the interval.
+        end_timestamp (int): The end timestamp of the interval (exclusive).
+        row_budget (int): The row budget. Defaults to the configured ROW_BUDGET.
+
+    Returns:
+        int: The bucket width in seconds.
+    """
+    if row_budget is None:
+        row_budget = settings.ROW_BUDGET
+    minimum_seconds = math.ceil((end_timestamp - start_timestamp) / max(row_budget, 1))
+    for resolution_seconds in RESOLUTIONS_SECONDS:
+        if resolution_seconds >= minimum_seconds:
+            return resolution_seconds
+    days = math.ceil(minimum_seconds / RESOLUTIONS_SECONDS[-1])
+    return days * RESOLUTIONS_SECONDS[-1]
+
+def format_resolution(bucket_seconds):
+    """
+    Describes a bucket width in Portuguese, to tell the user which resolution is shown.
+
+    Args:
+        bucket_seconds (int): The bucket width in seconds, or None for raw data.
+
+    Returns:
+        str: The description of the resolution.
+    """
+    if bucket_seconds is None:
+        return 'dados brutos'
+    if bucket_seconds % (24 * 60 * 60) == 0:
+        days = bucket_seconds // (24 * 60 * 60)
+        return f'médias de {days} dia' if days == 1 else f'médias de {days} dias'
+    if bucket_seconds % (60 * 60) == 0:
+        return f'médias de {bucket_seconds // (60 * 60)} h'
+    return f'médias de {bucket_seconds // 60} min'
@@ -0,0 +1,308 @@
+import re
+import time
+
+from functions.data import async_engine, frame_store, replica_routing, settings
+from functions.monitoring import metrics, tracing
+
+# Numeric literals not glued to a letter (so the 3 and 7 of spot_3_var_7 are parameters, p95 is not)
+NUMBER_PATTERN = re.compile(r"(?<![A-Za-z])-?\d+(?:\.\d+)?")
+STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def fingerprint_query(query):
+    """
+    Splits an SQL query into its shape and its parameters.
+
+    Literals are replaced by '?' in the shape and collected, in order, as the parameters, so
+    the same query built for different spots, variables or intervals shares one shape.
+
+    Args:
+        query (str): The SQL query.
+
+    Returns:
+        str: The shape of the query, with normalized whitespace.
+        tuple: The literals of the query.
+    """
+    params = []
+
+    def replace_literal(match):
+        params.append(match.group(0))
+        return '?'
+
+    shape = STRING_PATTERN.sub(replace_literal, query)
+    strings = list(params)
+    params.clear()
+    shape = NUMBER_PATTERN.sub(replace_literal, shape)
+    shape = WHITESPACE_PATTERN.sub(' ', shape).strip()
+    return shape, tuple(strings) + tuple(params)
+
+def prefetch_key(namespace, query):
+    """
+    Builds the key of a prefetched query result in the frame store.
+
+    Args:
+        namespace (str): The slug of the tenant, or None in single-tenant mode.
+        query (str): The SQL query.
+
+    Returns:
+        tuple: The key.
+    """
+    return ('query', namespace, query)
+
+
+class QueryContext:
+    """
+    Memo of every query result of one script run, used in place of the Streamlit connection.
+
+    app.py creates one context per rerun and hands it to the builders as their `conn`. Results
+    are kept by (query shape, parameters), so a second request for the same data in the same
+    rerun never reaches the database. The memo dies with the rerun, so data is never stale
+    across reruns.
+
+    Historical range reads can be sent to a read replica through historical(), which returns a
+    context on the replica sharing this memo and its counters.
+    """
+
+    def __init__(self, conn, replicas=None, namespace=None):
+        """
+        Args:
+            conn: The Streamlit SQL connection to the database.
+            replicas (dict): The Streamlit SQL connections to the read replicas, by name.
+            namespace (str): The slug of the tenant, which namespaces its caches. None in single-tenant mode.
+        """
+        self.conn = conn
+        self.replicas = replicas or {}
+        self.namespace = namespace
+        self.replica_name = None
+        self.primary = self
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def engine(self):
+        """The SQLAlchemy engine of the connection, for the COPY and streaming paths."""
+        return self.conn.engine
+
+    def memoize(self, query_shape, params, fetch):
+        """
+        Returns the memoized result of a query, fetching it on the first request.
+
+        Args:
+            query_shape (str): The shape of the query, or any label of how the data is fetched.
+            params (tuple): The parameters of the query.
+            fetch (callable): Called with the connection to fetch the result on a miss.
+
+        Returns:
+            The result of the query.
+        """
+        key = (query_shape, params)
+        metrics.count_cache_request('memo', key in self.results)
+        if key in self.results:
+            self.primary.hits += 1
+            return self.results[key]
+        self.primary.misses += 1
+        # Timed here rather than in the callers (run_and_time_query, ...), so memo hits are not counted as queries
+        start_time = time.time()
+        span_attributes = {'replica': self.replica_name} if self.replica_name is not None else {}
+        with tracing.span('query', 'query', shape=query_shape, **span_attributes):
+            result = self.fetch_with_fallback(fetch)
+        metrics.observe_query(query_shape, time.time() - start_time, len(result) if hasattr(result, '__len__') else None)
+        self.results[key] = result
+        return result
+
+    def fetch_with_fallback(self, fetch):
+        """
+        Fetches a result from the connection of this context, falling back to the primary when a replica cannot be reached.
+
+        Args:
+            fetch (callable): Called with the connection to fetch the result.
+
+        Returns:
+            The result of the query.
+        """
+        if self.replica_name is None:
+            return fetch(self.conn)
+        try:
+            return fetch(self.conn)
+        except replica_routing.CONNECTION_ERRORS:
+            replica_routing.mark_unhealthy(self.replica_name)
+            return fetch(self.primary.conn)
+
+    def historical(self):
+        """
+        Returns the context that serves historical range reads: a healthy replica, or the primary.
+
+        Returns:
+            QueryContext: A context on a replica sharing this memo, or this context if no replica is healthy.
+        """
+        if not self.replicas:
+            return self
+        replica_name, replica_conn = replica_routing.choose_replica(self.replicas)
+        if replica_conn is None:
+            return self
+        replica_context = QueryContext(replica_conn, namespace=self.namespace)
+        replica_context.replica_name = replica_name
+        replica_context.primary = self
+        replica_context.results = self.results
+        return replica_context
+
+    def query(self, query, **kwargs):
+        """
+        Runs a query through conn.query, at most once per rerun.
+
+        Args:
+            query (str): The SQL query.
+            **kwargs: Extra arguments for conn.query (ttl, params, ...).
+
+        Returns:
+            DataFrame: The result of the query.
+        """
+        query_shape, params = fingerprint_query(query)
+        params = params + tuple(sorted((key, repr(value)) for key, value in kwargs.items()))
+        return self.memoize(query_shape, params, lambda connection: connection.query(query, **kwargs))
+
+    def prefetch(self, queries):
+        """
+        Fetches at once, through the async engine, the queries of this rerun that are not memoized yet.
+
+        The results are memoized under the same keys as query(), so the builders then read them
+        with their usual conn.query calls, one after the other, without waiting on the database.
+        The async engine does not go through the cache of conn.query, so the results are also kept
+        in the frame store, shared by every session of the tenant like the conn.query cache of the
+        sync engine, and a later rerun only fetches the queries it does not hold (or evicted).
+
+        Args:
+            queries (list): The SQL queries, as the builders pass them to conn.query.
+
+        Returns:
+            int: The number of queries fetched from the database.
+        """
+        pending = {}
+        for query in queries:
+            key = fingerprint_query(query)
+            if key in self.results or key in pending:
+                continue
+            stored = frame_store.get_frame(prefetch_key(self.namespace, query))
+            if stored is not None:
+                self.results[key] = stored
+            else:
+                pending[key] = query
+        if not pending:
+            return 0
+        for key in pending:
+            metrics.count_cache_request('memo', False)
+        self.primary.misses += len(pending)
+        start_time = time.time()
+        span_attributes = {'replica': self.replica_name} if self.replica_name is not None else {}
+        with tracing.span('async fan-out', 'query', queries=len(pending), **span_attributes):
+            results = self.fetch_with_fallback(lambda connection: async_engine.run_queries(connection.engine, list(pending.values())))
+        elapsed_time = time.time() - start_time
+        for ((query_shape, params), query), result in zip(pending.items(), results):
+            # Each query is recorded with the time of the whole fan-out, which bounds its own
+            metrics.observe_query(query_shape, elapsed_time, len(result))
+            frame_store.put_frame(prefetch_key(self.namespace, query), result)
+            self.results[(query_shape, params)] = frame_store.share_value(result)
+        return len(pending)
+
+    def stats(self):
+        """
+        Returns the memo counters of the rerun.
+
+        Returns:
+            dict: The 'hits', 'misses' and 'hit_ratio' of the memo.
+        """
+        requests = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else 0.0}
+
+
+def run_memoized(conn, query, fetch):
+    """
+    Runs a query with a fetch function other than conn.query, memoized when conn is a QueryContext.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+        query (str): The SQL query.
+        fetch (callable): Called with the connection and the query to fetch the result.
+
+    Returns:
+        The result of the query.
+    """
+    if not isinstance(conn, QueryContext):
+        return fetch(conn, query)
+    query_shape, params = fingerprint_query(query)
+    return conn.memoize(f'{fetch.__name__}: {query_shape}', params, lambda connection: fetch(connection, query))
+
+def can_prefetch(conn):
+    """
+    Checks whether queries can be fetched at once for a connection.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+
+    Returns:
+        bool: True when QUERY_ENGINE is 'async' and conn is a QueryContext.
+    """
+    return settings.QUERY_ENGINE == 'async' and isinstance(conn, QueryContext)
+
+def prefetch(conn, queries):
+    """
+    Fetches queries at once through the async engine, when possible (see can_prefetch()).
+
+    Otherwise nothing is fetched, and the builders fetch the queries one after the other.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+        queries (list): The SQL queries, as the builders pass them to conn.query.
+
+    Returns:
+        int: The number of queries fetched.
+    """
+    if not can_prefetch(conn):
+        return 0
+    return conn.prefetch(queries)
+
+def get_namespace(conn):
+    """
+    Returns the tenant namespace of a connection.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+
+    Returns:
+        str: The slug of the tenant, or None in single-tenant mode.
+    """
+    if not isinstance(conn, QueryContext):
+        return None
+    return conn.namespace
+
+def route_historical(conn):
+    """
+    Returns the connection for a historical range read: a read replica when conn is a QueryContext with healthy replicas.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+
+    Returns:
+        The QueryContext of a replica, or conn itself.
+    """
+    if not isinstance(conn, QueryContext):
+        return conn
+    return conn.historical()
+
+def route_primary(conn):
+    """
+    Returns the connection for a read that must see the latest writes: the primary, even from the context of a replica.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+
+    Returns:
+        The QueryContext of the primary, or conn itself.
+    """
+    if not isinstance(conn, QueryContext):
+        return conn
+    return conn.primary
@@ -0,0 +1,125 @@
+"""
+Health of the read replicas that serve the historical range reads.
+
+The primary keeps the latest-value and metadata reads, and the collectors' writes. Range reads
+go to a healthy replica, in turns. A replica is healthy when it answers and its replay lag is
+at most REPLICA_MAX_LAG_SECONDS. Its health is checked again at most every
+REPLICA_HEALTH_CHECK_SECONDS. Set connect_timeout in the connection URL of each replica, so a
+host that is down fails the check quickly.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import psycopg2
+import sqlalchemy
+
+from functions.data import settings
+from functions.monitoring import metrics
+
+# Errors that mean the replica cannot be reached, as opposed to errors of the query itself
+CONNECTION_ERRORS = (sqlalchemy.exc.OperationalError, sqlalchemy.exc.InterfaceError,
+                     psycopg2.OperationalError, psycopg2.InterfaceError)
+
+logger = logging.getLogger('acodata.replicas')
+
+health_lock = threading.Lock()
+replica_health = {}
+replica_turns = itertools.count()
+
+
+def query_replication_lag():
+    """
+    Constructs the SQL that measures the replay lag of a replica.
+
+    A server that is not in recovery (a primary, or a standalone copy) has no lag.
+
+    Returns:
+        str: The SQL query.
+    """
+    query = """SELECT CASE WHEN pg_is_in_recovery()
+                           THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                           ELSE 0
+                      END AS lag_seconds;"""
+    return query
+
+def check_replica(conn):
+    """
+    Checks whether a replica answers and how far behind the primary it is.
+
+    Args:
+        conn: The Streamlit SQL connection to the replica.
+
+    Returns:
+        bool: True if the replica answers within the allowed lag.
+        float: The replay lag in seconds, or None if the replica did not answer.
+    """
+    try:
+        with conn.engine.connect() as connection:
+            lag_seconds = float(connection.execute(sqlalchemy.text(query_replication_lag())).scalar())
+    except CONNECTION_ERRORS as error:
+        logger.warning('Replica health check failed: %s', error)
+        return False, None
+    return lag_seconds <= settings.REPLICA_MAX_LAG_SECONDS, lag_seconds
+
+def is_replica_healthy(name, conn, now=None):
+    """
+    Returns the health of a replica, checking it again when the last check is too old.
+
+    Args:
+        name (str): The name of the replica connection.
+        conn: The Streamlit SQL connection to the replica.
+        now (float): The current time. Defaults to time.time().
+
+    Returns:
+        bool: True if the replica can serve reads.
+    """
+    if now is None:
+        now = time.time()
+    with health_lock:
+        health = replica_health.get(name)
+    if health is not None and now - health['checked_at'] < settings.REPLICA_HEALTH_CHECK_SECONDS:
+        return health['healthy']
+    healthy, lag_seconds = check_replica(conn)
+    if health is not None and health['healthy'] != healthy:
+        logger.warning('Replica %s is now %s (lag: %s s)', name, 'healthy' if healthy else 'unhealthy', lag_seconds)
+    with health_lock:
+        replica_health[name] = {'healthy': healthy, 'lag_seconds': lag_seconds, 'checked_at': now}
+    metrics.observe_replica_health(name, healthy, lag_seconds)
+    return healthy
+
+def mark_unhealthy(name, now=None):
+    """
+    Takes a replica out of the rotation until its next health check, after a failed read.
+
+    Args:
+        name (str): The name of the replica connection.
+        now (float): The current time. Defaults to time.time().
+
+    Returns:
+        None
+    """
+    if now is None:
+        now = time.time()
+    logger.warning('Replica %s failed a read, falling back to the primary', name)
+    with health_lock:
+        replica_health[name] = {'healthy': False, 'lag_seconds': None, 'checked_at': now}
+    metrics.observe_replica_health(name, False, None)
+    return None
+
+def choose_replica(replicas):
+    """
+    Picks the healthy replica that serves the next historical read, in turns.
+
+    Args:
+        replicas (dict): The Streamlit SQL connections to the replicas, by name.
+
+    Returns:
+        str: The name of the replica, or None if no replica is healthy.
+        The connection to the replica, or None.
+    """
+    healthy_replicas = [(name, conn) for name, conn in replicas.items() if is_replica_healthy(name, conn)]
+    if not healthy_replicas:
+        return None, None
+    return healthy_replicas[next(replica_turns) % len(healthy_replicas)]
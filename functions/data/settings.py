@@ -0,0 +1,179 @@
+import os
+
+
+def get_env_str(name, default):
+    """
+    Reads a string setting from the environment.
+
+    Args:
+        name (str): The name of the environment variable.
+        default (str): The value used when the variable is not set.
+
+    Returns:
+        str: The value of the setting.
+    """
+    return os.environ.get(name, default)
+
+def get_env_int(name, default):
+    """
+    Reads an integer setting from the environment.
+
+    Args:
+        name (str): The name of the environment variable.
+        default (int): The value used when the variable is not set or empty.
+
+    Returns:
+        int: The value of the setting.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    return int(value)
+
+def get_env_float(name, default):
+    """
+    Reads a decimal setting from the environment.
+
+    Args:
+        name (str): The name of the environment variable.
+        default (float): The value used when the variable is not set or empty.
+
+    Returns:
+        float: The value of the setting.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return float(default)
+    return float(value)
+
+def get_env_bool(name, default):
+    """
+    Reads a boolean setting from the environment ('1', 'true', 'yes' and 'on' are true).
+
+    Args:
+        name (str): The name of the environment variable.
+        default (bool): The value used when the variable is not set or empty.
+
+    Returns:
+        bool: The value of the setting.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Local Parquet cache of closed days of the spot_{id}_var_{gid} tables
+PARQUET_CACHE_DIR = get_env_str('ACODATA_PARQUET_CACHE_DIR', 'cache/parquet')
+
+# Days younger than this margin (before the last record) are never cached, so late rows still get in
+PARQUET_CACHE_SETTLE_SECONDS = get_env_int('ACODATA_PARQUET_CACHE_SETTLE_SECONDS', 24 * 60 * 60)
+
+# In-process analytics engine over the Parquet cache: 'duckdb' or 'off'
+ANALYTICS_ENGINE = get_env_str('ACODATA_ANALYTICS_ENGINE', 'duckdb')
+
+# Most rows a single variable query may bring into a session; larger intervals are aggregated
+ROW_BUDGET = get_env_int('ACODATA_ROW_BUDGET', 100000)
+
+# Estimated row count above which interval reads switch from conn.query to the COPY bulk path
+BULK_FETCH_ROW_THRESHOLD = get_env_int('ACODATA_BULK_FETCH_ROW_THRESHOLD', 20000)
+
+# How intervals over ROW_BUDGET are read: 'batch' has the database average them into buckets,
+# 'stream' reads their raw rows in chunks through a server-side cursor, averaging them and redrawing
+# the charts as the chunks arrive
+INTERVAL_READ_MODE = get_env_str('ACODATA_INTERVAL_READ_MODE', 'batch')
+
+# Rows per chunk of a streamed interval, which bounds the memory used while streaming
+STREAMING_CHUNK_ROWS = get_env_int('ACODATA_STREAMING_CHUNK_ROWS', 50000)
+
+# Database used by the commands running outside Streamlit; when empty, the [connections.postgresql]
+# section of .streamlit/secrets.toml is used, like st.connection does
+DATABASE_URL = get_env_str('ACODATA_DATABASE_URL', '')
+SECRETS_PATH = get_env_str('ACODATA_SECRETS_PATH', '.streamlit/secrets.toml')
+
+# Retention job: per-variable policy file and directory of the archived raw rows
+RETENTION_POLICY_PATH = get_env_str('ACODATA_RETENTION_POLICY_PATH', 'retention.toml')
+ARCHIVE_DIR = get_env_str('ACODATA_ARCHIVE_DIR', 'archive')
+
+# Shows the per-rerun trace (render-time waterfall and Chrome trace export) in the sidebar
+DEBUG_TRACING = get_env_bool('ACODATA_DEBUG_TRACING', False)
+
+# Prometheus metrics: 'off', 'file' (text file for the node_exporter textfile collector) or 'http'
+METRICS_MODE = get_env_str('ACODATA_METRICS_MODE', 'off')
+METRICS_FILE_PATH = get_env_str('ACODATA_METRICS_FILE_PATH', 'metrics/acodata.prom')
+# Address of the 'http' endpoint; set it to 0.0.0.0 only where the port is firewalled to the scraper
+METRICS_HOST = get_env_str('ACODATA_METRICS_HOST', '127.0.0.1')
+# Port of the 'http' endpoint: one per Streamlit process, each process serves only its own metrics
+METRICS_PORT = get_env_int('ACODATA_METRICS_PORT', 9464)
+
+# Decimals of the values sent in the figures (sensor precision)
+FIGURE_VALUE_DECIMALS = get_env_int('ACODATA_FIGURE_VALUE_DECIMALS', 3)
+
+# Renderer of the last record panel: 'plotly' (bar chart) or 'html' (pre-rendered bars, no Plotly runtime)
+LAST_RECORD_RENDERER = get_env_str('ACODATA_LAST_RECORD_RENDERER', 'plotly')
+
+# Read replicas for the historical range reads: comma-separated names of [connections.<name>] entries of secrets.toml
+REPLICA_CONNECTIONS = [name.strip() for name in get_env_str('ACODATA_REPLICA_CONNECTIONS', '').split(',') if name.strip()]
+REPLICA_HEALTH_CHECK_SECONDS = get_env_int('ACODATA_REPLICA_HEALTH_CHECK_SECONDS', 30)
+REPLICA_MAX_LAG_SECONDS = get_env_int('ACODATA_REPLICA_MAX_LAG_SECONDS', 300)
+
+# Multi-tenant mode: tenants.toml lists the clients served by this process (absent: single client)
+TENANTS_PATH = get_env_str('ACODATA_TENANTS_PATH', 'tenants.toml')
+# Header holding the slug of the client authenticated by the reverse proxy; empty: ?cliente= with its token
+TENANT_HEADER = get_env_str('ACODATA_TENANT_HEADER', '')
+TENANT_POOL_SIZE = get_env_int('ACODATA_TENANT_POOL_SIZE', 5)
+TENANT_POOL_MAX_OVERFLOW = get_env_int('ACODATA_TENANT_POOL_MAX_OVERFLOW', 10)
+
+# Process-wide store of interval frames, shared by every session and tenant
+FRAME_STORE_BUDGET_MB = get_env_int('ACODATA_FRAME_STORE_BUDGET_MB', 512)
+
+# Cache warmer: preloads the catalog, latest values and default window of every spot at the first
+# run of the process, then again every CACHE_WARMER_INTERVAL_SECONDS (0 warms only once)
+CACHE_WARMER_ENABLED = get_env_bool('ACODATA_CACHE_WARMER_ENABLED', True)
+CACHE_WARMER_INTERVAL_SECONDS = get_env_int('ACODATA_CACHE_WARMER_INTERVAL_SECONDS', 300)
+CACHE_WARMER_WORKERS = get_env_int('ACODATA_CACHE_WARMER_WORKERS', 4)
+
+# Engine of the per-variable reads of a spot: 'sync' (one conn.query after the other) or 'async'
+# (issued at once from an event loop, at most ASYNC_POOL_SIZE connections per database)
+QUERY_ENGINE = get_env_str('ACODATA_QUERY_ENGINE', 'sync')
+ASYNC_POOL_SIZE = get_env_int('ACODATA_ASYNC_POOL_SIZE', 4)
+ASYNC_QUERY_TIMEOUT_SECONDS = get_env_int('ACODATA_ASYNC_QUERY_TIMEOUT_SECONDS', 30)
+
+# Spectral analysis of the vibration variables (alias matching SPECTRA_VARIABLE_PATTERN, ILIKE):
+# windowed FFTs and band energies of every closed day, stored by python -m functions.jobs.spectra
+# and shown under the time series when enabled. Bands are 'low-high' in cycles per hour.
+SPECTRA_ENABLED = get_env_bool('ACODATA_SPECTRA_ENABLED', False)
+SPECTRA_VARIABLE_PATTERN = get_env_str('ACODATA_SPECTRA_VARIABLE_PATTERN', 'vibra%')
+SPECTRA_WINDOW_SAMPLES = get_env_int('ACODATA_SPECTRA_WINDOW_SAMPLES', 256)
+SPECTRA_BANDS_CPH = [tuple(float(edge) for edge in band.split('-'))
+                     for band in get_env_str('ACODATA_SPECTRA_BANDS_CPH', '0-1,1-4,4-12,12-30').split(',') if band.strip()]
+SPECTRA_BACKFILL_DAYS = get_env_int('ACODATA_SPECTRA_BACKFILL_DAYS', 30)
+
+# Anomaly detection: rolling z-scores ('zscore': mean and standard deviation, 'robust': median and
+# MAD) of every column over its previous ANOMALY_WINDOW_SAMPLES samples, computed incrementally by
+# python -m functions.jobs.anomalies and shown as markers on the time series when enabled
+ANOMALIES_ENABLED = get_env_bool('ACODATA_ANOMALIES_ENABLED', False)
+ANOMALY_METHOD = get_env_str('ACODATA_ANOMALY_METHOD', 'robust')
+ANOMALY_WINDOW_SAMPLES = get_env_int('ACODATA_ANOMALY_WINDOW_SAMPLES', 1440)
+ANOMALY_SCORE_THRESHOLD = get_env_float('ACODATA_ANOMALY_SCORE_THRESHOLD', 4.0)
+ANOMALY_BACKFILL_DAYS = get_env_int('ACODATA_ANOMALY_BACKFILL_DAYS', 30)
+ANOMALY_CHUNK_ROWS = get_env_int('ACODATA_ANOMALY_CHUNK_ROWS', 200000)
+ANOMALY_WORKERS = get_env_int('ACODATA_ANOMALY_WORKERS', 1)
+
+# Freshness monitor: a variable is late after FRESHNESS_LATE_SAMPLES expected samples without a
+# row, and stale after FRESHNESS_STALE_SAMPLES; the expected interval is the median spacing of its
+# last FRESHNESS_SAMPLE_ROWS rows. The fleet-wide check is cached for FRESHNESS_TTL_SECONDS.
+FRESHNESS_SAMPLE_ROWS = get_env_int('ACODATA_FRESHNESS_SAMPLE_ROWS', 10)
+FRESHNESS_LATE_SAMPLES = get_env_int('ACODATA_FRESHNESS_LATE_SAMPLES', 3)
+FRESHNESS_STALE_SAMPLES = get_env_int('ACODATA_FRESHNESS_STALE_SAMPLES', 30)
+FRESHNESS_TTL_SECONDS = get_env_int('ACODATA_FRESHNESS_TTL_SECONDS', 60)
+
+# Time-to-threshold forecasting: a robust trend ('linear', or 'exponential' on the logarithm of the
+# values) fitted to the last FORECAST_LOOKBACK_HOURS of every column of the spot, extended to show in
+# the last record panel when it reaches alarm_alert and alarm_critical within FORECAST_HORIZON_DAYS.
+# Columns with fewer than FORECAST_MIN_SAMPLES samples in the lookback are not forecast.
+FORECAST_ENABLED = get_env_bool('ACODATA_FORECAST_ENABLED', False)
+FORECAST_MODEL = get_env_str('ACODATA_FORECAST_MODEL', 'linear')
+FORECAST_LOOKBACK_HOURS = get_env_int('ACODATA_FORECAST_LOOKBACK_HOURS', 24)
+FORECAST_HORIZON_DAYS = get_env_int('ACODATA_FORECAST_HORIZON_DAYS', 30)
+FORECAST_MIN_SAMPLES = get_env_int('ACODATA_FORECAST_MIN_SAMPLES', 30)
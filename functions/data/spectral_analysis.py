@@ -0,0 +1,259 @@
+"""
+Spectral analysis of the spot variables: windowed FFTs and band energies of closed days.
+
+Each day is resampled onto a regular grid of its sampling interval and cut into half-overlapping
+Hann windows. The spectra of every window of every day and column are computed in one NumPy
+call, then averaged per day (Welch's method). A window missing more than MAX_MISSING_FRACTION
+of its samples is left out. Frequencies are in cycles per hour, the power spectral density in
+squared units of the variable per cycle per hour.
+
+The results are stored in SPECTRA_TABLE and SPECTRAL_BANDS_TABLE by functions.jobs.spectra,
+so the dashboard only reads them.
+"""
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+SPECTRA_TABLE = 'spot_spectra'
+SPECTRAL_BANDS_TABLE = 'spot_spectral_bands'
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_HOUR = 60 * 60
+
+# Windows with more missing samples than this fraction (gaps filled by interpolation) are left out
+MAX_MISSING_FRACTION = 0.1
+
+
+def query_create_spectra_table():
+    """
+    Constructs the SQL that creates the table of the daily mean spectra of every column.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""CREATE TABLE IF NOT EXISTS {SPECTRA_TABLE} (
+                    spot_id integer NOT NULL,
+                    global_data_id integer NOT NULL,
+                    column_name text NOT NULL,
+                    period_start bigint NOT NULL,
+                    frequency_cph double precision NOT NULL,
+                    psd double precision NOT NULL,
+                    PRIMARY KEY (spot_id, global_data_id, period_start, column_name, frequency_cph)
+                );"""
+    return query
+
+def query_create_spectral_bands_table():
+    """
+    Constructs the SQL that creates the table of the daily band energies of every column.
+
+    Every analysed day has its rows here, with windows = 0 when no window was complete enough,
+    so the job knows which days are done.
+
+    Returns:
+        str: The SQL statement.
+    """
+    query = f"""CREATE TABLE IF NOT EXISTS {SPECTRAL_BANDS_TABLE} (
+                    spot_id integer NOT NULL,
+                    global_data_id integer NOT NULL,
+                    column_name text NOT NULL,
+                    period_start bigint NOT NULL,
+                    band_low_cph double precision NOT NULL,
+                    band_high_cph double precision NOT NULL,
+                    energy double precision,
+                    windows integer NOT NULL,
+                    PRIMARY KEY (spot_id, global_data_id, period_start, column_name, band_low_cph)
+                );"""
+    return query
+
+def create_spectral_tables(connection):
+    """
+    Creates the spectra and band energy tables if they do not exist.
+
+    Args:
+        connection: A psycopg2 connection.
+
+    Returns:
+        None
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query_create_spectra_table())
+        cursor.execute(query_create_spectral_bands_table())
+    connection.commit()
+    return None
+
+def get_sample_seconds(timestamps):
+    """
+    Returns the sampling interval of a variable, the median spacing of its timestamps.
+
+    Args:
+        timestamps (numpy.ndarray): The sorted unix timestamps of the rows.
+
+    Returns:
+        int: The interval in seconds, or None if there are fewer than two distinct timestamps.
+    """
+    spacing = np.diff(np.unique(timestamps))
+    if len(spacing) == 0:
+        return None
+    return max(int(np.median(spacing)), 1)
+
+def grid_days(df, days, sample_seconds):
+    """
+    Resamples the rows of whole days onto a regular grid, averaging the rows of each slot.
+
+    Args:
+        df (DataFrame): The raw rows, value columns and an integer 'timestamp' column.
+        days (list): The indexes of the UTC days, consecutive.
+        sample_seconds (int): The width of the grid slots in seconds.
+
+    Returns:
+        tuple: The values (columns x days x slots, NaN where a slot has no row) and the mask of
+        empty slots (days x slots).
+    """
+    value_columns = [column for column in df.columns if column != 'timestamp']
+    slots_per_day = SECONDS_PER_DAY // sample_seconds
+    timestamps = df['timestamp'].to_numpy(dtype='int64')
+    day_offsets = timestamps // SECONDS_PER_DAY - days[0]
+    in_days = (day_offsets >= 0) & (day_offsets < len(days))
+    slots = (day_offsets * slots_per_day
+             + np.minimum((timestamps % SECONDS_PER_DAY) // sample_seconds, slots_per_day - 1))[in_days]
+    n_slots = len(days) * slots_per_day
+    counts = np.bincount(slots, minlength=n_slots)
+    grid = np.full((len(value_columns), n_slots), np.nan)
+    filled = counts > 0
+    for index, column in enumerate(value_columns):
+        values = df[column].to_numpy(dtype='float64', na_value=np.nan)[in_days]
+        present = ~np.isnan(values)
+        column_sums = np.bincount(slots[present], weights=values[present], minlength=n_slots)
+        column_counts = np.bincount(slots[present], minlength=n_slots)
+        grid[index, column_counts > 0] = column_sums[column_counts > 0] / column_counts[column_counts > 0]
+    # Gaps between samples are filled linearly, all columns at once; leading and trailing gaps stay NaN
+    grid = pd.DataFrame(grid.T).interpolate(limit_area='inside').to_numpy().T
+    return grid.reshape(len(value_columns), len(days), slots_per_day), ~filled.reshape(len(days), slots_per_day)
+
+def welch_spectra(grid, missing, sample_seconds, window_samples):
+    """
+    Computes the mean spectrum of every column and day over half-overlapping Hann windows.
+
+    Args:
+        grid (numpy.ndarray): The gridded values, columns x days x slots.
+        missing (numpy.ndarray): The mask of empty slots, days x slots.
+        sample_seconds (int): The width of the grid slots in seconds.
+        window_samples (int): The number of samples per window.
+
+    Returns:
+        tuple: The frequencies in cycles per hour, the mean power spectral density (columns x days
+        x frequencies, NaN for days without windows) and the number of windows used (columns x days).
+    """
+    step = max(window_samples // 2, 1)
+    windows = np.lib.stride_tricks.sliding_window_view(grid, window_samples, axis=-1)[:, :, ::step]
+    missing_fraction = np.lib.stride_tricks.sliding_window_view(missing, window_samples, axis=-1)[:, ::step].mean(axis=-1)
+    valid = (missing_fraction <= MAX_MISSING_FRACTION) & ~np.isnan(windows).any(axis=-1)
+
+    segments = np.where(valid[..., None], windows, 0.0)
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    taper = np.hanning(window_samples)
+    samples_per_hour = SECONDS_PER_HOUR / sample_seconds
+    power = np.abs(np.fft.rfft(segments * taper, axis=-1)) ** 2 / (samples_per_hour * np.sum(taper ** 2))
+    # One-sided density: every bin but the zero and Nyquist frequencies holds both signs
+    power[..., 1:(window_samples + 1) // 2] *= 2
+
+    window_counts = valid.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_psd = (power * valid[..., None]).sum(axis=-2) / window_counts[..., None]
+    frequencies = np.fft.rfftfreq(window_samples, d=1 / samples_per_hour)
+    return frequencies, mean_psd, window_counts
+
+def band_energies(frequencies, mean_psd, bands):
+    """
+    Integrates the power spectral density over frequency bands.
+
+    Args:
+        frequencies (numpy.ndarray): The frequencies in cycles per hour.
+        mean_psd (numpy.ndarray): The power spectral density, frequencies on the last axis.
+        bands (list): The (low, high) edges of each band in cycles per hour, low included and high excluded.
+
+    Returns:
+        numpy.ndarray: The energy of each band, bands on the last axis.
+    """
+    band_matrix = np.array([(frequencies >= low) & (frequencies < high) for low, high in bands], dtype='float64').T
+    return mean_psd @ band_matrix * (frequencies[1] - frequencies[0])
+
+def compute_day_spectra(df, days, sample_seconds, window_samples, bands):
+    """
+    Computes the mean spectra and band energies of every column of a variable, for each day.
+
+    Args:
+        df (DataFrame): The raw rows of the days, value columns and an integer 'timestamp' column.
+        days (list): The indexes of the UTC days, consecutive.
+        sample_seconds (int): The sampling interval of the variable in seconds.
+        window_samples (int): The number of samples per window.
+        bands (list): The (low, high) edges of each band in cycles per hour.
+
+    Returns:
+        tuple: The spectra rows ('column_name', 'period_start', 'frequency_cph', 'psd') of the days
+        with windows, and the band rows ('column_name', 'period_start', 'band_low_cph',
+        'band_high_cph', 'energy', 'windows') of every day.
+    """
+    value_columns = [column for column in df.columns if column != 'timestamp']
+    grid, missing = grid_days(df, days, sample_seconds)
+    frequencies, mean_psd, window_counts = welch_spectra(grid, missing, sample_seconds, window_samples)
+    energies = band_energies(frequencies, mean_psd, bands)
+
+    period_starts = np.asarray(days, dtype='int64') * SECONDS_PER_DAY
+    column_index, day_index, frequency_index = np.meshgrid(np.arange(len(value_columns)), np.arange(len(days)),
+                                                           np.arange(len(frequencies)), indexing='ij')
+    spectra_df = pd.DataFrame({'column_name': np.asarray(value_columns)[column_index.ravel()],
+                               'period_start': period_starts[day_index.ravel()],
+                               'frequency_cph': frequencies[frequency_index.ravel()],
+                               'psd': mean_psd.ravel()})
+    spectra_df = spectra_df[np.repeat(window_counts.ravel() > 0, len(frequencies))]
+
+    column_index, day_index, band_index = np.meshgrid(np.arange(len(value_columns)), np.arange(len(days)),
+                                                      np.arange(len(bands)), indexing='ij')
+    band_edges = np.asarray(bands, dtype='float64')
+    bands_df = pd.DataFrame({'column_name': np.asarray(value_columns)[column_index.ravel()],
+                             'period_start': period_starts[day_index.ravel()],
+                             'band_low_cph': band_edges[band_index.ravel(), 0],
+                             'band_high_cph': band_edges[band_index.ravel(), 1],
+                             'energy': energies.ravel(),
+                             'windows': np.repeat(window_counts.ravel(), len(bands))})
+    return spectra_df.reset_index(drop=True), bands_df
+
+def upsert_day_spectra(cursor, spot_id, global_data_id, spectra_df, bands_df, page_size=5000):
+    """
+    Stores the spectra and band energies of a variable, replacing those of the same days.
+
+    Args:
+        cursor: A psycopg2 cursor.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        spectra_df (DataFrame): The spectra rows returned by compute_day_spectra.
+        bands_df (DataFrame): The band rows returned by compute_day_spectra.
+        page_size (int): The number of rows per INSERT statement.
+
+    Returns:
+        None
+    """
+    spectra_rows = [(int(spot_id), int(global_data_id), row.column_name, int(row.period_start), float(row.frequency_cph), float(row.psd))
+                    for row in spectra_df.itertuples(index=False)]
+    execute_values(cursor,
+                   f"""INSERT INTO {SPECTRA_TABLE}
+                           (spot_id, global_data_id, column_name, period_start, frequency_cph, psd)
+                       VALUES %s
+                       ON CONFLICT (spot_id, global_data_id, period_start, column_name, frequency_cph)
+                       DO UPDATE SET psd = EXCLUDED.psd;""",
+                   spectra_rows,
+                   page_size=page_size)
+    band_rows = [(int(spot_id), int(global_data_id), row.column_name, int(row.period_start), float(row.band_low_cph),
+                  float(row.band_high_cph), None if np.isnan(row.energy) else float(row.energy), int(row.windows))
+                 for row in bands_df.itertuples(index=False)]
+    execute_values(cursor,
+                   f"""INSERT INTO {SPECTRAL_BANDS_TABLE}
+                           (spot_id, global_data_id, column_name, period_start, band_low_cph, band_high_cph, energy, windows)
+                       VALUES %s
+                       ON CONFLICT (spot_id, global_data_id, period_start, column_name, band_low_cph)
+                       DO UPDATE SET band_high_cph = EXCLUDED.band_high_cph,
+                                     energy = EXCLUDED.energy,
+                                     windows = EXCLUDED.windows;""",
+                   band_rows,
+                   page_size=page_size)
+    return None
@@ -0,0 +1,54 @@
+import uuid
+
+import pandas as pd
+
+from functions.data import settings
+
+
+def use_streaming(estimated_rows):
+    """
+    Checks whether an interval should be streamed in chunks instead of fetched whole.
+
+    Args:
+        estimated_rows (int): The estimated number of rows of the interval, or None if unknown.
+
+    Returns:
+        bool: True if the streaming mode is on and the interval is large.
+    """
+    return (settings.INTERVAL_READ_MODE == 'stream'
+            and estimated_rows is not None
+            and estimated_rows > settings.BULK_FETCH_ROW_THRESHOLD)
+
+def stream_query_chunks(conn, query, chunk_rows=None):
+    """
+    Reads the result of a query in chunks through a named (server-side) cursor.
+
+    Only one chunk is held in memory at a time. The cursor lives in a transaction of a pooled
+    psycopg2 connection, which is rolled back and returned to the pool when the generator is
+    exhausted or closed.
+
+    Args:
+        conn: The Streamlit SQL connection to the database.
+        query (str): The SELECT query.
+        chunk_rows (int): The number of rows per chunk. Defaults to STREAMING_CHUNK_ROWS.
+
+    Yields:
+        DataFrame: The rows of each chunk.
+    """
+    if chunk_rows is None:
+        chunk_rows = settings.STREAMING_CHUNK_ROWS
+    raw_connection = conn.engine.raw_connection()
+    try:
+        cursor = raw_connection.cursor(name=f'acodata_stream_{uuid.uuid4().hex}')
+        cursor.itersize = chunk_rows
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            columns = [column.name for column in cursor.description]
+            yield pd.DataFrame.from_records(rows, columns=columns)
+        cursor.close()
+    finally:
+        raw_connection.rollback()  # Ends the transaction holding the named cursor
+        raw_connection.close()  # Returns the connection to the pool
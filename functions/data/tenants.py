@@ -0,0 +1,181 @@
+"""
+Clients served by one dashboard process.
+
+tenants.toml (see tenants.example.toml) maps the slug of each client to its header texts and to
+the [connections.<name>] entry of secrets.toml of its database. Every client gets its own pooled
+connection and its own cache namespace, while the process, its libraries and the frame store budget
+are shared. Without tenants.toml the dashboard serves the single client below.
+
+The slug alone gives no access, since anyone can edit a URL. With ACODATA_TENANT_HEADER set, the
+client of a session is the slug the authenticating reverse proxy puts in that header (the proxy
+must overwrite the header sent by the browser, and Streamlit must only be reachable through it).
+Otherwise a session opens ?cliente=<slug>&token=<token>, and the token must match the secret
+token of the client in tenants.toml.
+"""
+import hmac
+import os
+
+import streamlit as st
+import toml
+
+from functions.data import settings
+
+SINGLE_TENANT = {'slug': None,
+                 'client_name': 'PLATAFORMA CONFIABILIDADE',
+                 'code': 'CÓDIGO: 645205 - MODELO: ACOWLV4T4',
+                 'application': 'APLICAÇÃO: REDUTORES, MOTOREDUTORES & CONTRA RECUO',
+                 'connection': 'postgresql',
+                 'replicas': settings.REPLICA_CONNECTIONS}
+
+# Settings every entry of tenants.toml must give: nothing is inherited from the single client
+REQUIRED_TENANT_KEYS = ('client_name', 'code', 'application', 'connection')
+
+
+def load_tenants(tenants_path=None):
+    """
+    Reads the tenants file.
+
+    Args:
+        tenants_path (str): The path of the tenants file. Defaults to TENANTS_PATH.
+
+    Returns:
+        dict: The settings of each tenant by slug, empty (single tenant) if the file does not exist.
+    """
+    if tenants_path is None:
+        tenants_path = settings.TENANTS_PATH
+    if not os.path.exists(tenants_path):
+        return {}
+    return toml.load(tenants_path).get('tenants', {})
+
+def get_query_param(name):
+    """
+    Reads a parameter of the URL of the session.
+
+    Args:
+        name (str): The name of the parameter.
+
+    Returns:
+        str: The value, or None if the URL has none.
+    """
+    if hasattr(st, 'query_params'):
+        return st.query_params.get(name)
+    return st.experimental_get_query_params().get(name, [None])[0]  # Streamlit < 1.30
+
+def get_request_header(name):
+    """
+    Reads a header of the HTTP request that opened the session.
+
+    Args:
+        name (str): The name of the header (case-insensitive).
+
+    Returns:
+        str: The value, or None if the request has none.
+    """
+    if hasattr(st, 'context'):
+        return st.context.headers.get(name)
+    from streamlit.web.server.websocket_headers import _get_websocket_headers  # Streamlit < 1.37
+    headers = _get_websocket_headers()
+    return headers.get(name) if headers is not None else None
+
+def build_tenant(tenants, slug):
+    """
+    Builds the settings of a tenant of the tenants file, without checking any access.
+
+    Args:
+        tenants (dict): The tenants by slug, as returned by load_tenants().
+        slug (str): The slug of a tenant of the file.
+
+    Returns:
+        dict: The settings of the tenant, without its token.
+
+    Raises:
+        ValueError: If the tenant misses a required setting.
+    """
+    for key in REQUIRED_TENANT_KEYS:
+        if key not in tenants[slug]:
+            raise ValueError(f"Tenant '{slug}' has no {key} in {settings.TENANTS_PATH}.")
+    # The replicas of the single client belong to its database, so a tenant only gets the ones it lists
+    tenant = {'replicas': []}
+    tenant.update(tenants[slug])
+    tenant.pop('token', None)
+    tenant['slug'] = slug
+    return tenant
+
+def get_tenant(tenants, slug, token=None, authenticated=False):
+    """
+    Resolves the tenant of a request, checking its secret token unless the proxy authenticated the slug.
+
+    Args:
+        tenants (dict): The tenants by slug, as returned by load_tenants().
+        slug (str): The slug given in the URL or the proxy header, or None.
+        token (str): The token given in the URL, or None.
+        authenticated (bool): Whether the slug comes from the trusted header of ACODATA_TENANT_HEADER.
+
+    Returns:
+        dict: The settings of the tenant, SINGLE_TENANT without a tenants file, or None if the slug
+        is unknown or the token does not match.
+
+    Raises:
+        ValueError: If the tenant misses a required setting, or its token without a trusted header.
+    """
+    if not tenants:
+        return SINGLE_TENANT
+    if slug not in tenants:
+        return None
+    tenant = build_tenant(tenants, slug)
+    if authenticated:
+        return tenant
+    expected_token = tenants[slug].get('token')
+    if not expected_token:
+        raise ValueError(f"Tenant '{slug}' has no token in {settings.TENANTS_PATH} and ACODATA_TENANT_HEADER is not set.")
+    if token is None or not hmac.compare_digest(str(token).encode(), str(expected_token).encode()):
+        return None
+    return tenant
+
+def get_session_tenant(tenants):
+    """
+    Resolves the tenant of the current session, from the proxy header or from the URL and its token.
+
+    Args:
+        tenants (dict): The tenants by slug, as returned by load_tenants().
+
+    Returns:
+        dict: The settings of the tenant, or None if the session has no access to any.
+    """
+    if settings.TENANT_HEADER:
+        return get_tenant(tenants, get_request_header(settings.TENANT_HEADER), authenticated=True)
+    return get_tenant(tenants, get_query_param('cliente'), token=get_query_param('token'))
+
+def list_tenants(tenants):
+    """
+    Lists every tenant served by the process.
+
+    Args:
+        tenants (dict): The tenants by slug, as returned by load_tenants().
+
+    Returns:
+        list: The settings of each tenant, [SINGLE_TENANT] without a tenants file.
+    """
+    if not tenants:
+        return [SINGLE_TENANT]
+    return [build_tenant(tenants, slug) for slug in tenants]
+
+def connect_tenant(tenant):
+    """
+    Opens the pooled connections of a tenant, shared by every session of the process.
+
+    st.connection keeps one connection per name and arguments, so the sessions and the cache
+    warmer of a tenant share the same pool and the same conn.query cache.
+
+    Args:
+        tenant (dict): The settings of the tenant.
+
+    Returns:
+        The Streamlit SQL connection to the database of the tenant.
+        dict: The Streamlit SQL connections to its read replicas, by name.
+    """
+    conn = st.connection(tenant['connection'], type="sql",
+                         pool_size=settings.TENANT_POOL_SIZE,
+                         max_overflow=settings.TENANT_POOL_MAX_OVERFLOW)
+    replica_conns = {name: st.connection(name, type="sql") for name in tenant['replicas']}
+    return conn, replica_conns
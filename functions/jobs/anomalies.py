@@ -0,0 +1,297 @@
+"""
+Anomaly detection job: scores the new rows of every spot variable table against their rolling window.
+
+Usage (from the repository root):
+    python -m functions.jobs.anomalies [--url postgresql+psycopg2://...] [--workers 4] [--method robust] [--spot-id 1]
+
+Each variable resumes from the last timestamp it scored (see functions.data.anomaly_detection):
+the window of rows before it is read back, then the new rows in chunks of ANOMALY_CHUNK_ROWS,
+each scored for all its columns at once. The anomalies of a chunk and the new progress are
+committed together, so an interrupted run resumes where it stopped. A first run starts
+ANOMALY_BACKFILL_DAYS before the last record. With --workers above 1, the variables are spread
+over a pool of processes, each with its own connection, as the parallel ingestion does.
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+
+import pandas as pd
+
+from functions.data import anomaly_detection, database, settings
+from functions.jobs import retention
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+logger = logging.getLogger('acodata.anomalies')
+
+# Engine of each worker process, created once by init_worker_process
+worker_engine = None
+
+
+def query_progress(spot_id, global_data_id):
+    """
+    Constructs the SQL that reads the last timestamp scored of a variable.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f"""SELECT last_timestamp
+               FROM {anomaly_detection.ANOMALY_PROGRESS_TABLE}
+               WHERE spot_id = {spot_id} AND global_data_id = {global_data_id};"""
+
+def query_last_timestamp(spot_id, global_data_id):
+    """
+    Constructs the SQL that reads the timestamp of the last record of a variable.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f'SELECT MAX(timestamp) FROM spot_{spot_id}_var_{global_data_id};'
+
+def query_rows_until(spot_id, global_data_id, timestamp, rows):
+    """
+    Constructs the SQL that reads the last rows up to a timestamp, in timestamp order.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        timestamp (int): The last timestamp read (included).
+        rows (int): The number of rows.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f"""SELECT *
+               FROM (SELECT *
+                     FROM spot_{spot_id}_var_{global_data_id}
+                     WHERE timestamp <= {timestamp}
+                     ORDER BY timestamp DESC
+                     LIMIT {rows}) AS window_rows
+               ORDER BY timestamp;"""
+
+def query_rows_after(spot_id, global_data_id, timestamp, rows):
+    """
+    Constructs the SQL that reads the next rows after a timestamp, in timestamp order.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        timestamp (int): The last timestamp already scored (excluded).
+        rows (int): The most rows read.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f"""SELECT *
+               FROM spot_{spot_id}_var_{global_data_id}
+               WHERE timestamp > {timestamp}
+               ORDER BY timestamp
+               LIMIT {rows};"""
+
+def get_start_timestamp(connection, spot_id, global_data_id, backfill_days):
+    """
+    Returns the timestamp after which the rows of a variable are not scored yet.
+
+    Args:
+        connection: A psycopg2 connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        backfill_days (int): How many days before the last record a first run starts.
+
+    Returns:
+        int: The timestamp, or None if the table is empty.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query_progress(spot_id, global_data_id))
+        progress = cursor.fetchone()
+        if progress is None:
+            cursor.execute(query_last_timestamp(spot_id, global_data_id))
+            last_timestamp = cursor.fetchone()[0]
+    connection.commit()
+    if progress is not None:
+        return progress[0]
+    if last_timestamp is None:
+        return None
+    return last_timestamp - backfill_days * SECONDS_PER_DAY
+
+def read_rows(connection, query):
+    """
+    Runs a query on a psycopg2 connection into a DataFrame.
+
+    Args:
+        connection: A psycopg2 connection.
+        query (str): The SQL query.
+
+    Returns:
+        DataFrame: The rows.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        columns = [column.name for column in cursor.description]
+        rows = cursor.fetchall()
+    connection.commit()
+    return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+def score_variable(engine, spot_id, global_data_id, method, window_samples, threshold, chunk_rows, backfill_days):
+    """
+    Scores the rows of a variable not scored yet, chunk by chunk.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        method (str): 'zscore' or 'robust'.
+        window_samples (int): The number of samples of the rolling window.
+        threshold (float): The absolute score from which a sample is anomalous.
+        chunk_rows (int): The most new rows scored at once.
+        backfill_days (int): How many days before the last record a first run starts.
+
+    Returns:
+        dict: The 'spot_id', 'global_data_id', 'rows' scored, 'anomalies' found and 'seconds' taken.
+    """
+    start_time = time.time()
+    rows_scored = 0
+    anomalies_found = 0
+    connection = engine.raw_connection()
+    try:
+        last_timestamp = get_start_timestamp(connection, spot_id, global_data_id, backfill_days)
+        if last_timestamp is not None:
+            history_rows = window_samples
+            history_df = read_rows(connection, query_rows_until(spot_id, global_data_id, last_timestamp, history_rows))
+            while True:
+                new_df = read_rows(connection, query_rows_after(spot_id, global_data_id, last_timestamp, chunk_rows))
+                full_chunk = len(new_df) == chunk_rows
+                if full_chunk and new_df['timestamp'].iloc[0] != new_df['timestamp'].iloc[-1]:
+                    # The LIMIT may split the rows of the last timestamp: they are left to the next chunk
+                    new_df = new_df[new_df['timestamp'] < new_df['timestamp'].iloc[-1]]
+                if new_df.empty:
+                    break
+                anomalies_df = anomaly_detection.detect_anomalies(history_df, new_df, window_samples, method, threshold)
+                last_timestamp = int(new_df['timestamp'].iloc[-1])
+                anomaly_detection.write_anomalies(connection, spot_id, global_data_id, anomalies_df, last_timestamp)
+                rows_scored += len(new_df)
+                anomalies_found += len(anomalies_df)
+                history_df = pd.concat([history_df, new_df], ignore_index=True).tail(history_rows)
+                if not full_chunk:
+                    break
+    finally:
+        connection.close()
+    seconds = time.time() - start_time
+    logger.info('spot_%s_var_%s: %d rows scored, %d anomalies (%.2f s)', spot_id, global_data_id,
+                rows_scored, anomalies_found, seconds)
+    return {'spot_id': spot_id,
+            'global_data_id': global_data_id,
+            'rows': rows_scored,
+            'anomalies': anomalies_found,
+            'seconds': round(seconds, 3)}
+
+def init_worker_process(url):
+    """
+    Creates the engine of a worker process, with a single connection.
+
+    Args:
+        url (str): The database URL.
+
+    Returns:
+        None
+    """
+    global worker_engine
+    worker_engine = database.create_engine(url=url, pool_size=1)
+    return None
+
+def score_variable_in_worker_process(spot_id, global_data_id, *args):
+    """
+    Scores a variable with the engine of the current worker process.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        *args: The other arguments of score_variable.
+
+    Returns:
+        dict: The report of score_variable.
+    """
+    return score_variable(worker_engine, spot_id, global_data_id, *args)
+
+def list_variables(engine, spot_id=None):
+    """
+    Lists every variable of every spot, or of one spot.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        spot_id (int): Only list the variables of this spot, if given.
+
+    Returns:
+        list: Tuples (spot_id, global_data_id).
+    """
+    connection = engine.raw_connection()
+    try:
+        spot_ids = [spot_id] if spot_id is not None else read_rows(connection, retention.query_spot_ids())['spot_id'].tolist()
+        return [(spot, global_data_id)
+                for spot in spot_ids
+                for global_data_id in read_rows(connection, retention.query_spot_variable_ids(spot))['global_data_id'].tolist()]
+    finally:
+        connection.close()
+
+def run_anomalies(engine, workers=None, method=None, spot_id=None):
+    """
+    Scores the new rows of every spot variable, in this process or over a pool of worker processes.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        workers (int): The number of worker processes; 1 scores in this process. Defaults to ANOMALY_WORKERS.
+        method (str): 'zscore' or 'robust'. Defaults to ANOMALY_METHOD.
+        spot_id (int): Only score the variables of this spot, if given.
+
+    Returns:
+        DataFrame: One row per variable with the rows scored, the anomalies found and the time taken.
+    """
+    workers = settings.ANOMALY_WORKERS if workers is None else workers
+    method = settings.ANOMALY_METHOD if method is None else method
+    score_args = (method, settings.ANOMALY_WINDOW_SAMPLES, settings.ANOMALY_SCORE_THRESHOLD,
+                  settings.ANOMALY_CHUNK_ROWS, settings.ANOMALY_BACKFILL_DAYS)
+
+    connection = engine.raw_connection()
+    try:
+        anomaly_detection.create_anomaly_tables(connection)
+    finally:
+        connection.close()
+    variables = list_variables(engine, spot_id)
+
+    if workers > 1:
+        url = engine.url.render_as_string(hide_password=False)
+        with multiprocessing.Pool(processes=workers, initializer=init_worker_process, initargs=(url,)) as pool:
+            report = pool.starmap(score_variable_in_worker_process, [variable + score_args for variable in variables])
+    else:
+        report = [score_variable(engine, *variable, *score_args) for variable in variables]
+    return pd.DataFrame(report, columns=['spot_id', 'global_data_id', 'rows', 'anomalies', 'seconds'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Scores the new rows of the spot variable tables and stores their anomalies.')
+    parser.add_argument('--url', default=None, help='Database URL (defaults to ACODATA_DATABASE_URL or secrets.toml).')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (defaults to ACODATA_ANOMALY_WORKERS).')
+    parser.add_argument('--method', choices=anomaly_detection.ANOMALY_METHODS, default=None, help='Defaults to ACODATA_ANOMALY_METHOD.')
+    parser.add_argument('--spot-id', type=int, default=None, help='Only score this spot.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    start_time = time.time()
+    report_df = run_anomalies(engine=database.create_engine(url=args.url),
+                              workers=args.workers,
+                              method=args.method,
+                              spot_id=args.spot_id)
+    print(report_df.to_string(index=False))
+    print(f'{report_df["rows"].sum()} rows, {report_df["anomalies"].sum()} anomalies in {time.time() - start_time:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
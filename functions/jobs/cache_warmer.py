@@ -0,0 +1,206 @@
+"""
+Cache warmer: preloads the shared caches, so no operator opens a cold dashboard.
+
+The first run of app.py in the process starts a daemon thread that warms every tenant, and warms
+them again every CACHE_WARMER_INTERVAL_SECONDS. A pass reads what the default page of each spot
+reads, through the same builder functions, so the cache keys are the same ones: the spot catalog
+and text aliases, the variables, alarms and last record of every variable (conn.query cache), the
+default 24 hour window of every variable (frame store and Parquet cache), and the trend fits of
+the spot when FORECAST_ENABLED (forecasting.forecast_cache). The spots of a tenant are warmed by
+at most CACHE_WARMER_WORKERS threads, fewer than the connections of its pool, so sessions still
+get connections while a pass runs. Later passes are cheap: only what
+expired or changed since the last pass (a new last record, ...) reaches the database.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from functions.content import last_record_chart_builder, spot_selector_builder, time_series_plot_builder
+from functions.data import forecasting, settings, tenants
+from functions.data.query_context import QueryContext
+from functions.monitoring import metrics
+
+logger = logging.getLogger('acodata.warmer')
+
+# Loggers that warn about every cached call made outside a script run (module moved in Streamlit 1.37)
+SCRIPT_RUN_CONTEXT_LOGGERS = ('streamlit.runtime.scriptrunner.script_run_context',
+                              'streamlit.runtime.scriptrunner_utils.script_run_context')
+
+warmer_lock = threading.Lock()
+warmer_thread = None
+
+
+class WarmerThreadFilter(logging.Filter):
+    """Drops the missing ScriptRunContext warnings of the warmer threads, which run outside any session by design."""
+
+    def filter(self, record):
+        return not threading.current_thread().name.startswith('acodata-warmer')
+
+
+def warm_catalog(conn):
+    """
+    Preloads the metadata shared by every spot of a tenant: the spot catalog and the text aliases.
+
+    Args:
+        conn (QueryContext): The context on the connection of the tenant.
+
+    Returns:
+        list: The IDs of the spots of the tenant.
+    """
+    spots_df, _ = spot_selector_builder.get_column_from_table(conn=conn, column='*', table='alias_spots')
+    last_record_chart_builder.get_text_alias_df(conn=conn)
+    return spots_df['spot_id'].tolist()
+
+def warm_spot(conn, spot_id):
+    """
+    Preloads the default page of a spot: the latest values of its variables and their last 24 hours.
+
+    Args:
+        conn (QueryContext): A context on the connection of the tenant, used by this spot only.
+        spot_id (int): The ID of the spot.
+
+    Returns:
+        int: The number of variables preloaded.
+    """
+    variables_from_spot_df, _ = last_record_chart_builder.variables_from_spot(conn=conn,
+                                                                             spot_id=spot_id,
+                                                                             global_data_id_column='global_data_id',
+                                                                             global_data_name_column='global_data_name',
+                                                                             column_not_null='alarm_critical')
+    global_data_ids = variables_from_spot_df['global_data_id'].tolist()
+    if not global_data_ids:
+        return 0
+
+    # Both builders read the alarms with the same query, so one read warms the two of them
+    last_record_timestamps = {}
+    forecast_variables = {}
+    for global_data_id in global_data_ids:
+        variable_name_alarms_df, _ = last_record_chart_builder.get_variable_name_alarms(conn=conn, spot_id=spot_id, global_data_id=global_data_id)
+        last_record_df, _ = last_record_chart_builder.get_last_record(conn=conn, spot_id=spot_id, global_data_id=global_data_id)
+        last_record_timestamps[global_data_id] = last_record_chart_builder.get_last_record_timestamp(last_record_df)
+        # A variable without alarms has nothing to forecast, and must not fail the rest of the spot
+        if settings.FORECAST_ENABLED and not variable_name_alarms_df.empty:
+            forecast_variables[global_data_id] = (last_record_timestamps[global_data_id],
+                                                  variable_name_alarms_df['alarm_alert'].iloc[0],
+                                                  variable_name_alarms_df['alarm_critical'].iloc[0])
+
+    if forecast_variables:
+        forecasting.get_spot_forecasts(conn=conn, spot_id=spot_id, variables=forecast_variables)
+
+    # The default window ends at the newest last record of the spot, which show_last_record_chart
+    # hands to show_line_plots as the end of the window and the version of the stored frames
+    spot_last_timestamp_int = max(last_record_timestamps.values())
+    start_timestamp, end_timestamp = time_series_plot_builder.get_timestamps_for_query(date_interval=None,
+                                                                                      last_record_timestamp_int=spot_last_timestamp_int)
+    for global_data_id in global_data_ids:
+        time_series_plot_builder.get_interval_df(conn=conn,
+                                                 spot_id=spot_id,
+                                                 global_data_id=global_data_id,
+                                                 start_timestamp=start_timestamp,
+                                                 end_timestamp=end_timestamp,
+                                                 last_record_timestamp_int=spot_last_timestamp_int)
+    return len(global_data_ids)
+
+def warm_tenant(tenant, workers=None):
+    """
+    Preloads the catalog and every spot of a tenant, with bounded concurrency.
+
+    Args:
+        tenant (dict): The settings of the tenant.
+        workers (int): The most spots warmed at once. Defaults to CACHE_WARMER_WORKERS.
+
+    Returns:
+        int: The number of spots preloaded.
+        int: The number of spots whose preload failed.
+    """
+    if workers is None:
+        workers = settings.CACHE_WARMER_WORKERS
+    tenant_name = tenant['slug'] or 'default'
+    conn, replica_conns = tenants.connect_tenant(tenant)
+
+    def new_context():
+        # A context per spot, since a QueryContext is not shared between threads
+        return QueryContext(conn, replicas=replica_conns, namespace=tenant['slug'])
+
+    spot_ids = warm_catalog(new_context())
+    warmed_spots = failed_spots = 0
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='acodata-warmer') as executor:
+        futures = {executor.submit(warm_spot, new_context(), spot_id): spot_id for spot_id in spot_ids}
+        for future in as_completed(futures):
+            try:
+                variables = future.result()
+                warmed_spots += 1
+                logger.info('%s: spot %s warmed (%d variables), %d/%d',
+                            tenant_name, futures[future], variables, warmed_spots + failed_spots, len(spot_ids))
+            except Exception as error:
+                failed_spots += 1
+                logger.warning('%s: spot %s not warmed: %s', tenant_name, futures[future], error)
+    return warmed_spots, failed_spots
+
+def run_warm_pass():
+    """
+    Preloads every tenant served by the process, one tenant after the other.
+
+    Returns:
+        int: The number of spots preloaded.
+        int: The number of spots (or tenants, counted as one) whose preload failed.
+    """
+    start_time = time.time()
+    warmed_spots = failed_spots = 0
+    for tenant in tenants.list_tenants(tenants.load_tenants()):
+        try:
+            tenant_warmed, tenant_failed = warm_tenant(tenant)
+        except Exception as error:
+            logger.warning('%s: catalog not warmed: %s', tenant['slug'] or 'default', error)
+            tenant_warmed, tenant_failed = 0, 1
+        warmed_spots += tenant_warmed
+        failed_spots += tenant_failed
+    elapsed_time = time.time() - start_time
+    logger.info('Cache warm pass: %d spots warmed, %d failed in %.1f s', warmed_spots, failed_spots, elapsed_time)
+    metrics.observe_cache_warm(elapsed_time, warmed_spots, failed_spots)
+    return warmed_spots, failed_spots
+
+def run_warmer(interval_seconds):
+    """
+    Runs a warm pass, then another one every interval, for the life of the process.
+
+    Args:
+        interval_seconds (int): The seconds between the start of two passes. 0 runs a single pass.
+
+    Returns:
+        None
+    """
+    while True:
+        start_time = time.time()
+        try:
+            run_warm_pass()
+        except Exception:
+            logger.exception('Cache warm pass failed')
+        if interval_seconds <= 0:
+            return None
+        time.sleep(max(interval_seconds - (time.time() - start_time), 0))
+
+def start_warmer(interval_seconds=None):
+    """
+    Starts the cache warmer in a daemon thread, once per process.
+
+    Args:
+        interval_seconds (int): The seconds between two passes. Defaults to CACHE_WARMER_INTERVAL_SECONDS.
+
+    Returns:
+        None
+    """
+    global warmer_thread
+    if not settings.CACHE_WARMER_ENABLED:
+        return None
+    if interval_seconds is None:
+        interval_seconds = settings.CACHE_WARMER_INTERVAL_SECONDS
+    with warmer_lock:
+        if warmer_thread is not None:
+            return None
+        for logger_name in SCRIPT_RUN_CONTEXT_LOGGERS:
+            logging.getLogger(logger_name).addFilter(WarmerThreadFilter())
+        warmer_thread = threading.Thread(target=run_warmer, args=(interval_seconds,), name='acodata-warmer', daemon=True)
+    warmer_thread.start()
+    return None
@@ -0,0 +1,300 @@
+"""
+Retention and compaction of the spot variable tables.
+
+Usage (from the repository root):
+    python -m functions.jobs.retention [--dry-run] [--batch-rows 50000] [--pause-seconds 0.5]
+
+Raw rows older than the retention of their variable (see retention.example.toml) are deleted
+in bounded batches. With archive enabled, each batch is written to a zstd-compressed Parquet file
+under ARCHIVE_DIR before its deletion is committed. Each batch is a short transaction, so the
+dashboard keeps reading while the job runs. Every table that lost rows is then vacuumed and
+analyzed, which keeps the timestamp range scans of query_interval_timestamps fast.
+"""
+import argparse
+import logging
+import os
+import time
+
+import pandas as pd
+import sqlalchemy
+import toml
+
+from functions.data import database, ingestion, settings
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+logger = logging.getLogger('acodata.retention')
+
+
+def load_retention_policy(policy_path=None):
+    """
+    Reads the retention policy file.
+
+    Args:
+        policy_path (str): The path of the policy file. Defaults to RETENTION_POLICY_PATH.
+
+    Returns:
+        dict: The policy, empty (keep everything) if the file does not exist.
+    """
+    if policy_path is None:
+        policy_path = settings.RETENTION_POLICY_PATH
+    if not os.path.exists(policy_path):
+        return {}
+    return toml.load(policy_path)
+
+def get_variable_policy(policy, spot_id, global_data_id):
+    """
+    Resolves the retention of one variable: variable overrides, then spot overrides, then defaults.
+
+    Args:
+        policy (dict): The retention policy.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+
+    Returns:
+        dict: The 'raw_days' (None keeps forever) and 'archive' settings of the variable.
+    """
+    variable_policy = {'raw_days': None, 'archive': True}
+    variable_policy.update(policy.get('default', {}))
+    for spot_policy in policy.get('spots', []):
+        if spot_policy.get('spot_id') == spot_id:
+            variable_policy.update({key: value for key, value in spot_policy.items() if key != 'spot_id'})
+    for override in policy.get('variables', []):
+        if override.get('spot_id') == spot_id and override.get('global_data_id') == global_data_id:
+            variable_policy.update({key: value for key, value in override.items() if key not in ('spot_id', 'global_data_id')})
+    return variable_policy
+
+def query_spot_ids():
+    """
+    Constructs the SQL that lists every spot.
+
+    Returns:
+        str: The SQL query.
+    """
+    return 'SELECT spot_id FROM spots;'
+
+def query_spot_variable_ids(spot_id):
+    """
+    Constructs the SQL that lists every variable of a spot.
+
+    Args:
+        spot_id (int): The ID of the spot.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f'SELECT global_data_id FROM spot_{spot_id}_variables;'
+
+def query_count_expired_rows(spot_id, global_data_id, cutoff_timestamp):
+    """
+    Constructs the SQL that counts the rows of a table older than the cutoff.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        cutoff_timestamp (int): Rows strictly older than this timestamp are expired.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f'SELECT COUNT(*) FROM spot_{spot_id}_var_{global_data_id} WHERE timestamp < {cutoff_timestamp};'
+
+def query_delete_expired_batch(spot_id, global_data_id, cutoff_timestamp, batch_rows):
+    """
+    Constructs the SQL that deletes the oldest expired rows of a table, one batch at a time,
+    returning them so they can be archived.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        cutoff_timestamp (int): Rows strictly older than this timestamp are expired.
+        batch_rows (int): The maximum number of rows deleted.
+
+    Returns:
+        str: The SQL statement.
+    """
+    table = f'spot_{spot_id}_var_{global_data_id}'
+    query = f"""DELETE FROM {table}
+                WHERE ctid IN (SELECT ctid
+                               FROM {table}
+                               WHERE timestamp < {cutoff_timestamp}
+                               ORDER BY timestamp
+                               LIMIT {batch_rows})
+                RETURNING *;"""
+    return query
+
+def query_delete_expired_rollups(cutoff_timestamp):
+    """
+    Constructs the SQL that deletes the hourly rollups older than the cutoff.
+
+    Args:
+        cutoff_timestamp (int): Rollups of buckets strictly older than this timestamp are deleted.
+
+    Returns:
+        str: The SQL statement.
+    """
+    return f'DELETE FROM {ingestion.HOURLY_ROLLUPS_TABLE} WHERE bucket < {cutoff_timestamp};'
+
+def archive_rows(rows_df, spot_id, global_data_id, archive_dir=None):
+    """
+    Writes a batch of deleted rows to a compressed Parquet file.
+
+    The file is named after the first and last timestamps of the batch and written through a
+    temporary path, so a failed run never leaves a partial archive behind.
+
+    Args:
+        rows_df (DataFrame): The deleted rows.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        archive_dir (str): The root of the archive. Defaults to ARCHIVE_DIR.
+
+    Returns:
+        str: The path of the archive file.
+    """
+    if archive_dir is None:
+        archive_dir = settings.ARCHIVE_DIR
+    table_dir = os.path.join(archive_dir, f'spot_{spot_id}_var_{global_data_id}')
+    os.makedirs(table_dir, exist_ok=True)
+    path = os.path.join(table_dir, f"rows_{rows_df['timestamp'].min()}_{rows_df['timestamp'].max()}_{len(rows_df)}.parquet")
+    temporary_path = f'{path}.tmp'
+    rows_df.to_parquet(temporary_path, compression='zstd', index=False)
+    os.replace(temporary_path, path)
+    return path
+
+def purge_expired_rows(connection, spot_id, global_data_id, cutoff_timestamp, archive, batch_rows, pause_seconds):
+    """
+    Deletes (and optionally archives) every expired row of a table, in bounded batches.
+
+    Each batch is committed only after its archive file is written, so rows are never lost.
+
+    Args:
+        connection: A psycopg2 connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        cutoff_timestamp (int): Rows strictly older than this timestamp are expired.
+        archive (bool): Whether to archive the rows before deleting them.
+        batch_rows (int): The maximum number of rows per batch.
+        pause_seconds (float): The pause between batches, to leave room for the dashboard.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+    rows_deleted = 0
+    while True:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query_delete_expired_batch(spot_id, global_data_id, cutoff_timestamp, batch_rows))
+                rows = cursor.fetchall()
+                columns = [column.name for column in cursor.description]
+            if rows and archive:
+                path = archive_rows(pd.DataFrame.from_records(rows, columns=columns), spot_id, global_data_id)
+                logger.info('Archived %d rows of spot_%s_var_%s to %s', len(rows), spot_id, global_data_id, path)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        rows_deleted += len(rows)
+        if len(rows) < batch_rows:
+            return rows_deleted
+        time.sleep(pause_seconds)
+
+def vacuum_analyze(engine, table):
+    """
+    Reclaims the space of deleted rows and refreshes the planner statistics of a table.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        table (str): The name of the table.
+
+    Returns:
+        None
+    """
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(sqlalchemy.text(f'VACUUM (ANALYZE) {table};'))
+    return None
+
+def run_retention(engine, policy, now_timestamp, batch_rows=50000, pause_seconds=0.5, dry_run=False):
+    """
+    Applies the retention policy to every variable table of every spot.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        policy (dict): The retention policy.
+        now_timestamp (int): The reference time of the cutoffs.
+        batch_rows (int): The maximum number of rows per delete batch.
+        pause_seconds (float): The pause between batches.
+        dry_run (bool): Only count the expired rows, without deleting anything.
+
+    Returns:
+        DataFrame: One row per table with its cutoff and the number of expired or deleted rows.
+    """
+    report = []
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query_spot_ids())
+            spot_ids = [row[0] for row in cursor.fetchall()]
+        for spot_id in spot_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(query_spot_variable_ids(spot_id))
+                global_data_ids = [row[0] for row in cursor.fetchall()]
+            connection.commit()
+            for global_data_id in global_data_ids:
+                variable_policy = get_variable_policy(policy, spot_id, global_data_id)
+                if variable_policy['raw_days'] is None:
+                    continue
+                cutoff_timestamp = int(now_timestamp - variable_policy['raw_days'] * SECONDS_PER_DAY)
+                if dry_run:
+                    with connection.cursor() as cursor:
+                        cursor.execute(query_count_expired_rows(spot_id, global_data_id, cutoff_timestamp))
+                        rows = cursor.fetchone()[0]
+                    connection.commit()
+                else:
+                    rows = purge_expired_rows(connection, spot_id, global_data_id, cutoff_timestamp,
+                                              archive=variable_policy['archive'],
+                                              batch_rows=batch_rows,
+                                              pause_seconds=pause_seconds)
+                    if rows > 0:
+                        vacuum_analyze(engine, f'spot_{spot_id}_var_{global_data_id}')
+                logger.info('spot_%s_var_%s: %d rows older than %d %s', spot_id, global_data_id, rows,
+                            cutoff_timestamp, 'expired' if dry_run else 'deleted')
+                report.append({'spot_id': spot_id,
+                               'global_data_id': global_data_id,
+                               'cutoff_timestamp': cutoff_timestamp,
+                               'rows': rows})
+
+        rollup_days = policy.get('default', {}).get('rollup_days')
+        if rollup_days is not None and not dry_run:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT to_regclass('{ingestion.HOURLY_ROLLUPS_TABLE}') IS NOT NULL;")
+                has_rollups = cursor.fetchone()[0]
+                if has_rollups:
+                    cursor.execute(query_delete_expired_rollups(int(now_timestamp - rollup_days * SECONDS_PER_DAY)))
+            connection.commit()
+            if has_rollups:
+                vacuum_analyze(engine, ingestion.HOURLY_ROLLUPS_TABLE)
+    finally:
+        connection.close()
+    return pd.DataFrame(report, columns=['spot_id', 'global_data_id', 'cutoff_timestamp', 'rows'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Deletes and archives the expired rows of the spot variable tables.')
+    parser.add_argument('--policy', default=None, help='Retention policy file (defaults to ACODATA_RETENTION_POLICY_PATH).')
+    parser.add_argument('--batch-rows', type=int, default=50000, help='Maximum rows per delete batch.')
+    parser.add_argument('--pause-seconds', type=float, default=0.5, help='Pause between batches.')
+    parser.add_argument('--dry-run', action='store_true', help='Only report the expired rows.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    report_df = run_retention(engine=database.create_engine(),
+                              policy=load_retention_policy(args.policy),
+                              now_timestamp=time.time(),
+                              batch_rows=args.batch_rows,
+                              pause_seconds=args.pause_seconds,
+                              dry_run=args.dry_run)
+    print(report_df.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
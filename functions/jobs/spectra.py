@@ -0,0 +1,208 @@
+"""
+Spectral analysis job: stores the spectra and band energies of every closed day of the vibration variables.
+
+Usage (from the repository root):
+    python -m functions.jobs.spectra [--url postgresql+psycopg2://...] [--days 30] [--spot-id 1]
+
+Only the days not analysed yet are computed, so the job can run as often as wanted (once a
+day is enough); --days bounds how far back a first run goes. A day is closed as in the Parquet
+cache: it ended at least PARQUET_CACHE_SETTLE_SECONDS before the last record, so late rows are in.
+The pending days of a variable are read in one query and all their windows are transformed at
+once (see functions.data.spectral_analysis). The dashboard never computes spectra, it reads them.
+"""
+import argparse
+import logging
+import time
+
+import pandas as pd
+
+from functions.content import last_record_chart_builder, time_series_plot_builder
+from functions.data import database, parquet_cache, settings, spectral_analysis
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Most days read and transformed at once, which bounds the memory of the job
+DAYS_PER_BATCH = 31
+
+logger = logging.getLogger('acodata.spectra')
+
+
+def query_spectral_variables(variable_pattern, spot_id=None):
+    """
+    Constructs the SQL that lists the variables whose alias matches a pattern.
+
+    Args:
+        variable_pattern (str): The ILIKE pattern of the alias names.
+        spot_id (int): Only list the variables of this spot, if given.
+
+    Returns:
+        str: The SQL query.
+    """
+    spot_filter = f'AND spot_id = {int(spot_id)}' if spot_id is not None else ''
+    query = f"""SELECT spot_id, global_data_id, alias_name
+                FROM alias_variables
+                WHERE alias_name ILIKE '{variable_pattern.replace("'", "''")}'
+                {spot_filter}
+                ORDER BY spot_id, global_data_id;"""
+    return query
+
+def query_analysed_days(spot_id, global_data_id):
+    """
+    Constructs the SQL that lists the days of a variable already analysed.
+
+    Args:
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+
+    Returns:
+        str: The SQL query.
+    """
+    return f"""SELECT DISTINCT period_start
+               FROM {spectral_analysis.SPECTRAL_BANDS_TABLE}
+               WHERE spot_id = {spot_id} AND global_data_id = {global_data_id};"""
+
+def get_pending_days(connection, spot_id, global_data_id, last_record_timestamp, days):
+    """
+    Lists the closed days of the last `days` of a variable that are not analysed yet.
+
+    Args:
+        connection: A psycopg2 connection.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        last_record_timestamp (int): The timestamp of the last record of the variable.
+        days (int): How many days before the last record to look at.
+
+    Returns:
+        list: The indexes of the pending days, in order.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query_analysed_days(spot_id, global_data_id))
+        analysed_days = {row[0] // SECONDS_PER_DAY for row in cursor.fetchall()}
+    connection.commit()
+    closed_days = parquet_cache.closed_days_in_interval(last_record_timestamp - days * SECONDS_PER_DAY,
+                                                        last_record_timestamp,
+                                                        last_record_timestamp)
+    return [day for day in closed_days if day not in analysed_days]
+
+def split_into_batches(days, days_per_batch=DAYS_PER_BATCH):
+    """
+    Splits days into runs of consecutive days of at most days_per_batch days.
+
+    Args:
+        days (list): The indexes of the days, in order.
+        days_per_batch (int): The most days per run.
+
+    Returns:
+        list: The runs, each a list of consecutive day indexes.
+    """
+    batches = []
+    for day in days:
+        if batches and day == batches[-1][-1] + 1 and len(batches[-1]) < days_per_batch:
+            batches[-1].append(day)
+        else:
+            batches.append([day])
+    return batches
+
+def analyse_variable(engine, connection, spot_id, global_data_id, days, window_samples, bands):
+    """
+    Computes and stores the spectra of the pending closed days of a variable.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        connection: A psycopg2 connection of the engine.
+        spot_id (int): The ID of the spot.
+        global_data_id (int): The ID of the global variable.
+        days (int): How many days before the last record to look at.
+        window_samples (int): The number of samples per FFT window.
+        bands (list): The (low, high) edges of each band in cycles per hour.
+
+    Returns:
+        int: The number of days analysed.
+    """
+    last_record_df = pd.read_sql(last_record_chart_builder.query_get_last_record(spot_id, global_data_id), engine)
+    if last_record_df.empty:
+        return 0
+    pending_days = get_pending_days(connection, spot_id, global_data_id, int(last_record_df['timestamp'].iloc[0]), days)
+    days_analysed = 0
+    for batch_days in split_into_batches(pending_days):
+        rows_df = pd.read_sql(time_series_plot_builder.query_interval_timestamps(spot_id, global_data_id,
+                                                                                 batch_days[0] * SECONDS_PER_DAY,
+                                                                                 (batch_days[-1] + 1) * SECONDS_PER_DAY), engine)
+        if rows_df.empty:
+            # Days before the first record, left pending in case older rows are loaded later
+            continue
+        sample_seconds = spectral_analysis.get_sample_seconds(rows_df['timestamp'].to_numpy())
+        if sample_seconds is None or SECONDS_PER_DAY // sample_seconds < window_samples:
+            # Too few samples per day for one window: the days are stored without windows, as done
+            sample_seconds = SECONDS_PER_DAY // window_samples
+        spectra_df, bands_df = spectral_analysis.compute_day_spectra(rows_df, batch_days, sample_seconds, window_samples, bands)
+        try:
+            with connection.cursor() as cursor:
+                spectral_analysis.upsert_day_spectra(cursor, spot_id, global_data_id, spectra_df, bands_df)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        days_analysed += len(batch_days)
+        logger.info('spot_%s_var_%s: %d days analysed (%d rows, %d s sampling)', spot_id, global_data_id,
+                    len(batch_days), len(rows_df), sample_seconds)
+    return days_analysed
+
+def run_spectra(engine, days=None, spot_id=None, variable_pattern=None, window_samples=None, bands=None):
+    """
+    Analyses the pending closed days of every vibration variable.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+        days (int): How many days before the last record to look at. Defaults to SPECTRA_BACKFILL_DAYS.
+        spot_id (int): Only analyse the variables of this spot, if given.
+        variable_pattern (str): The ILIKE pattern of the alias names. Defaults to SPECTRA_VARIABLE_PATTERN.
+        window_samples (int): The number of samples per FFT window. Defaults to SPECTRA_WINDOW_SAMPLES.
+        bands (list): The (low, high) band edges in cycles per hour. Defaults to SPECTRA_BANDS_CPH.
+
+    Returns:
+        DataFrame: One row per variable with the number of days analysed and the time taken.
+    """
+    days = settings.SPECTRA_BACKFILL_DAYS if days is None else days
+    variable_pattern = settings.SPECTRA_VARIABLE_PATTERN if variable_pattern is None else variable_pattern
+    window_samples = settings.SPECTRA_WINDOW_SAMPLES if window_samples is None else window_samples
+    bands = settings.SPECTRA_BANDS_CPH if bands is None else bands
+
+    report = []
+    connection = engine.raw_connection()
+    try:
+        spectral_analysis.create_spectral_tables(connection)
+        # Through the cursor: the % of the pattern would be taken for a parameter by pandas.read_sql
+        with connection.cursor() as cursor:
+            cursor.execute(query_spectral_variables(variable_pattern, spot_id))
+            variables = cursor.fetchall()
+        connection.commit()
+        for variable_spot_id, global_data_id, alias_name in variables:
+            start_time = time.time()
+            days_analysed = analyse_variable(engine, connection, variable_spot_id, global_data_id,
+                                             days, window_samples, bands)
+            report.append({'spot_id': variable_spot_id,
+                           'global_data_id': global_data_id,
+                           'alias_name': alias_name,
+                           'days': days_analysed,
+                           'seconds': round(time.time() - start_time, 3)})
+    finally:
+        connection.close()
+    return pd.DataFrame(report, columns=['spot_id', 'global_data_id', 'alias_name', 'days', 'seconds'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Stores the spectra and band energies of the closed days of the vibration variables.')
+    parser.add_argument('--url', default=None, help='Database URL (defaults to ACODATA_DATABASE_URL or secrets.toml).')
+    parser.add_argument('--days', type=int, default=None, help='Days before the last record to analyse (defaults to ACODATA_SPECTRA_BACKFILL_DAYS).')
+    parser.add_argument('--spot-id', type=int, default=None, help='Only analyse this spot.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    report_df = run_spectra(engine=database.create_engine(url=args.url),
+                            days=args.days,
+                            spot_id=args.spot_id)
+    print(report_df.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
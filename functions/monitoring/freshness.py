@@ -0,0 +1,139 @@
+"""
+Freshness of the spot variables: which sensors stopped sending data, across the whole fleet.
+
+One batched query reads, for every spot_{id}_var_{gid} table, its last timestamp and the median
+spacing of its last FRESHNESS_SAMPLE_ROWS rows, the interval at which the variable is expected to
+send. Each table costs a backward scan of a few rows of its timestamp index, so the check of the
+fleet stays cheap, and conn.query keeps its result for FRESHNESS_TTL_SECONDS for every session.
+
+The tables are read rather than spot_latest_records, which only the ingestion API maintains,
+and always on the primary: the lag of a replica would show as stale sensors.
+"""
+import time
+
+import numpy as np
+
+from functions.data import query_context, settings
+from functions.monitoring import metrics
+
+FRESHNESS_OK = 'ok'
+FRESHNESS_LATE = 'late'
+FRESHNESS_STALE = 'stale'
+FRESHNESS_UNKNOWN = 'unknown'
+
+FRESHNESS_LABELS = {FRESHNESS_OK: 'Em dia',
+                    FRESHNESS_LATE: 'Atrasado',
+                    FRESHNESS_STALE: 'Parado',
+                    FRESHNESS_UNKNOWN: 'Sem histórico'}
+
+
+def query_fleet_variables():
+    """
+    Constructs the SQL query that lists the variables of every spot whose table exists, with their aliases.
+
+    Returns:
+        str: The SQL query.
+    """
+    query = """SELECT alias_variables.spot_id, alias_spots.alias AS spot_alias,
+                      alias_variables.global_data_id, alias_variables.alias_name
+               FROM alias_variables
+               JOIN alias_spots ON alias_spots.spot_id = alias_variables.spot_id
+               JOIN information_schema.tables
+                 ON tables.table_name = 'spot_' || alias_variables.spot_id || '_var_' || alias_variables.global_data_id
+                AND tables.table_schema = current_schema()
+               ORDER BY alias_variables.spot_id, alias_variables.global_data_id;"""
+    return query
+
+def query_fleet_freshness(variables, sample_rows):
+    """
+    Constructs one SQL query that reads the last timestamp and the sampling interval of many variables.
+
+    Args:
+        variables (list): The (spot_id, global_data_id) of each variable.
+        sample_rows (int): The number of last rows whose spacing gives the sampling interval.
+
+    Returns:
+        str: The SQL query, with one row per variable ('spot_id', 'global_data_id', 'last_timestamp', 'sample_seconds').
+    """
+    selects = [f"""SELECT {spot_id} AS spot_id, {global_data_id} AS global_data_id, MAX(timestamp) AS last_timestamp,
+                          percentile_cont(0.5) WITHIN GROUP (ORDER BY spacing) AS sample_seconds
+                   FROM (SELECT timestamp, timestamp - LAG(timestamp) OVER (ORDER BY timestamp) AS spacing
+                         FROM (SELECT timestamp
+                               FROM spot_{spot_id}_var_{global_data_id}
+                               ORDER BY timestamp DESC
+                               LIMIT {int(sample_rows)}) AS last_rows) AS spacings"""
+               for spot_id, global_data_id in variables]
+    return '\nUNION ALL\n'.join(selects)
+
+def classify_freshness(freshness_df, now_timestamp, late_samples, stale_samples):
+    """
+    Compares how long each variable has been silent with its sampling interval.
+
+    Args:
+        freshness_df (DataFrame): The rows of query_fleet_freshness.
+        now_timestamp (float): The current unix timestamp.
+        late_samples (int): The missed samples after which a variable is late.
+        stale_samples (int): The missed samples after which a variable is stale.
+
+    Returns:
+        DataFrame: The rows with their 'gap_seconds', 'missed_samples' and 'status' added.
+    """
+    last_timestamp = freshness_df['last_timestamp'].to_numpy(dtype='float64', na_value=np.nan)
+    sample_seconds = freshness_df['sample_seconds'].to_numpy(dtype='float64', na_value=np.nan)
+    gap_seconds = np.maximum(now_timestamp - last_timestamp, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        missed_samples = gap_seconds / np.where(sample_seconds > 0, sample_seconds, np.nan)
+    status = np.select([np.isnan(missed_samples), missed_samples >= stale_samples, missed_samples >= late_samples],
+                       [FRESHNESS_UNKNOWN, FRESHNESS_STALE, FRESHNESS_LATE],
+                       default=FRESHNESS_OK)
+    return freshness_df.assign(gap_seconds=gap_seconds, missed_samples=missed_samples, status=status)
+
+def get_fleet_freshness(conn, now_timestamp=None):
+    """
+    Checks the freshness of every variable of every spot.
+
+    Args:
+        conn: A QueryContext or a Streamlit SQL connection.
+        now_timestamp (float): The current unix timestamp. Defaults to now.
+
+    Returns:
+        DataFrame: One row per variable, with 'spot_id', 'spot_alias', 'global_data_id', 'alias_name',
+        'last_timestamp', 'sample_seconds', 'gap_seconds', 'missed_samples' and 'status', the most
+        silent first.
+    """
+    if now_timestamp is None:
+        now_timestamp = time.time()
+    primary_conn = query_context.route_primary(conn)
+    variables_df = primary_conn.query(query_fleet_variables(), ttl=settings.FRESHNESS_TTL_SECONDS)
+    if variables_df.empty:
+        return variables_df.assign(last_timestamp=[], sample_seconds=[], gap_seconds=[], missed_samples=[], status=[])
+    variables = list(zip(variables_df['spot_id'], variables_df['global_data_id']))
+    freshness_df = primary_conn.query(query_fleet_freshness(variables, settings.FRESHNESS_SAMPLE_ROWS),
+                                      ttl=settings.FRESHNESS_TTL_SECONDS)
+    freshness_df = classify_freshness(variables_df.merge(freshness_df, on=['spot_id', 'global_data_id'], how='left'),
+                                      now_timestamp=now_timestamp,
+                                      late_samples=settings.FRESHNESS_LATE_SAMPLES,
+                                      stale_samples=settings.FRESHNESS_STALE_SAMPLES)
+    metrics.observe_freshness({status: int((freshness_df['status'] == status).sum()) for status in FRESHNESS_LABELS})
+    return freshness_df.sort_values('missed_samples', ascending=False, na_position='first').reset_index(drop=True)
+
+def format_gap(gap_seconds):
+    """
+    Describes a duration in Portuguese, to tell for how long a variable has been silent.
+
+    Args:
+        gap_seconds (float): The duration in seconds.
+
+    Returns:
+        str: The description of the duration.
+    """
+    if np.isnan(gap_seconds):
+        return '-'
+    minutes = int(gap_seconds // 60)
+    if minutes < 60:
+        return f'{minutes} min'
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f'{hours} h {minutes:02d} min'
+    days, hours = divmod(hours, 24)
+    return f'{days} dia {hours} h' if days == 1 else f'{days} dias {hours} h'
@@ -0,0 +1,428 @@
+"""
+Process-wide metrics of the dashboard, exported in the Prometheus text exposition format.
+
+Every Streamlit session runs in the same process, so the registry below aggregates all of them.
+With ACODATA_METRICS_MODE=http the metrics are served at
+http://<ACODATA_METRICS_HOST>:<ACODATA_METRICS_PORT>/metrics (localhost unless the host is set),
+with ACODATA_METRICS_MODE=file they are written to ACODATA_METRICS_FILE_PATH at the end of each rerun.
+The endpoint serves the metrics of one process, so each Streamlit process of a host needs its own
+ACODATA_METRICS_PORT (one scrape target per process). A process that cannot bind its port logs it
+once and keeps serving pages without the endpoint.
+"""
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from functions.data import settings
+
+QUERY_SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+RERUN_SECONDS_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30]
+PAYLOAD_BYTES_BUCKETS = [1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7]
+
+# Sessions seen in this window are counted as active
+ACTIVE_SESSION_SECONDS = 5 * 60
+
+registry_lock = threading.Lock()
+registry = {}
+session_last_seen = {}
+http_server = None
+# Set when the endpoint could not be bound, so the following reruns do not retry
+http_server_error = None
+
+logger = logging.getLogger('acodata.metrics')
+
+
+def is_enabled():
+    """
+    Checks whether metrics are collected.
+
+    Returns:
+        bool: True unless ACODATA_METRICS_MODE is 'off'.
+    """
+    return settings.METRICS_MODE in ('file', 'http')
+
+def get_metric(name, metric_type, help_text, buckets=None):
+    """
+    Returns a metric of the registry, creating it on first use. Must be called with the lock held.
+
+    Args:
+        name (str): The name of the metric.
+        metric_type (str): 'counter', 'gauge' or 'histogram'.
+        help_text (str): The description of the metric.
+        buckets (list): The upper bounds of the histogram buckets.
+
+    Returns:
+        dict: The metric, with its samples by label values.
+    """
+    if name not in registry:
+        registry[name] = {'type': metric_type, 'help': help_text, 'buckets': buckets, 'samples': {}}
+    return registry[name]
+
+def increment_counter(name, help_text, labels=(), value=1):
+    """
+    Adds a value to a counter.
+
+    Args:
+        name (str): The name of the counter.
+        help_text (str): The description of the counter.
+        labels (tuple): The (label, value) pairs of the sample.
+        value (float): The amount added.
+
+    Returns:
+        None
+    """
+    if not is_enabled():
+        return None
+    with registry_lock:
+        samples = get_metric(name, 'counter', help_text)['samples']
+        samples[labels] = samples.get(labels, 0) + value
+    return None
+
+def set_gauge(name, help_text, value, labels=()):
+    """
+    Sets the value of a gauge.
+
+    Args:
+        name (str): The name of the gauge.
+        help_text (str): The description of the gauge.
+        value (float): The new value.
+        labels (tuple): The (label, value) pairs of the sample.
+
+    Returns:
+        None
+    """
+    if not is_enabled():
+        return None
+    with registry_lock:
+        get_metric(name, 'gauge', help_text)['samples'][labels] = value
+    return None
+
+def observe_histogram(name, help_text, buckets, value, labels=()):
+    """
+    Records one observation in a histogram.
+
+    Args:
+        name (str): The name of the histogram.
+        help_text (str): The description of the histogram.
+        buckets (list): The upper bounds of the buckets.
+        value (float): The observed value.
+        labels (tuple): The (label, value) pairs of the sample.
+
+    Returns:
+        None
+    """
+    if not is_enabled():
+        return None
+    with registry_lock:
+        samples = get_metric(name, 'histogram', help_text, buckets)['samples']
+        bucket_counts, total, count = samples.get(labels, ([0] * len(buckets), 0.0, 0))
+        bucket_counts = [bucket_count + (1 if value <= bound else 0) for bucket_count, bound in zip(bucket_counts, buckets)]
+        samples[labels] = (bucket_counts, total + value, count + 1)
+    return None
+
+def observe_query(query_shape, seconds, rows):
+    """
+    Records a query that reached the database.
+
+    Args:
+        query_shape (str): The shape of the query (see query_context.fingerprint_query).
+        seconds (float): The time the query took.
+        rows (int): The number of rows fetched, or None if unknown.
+
+    Returns:
+        None
+    """
+    labels = (('shape', query_shape),)
+    observe_histogram('acodata_query_duration_seconds', 'Time of the queries that reached the database.',
+                      QUERY_SECONDS_BUCKETS, seconds, labels)
+    if rows is not None:
+        increment_counter('acodata_query_rows_total', 'Rows fetched from the database.', labels, rows)
+    return None
+
+def count_cache_request(cache, hit):
+    """
+    Records a lookup in one of the caches ('memo' for the per-rerun QueryContext, 'parquet' for the local cache,
+    'frame_store' for the process-wide frames, 'forecast' for the trend fits of the spots).
+
+    Args:
+        cache (str): The name of the cache.
+        hit (bool): Whether the data was found in the cache.
+
+    Returns:
+        None
+    """
+    increment_counter('acodata_cache_requests_total', 'Cache lookups by cache and result.',
+                      (('cache', cache), ('result', 'hit' if hit else 'miss')))
+    return None
+
+def observe_rerun(seconds):
+    """
+    Records the duration of a script rerun.
+
+    Args:
+        seconds (float): The time the rerun took.
+
+    Returns:
+        None
+    """
+    observe_histogram('acodata_rerun_duration_seconds', 'Time of the dashboard reruns.', RERUN_SECONDS_BUCKETS, seconds)
+    return None
+
+def observe_session(session_id, now=None):
+    """
+    Marks a session as active and updates the active sessions gauge.
+
+    Args:
+        session_id (str): The ID of the session.
+        now (float): The current time. Defaults to time.time().
+
+    Returns:
+        None
+    """
+    if not is_enabled():
+        return None
+    if now is None:
+        now = time.time()
+    with registry_lock:
+        session_last_seen[session_id] = now
+        for expired_session_id in [key for key, last_seen in session_last_seen.items() if now - last_seen > ACTIVE_SESSION_SECONDS]:
+            del session_last_seen[expired_session_id]
+        active_sessions = len(session_last_seen)
+    set_gauge('acodata_active_sessions', f'Sessions with a rerun in the last {ACTIVE_SESSION_SECONDS} seconds.', active_sessions)
+    return None
+
+def observe_replica_health(name, healthy, lag_seconds):
+    """
+    Records the result of a replica health check.
+
+    Args:
+        name (str): The name of the replica connection.
+        healthy (bool): Whether the replica can serve reads.
+        lag_seconds (float): The replay lag, or None if the replica did not answer.
+
+    Returns:
+        None
+    """
+    labels = (('replica', name),)
+    set_gauge('acodata_replica_healthy', 'Whether the replica serves the historical reads (1) or not (0).',
+              1 if healthy else 0, labels)
+    if lag_seconds is not None:
+        set_gauge('acodata_replica_lag_seconds', 'Replay lag of the replica at its last health check.', lag_seconds, labels)
+    return None
+
+def observe_figure_payload_bytes(chart, payload_bytes):
+    """
+    Records the size in bytes of a figure payload already serialized.
+
+    Args:
+        chart (str): The kind of chart ('last_record', 'time_series', 'reliability_gauge', ...).
+        payload_bytes (int): The size of the payload.
+
+    Returns:
+        None
+    """
+    observe_histogram('acodata_figure_payload_bytes', 'Size of the figure JSON sent to the browser.',
+                      PAYLOAD_BYTES_BUCKETS, payload_bytes, (('chart', chart),))
+    return None
+
+def observe_frame_store(frames, size_bytes, evictions):
+    """
+    Records the size of the process-wide frame store after a frame was stored.
+
+    Args:
+        frames (int): The number of frames held.
+        size_bytes (int): The memory held by the frames.
+        evictions (int): The number of frames evicted to store the new one.
+
+    Returns:
+        None
+    """
+    set_gauge('acodata_frame_store_frames', 'Frames held by the process-wide frame store.', frames)
+    set_gauge('acodata_frame_store_bytes', 'Memory held by the process-wide frame store.', size_bytes)
+    if evictions:
+        increment_counter('acodata_frame_store_evictions_total', 'Frames evicted from the frame store to stay within its budget.',
+                          value=evictions)
+    return None
+
+def observe_cache_warm(seconds, warmed_spots, failed_spots):
+    """
+    Records a pass of the cache warmer.
+
+    Args:
+        seconds (float): The duration of the pass.
+        warmed_spots (int): The number of spots preloaded.
+        failed_spots (int): The number of spots whose preload failed.
+
+    Returns:
+        None
+    """
+    set_gauge('acodata_cache_warm_duration_seconds', 'Duration of the last pass of the cache warmer.', seconds)
+    set_gauge('acodata_cache_warm_spots', 'Spots preloaded by the last pass of the cache warmer.', warmed_spots)
+    increment_counter('acodata_cache_warm_failures_total', 'Spots whose preload failed.', value=failed_spots)
+    set_gauge('acodata_cache_warm_last_timestamp_seconds', 'End of the last pass of the cache warmer.', time.time())
+    return None
+
+def observe_freshness(status_counts):
+    """
+    Records the result of a fleet-wide freshness check.
+
+    Args:
+        status_counts (dict): The number of variables of each freshness status.
+
+    Returns:
+        None
+    """
+    for status, count in status_counts.items():
+        set_gauge('acodata_variables_by_freshness', 'Spot variables by freshness status at the last check.',
+                  count, labels=(('status', status),))
+    set_gauge('acodata_freshness_last_check_timestamp_seconds', 'End of the last fleet-wide freshness check.', time.time())
+    return None
+
+def escape_label_value(value):
+    """
+    Escapes a label value for the text exposition format.
+
+    Args:
+        value: The label value.
+
+    Returns:
+        str: The escaped value.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    """
+    Formats label pairs as {name="value",...}.
+
+    Args:
+        labels (tuple): The (label, value) pairs.
+
+    Returns:
+        str: The formatted labels, empty if there are none.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+def format_bound(bound):
+    """
+    Formats a bucket bound the way Prometheus clients do.
+
+    Args:
+        bound (float): The upper bound of the bucket.
+
+    Returns:
+        str: The formatted bound.
+    """
+    return repr(float(bound))
+
+def render_prometheus_text():
+    """
+    Renders every metric in the Prometheus text exposition format (version 0.0.4).
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    with registry_lock:
+        for name, metric in sorted(registry.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in sorted(metric['samples'].items()):
+                if metric['type'] != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                bucket_counts, total, count = value
+                for bound, bucket_count in zip(metric['buckets'], bucket_counts):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', format_bound(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+def write_metrics_file(path=None):
+    """
+    Writes the metrics to a file, through a temporary file so scrapers never read a partial one.
+
+    Args:
+        path (str): The path of the file. Defaults to METRICS_FILE_PATH.
+
+    Returns:
+        None
+    """
+    if path is None:
+        path = settings.METRICS_FILE_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'w') as file:
+        file.write(render_prometheus_text())
+    os.replace(temporary_path, path)
+    return None
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the metrics at /metrics."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the Streamlit log
+
+
+def start_http_server(host=None, port=None):
+    """
+    Starts the metrics endpoint in a daemon thread, once per process.
+
+    If the address cannot be bound (typically another process of the host already serves
+    metrics on the port), the error is logged once and the endpoint stays off in this process.
+
+    Args:
+        host (str): The address to bind. Defaults to METRICS_HOST.
+        port (int): The port to listen on. Defaults to METRICS_PORT.
+
+    Returns:
+        None
+    """
+    global http_server, http_server_error
+    if host is None:
+        host = settings.METRICS_HOST
+    if port is None:
+        port = settings.METRICS_PORT
+    with registry_lock:
+        if http_server is not None or http_server_error is not None:
+            return None
+        try:
+            http_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        except OSError as error:
+            http_server_error = error
+            logger.error('Metrics endpoint disabled in this process, cannot bind %s:%s: %s '
+                         '(give each process its own ACODATA_METRICS_PORT)', host, port, error)
+            return None
+    threading.Thread(target=http_server.serve_forever, name='acodata-metrics', daemon=True).start()
+    return None
+
+def export():
+    """
+    Publishes the metrics according to ACODATA_METRICS_MODE. Called at the end of every rerun.
+
+    Returns:
+        None
+    """
+    if settings.METRICS_MODE == 'http':
+        start_http_server()
+    elif settings.METRICS_MODE == 'file':
+        write_metrics_file()
+    return None
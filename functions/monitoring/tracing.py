@@ -0,0 +1,169 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Each Streamlit session runs its script in its own thread, so each rerun traces into its own state
+trace_state = threading.local()
+
+
+def start_trace(name='rerun'):
+    """
+    Starts the trace of the current thread, with a root span covering the whole rerun.
+
+    Args:
+        name (str): The name of the root span.
+
+    Returns:
+        None
+    """
+    trace_state.origin = time.perf_counter()
+    trace_state.spans = [{'name': name, 'stage': 'rerun', 'start': 0.0, 'end': None,
+                          'depth': 0, 'parent': None, 'attributes': {}}]
+    trace_state.stack = [0]
+    return None
+
+def finish_trace():
+    """
+    Closes the root span and stops tracing the current thread.
+
+    Returns:
+        list: The spans of the trace, in start order, or an empty list if no trace was started.
+    """
+    spans = getattr(trace_state, 'spans', None)
+    if spans is None:
+        return []
+    spans[0]['end'] = time.perf_counter() - trace_state.origin
+    trace_state.spans = None
+    trace_state.stack = None
+    return spans
+
+def is_tracing():
+    """
+    Checks whether the current thread is being traced.
+
+    Returns:
+        bool: True between start_trace() and finish_trace().
+    """
+    return getattr(trace_state, 'spans', None) is not None
+
+@contextmanager
+def span(name, stage, **attributes):
+    """
+    Records the time spent in a block as a span nested in the currently open one.
+
+    Outside a trace the block runs untouched.
+
+    Args:
+        name (str): The name of the span.
+        stage (str): The kind of work: 'builder', 'query', 'transform', 'figure' or 'render'.
+        **attributes: Extra details shown with the span (query shape, rows, ...).
+
+    Yields:
+        dict: The span record, or None outside a trace.
+    """
+    if not is_tracing():
+        yield None
+        return
+    spans = trace_state.spans
+    record = {'name': name, 'stage': stage, 'start': time.perf_counter() - trace_state.origin, 'end': None,
+              'depth': len(trace_state.stack), 'parent': trace_state.stack[-1], 'attributes': attributes}
+    spans.append(record)
+    trace_state.stack.append(len(spans) - 1)
+    try:
+        yield record
+    finally:
+        record['end'] = time.perf_counter() - trace_state.origin
+        trace_state.stack.pop()
+
+def traced(stage, name=None):
+    """
+    Decorates a function so every call is recorded as a span.
+
+    Args:
+        stage (str): The kind of work done by the function.
+        name (str): The name of the span. Defaults to 'module.function'.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(function):
+        span_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not is_tracing():
+                return function(*args, **kwargs)
+            with span(span_name, stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def spans_to_df(spans):
+    """
+    Converts the spans of a trace into a DataFrame, in start order.
+
+    Args:
+        spans (list): The spans returned by finish_trace().
+
+    Returns:
+        DataFrame: One row per span with 'name', 'stage', 'depth', 'start_ms', 'duration_ms' and 'details'.
+    """
+    rows = [{'name': record['name'],
+             'stage': record['stage'],
+             'depth': record['depth'],
+             'start_ms': record['start'] * 1000,
+             'duration_ms': ((record['end'] if record['end'] is not None else record['start']) - record['start']) * 1000,
+             'details': ', '.join(f'{key}={value}' for key, value in record['attributes'].items())}
+            for record in spans]
+    return pd.DataFrame(rows, columns=['name', 'stage', 'depth', 'start_ms', 'duration_ms', 'details'])
+
+def stage_breakdown(spans):
+    """
+    Sums the self time (duration minus the time of nested spans) of each stage.
+
+    Self times add up to the whole rerun, so the shares show where the time goes: the
+    'rerun' and 'builder' rows are the glue code between the traced stages.
+
+    Args:
+        spans (list): The spans returned by finish_trace().
+
+    Returns:
+        DataFrame: The total milliseconds and share of the rerun of every stage.
+    """
+    durations = [((record['end'] if record['end'] is not None else record['start']) - record['start']) * 1000
+                 for record in spans]
+    self_times = list(durations)
+    for record, duration in zip(spans, durations):
+        if record['parent'] is not None:
+            self_times[record['parent']] -= duration
+    totals = {}
+    for record, self_time in zip(spans, self_times):
+        totals[record['stage']] = totals.get(record['stage'], 0.0) + self_time
+    rerun_ms = durations[0] if durations else 0.0
+    breakdown_df = pd.DataFrame({'stage': list(totals.keys()), 'total_ms': list(totals.values())})
+    breakdown_df['share'] = breakdown_df['total_ms'] / rerun_ms if rerun_ms else 0.0
+    return breakdown_df.sort_values(by='total_ms', ascending=False).reset_index(drop=True)
+
+def to_chrome_trace(spans):
+    """
+    Converts the spans of a trace into the Chrome trace-event format (chrome://tracing, Perfetto).
+
+    Args:
+        spans (list): The spans returned by finish_trace().
+
+    Returns:
+        dict: The trace, ready to be dumped as JSON.
+    """
+    events = [{'name': record['name'],
+               'cat': record['stage'],
+               'ph': 'X',
+               'ts': record['start'] * 1e6,
+               'dur': ((record['end'] if record['end'] is not None else record['start']) - record['start']) * 1e6,
+               'pid': 1,
+               'tid': 1,
+               'args': {key: str(value) for key, value in record['attributes'].items()}}
+              for record in spans]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
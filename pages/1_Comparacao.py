@@ -0,0 +1,37 @@
+# Importing the main packages
+import streamlit as st
+
+
+# Importing customized functions
+from functions.style import css_hacks
+from functions.content import sticky_logo, comparison_plot_builder
+from functions.data import tenants
+from functions.data.query_context import QueryContext
+
+
+# Setting the page configuration
+st.set_page_config(page_title='ACOPLAST Brasil - Comparação',
+                   page_icon="images/favicon-acoplast.ico",
+                   layout="wide",
+                   initial_sidebar_state="collapsed"
+                   )
+
+# Client of this session, as in the main page
+tenant = tenants.get_session_tenant(tenants.load_tenants())
+if tenant is None:
+    st.error('Cliente não encontrado ou acesso não autorizado. Verifique o endereço de acesso.')
+    st.stop()
+
+conn, replica_conns = tenants.connect_tenant(tenant)
+query_context = QueryContext(conn, replicas=replica_conns, namespace=tenant['slug'])
+
+# Removing undesired streamlit elements
+css_hacks.remove_streamlit_elements()
+
+banner_logo = st.container()
+sticky_logo.insert_logo(banner_logo)
+
+st.markdown(f'<div align="center"><h3>{tenant["client_name"]}</h3></div>', unsafe_allow_html=True)
+st.markdown("#### Comparação entre séries")
+
+comparison_plot_builder.show_comparison(column=st.container(), conn=query_context)
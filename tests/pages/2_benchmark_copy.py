@@ -0,0 +1,64 @@
+import streamlit as st
+import time
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+# Makes the app functions importable when running `streamlit run tests/app.py`
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from functions.content import time_series_plot_builder
+from functions.data import bulk_fetch
+
+st.set_page_config(
+    page_title="Benchmark de Leitura COPY",
+    page_icon="⏳",
+    layout="wide",
+    initial_sidebar_state="expanded",
+)
+
+st.title('Benchmark: conn.query x COPY')
+
+conn = st.connection("postgresql", type="sql")
+
+spots_df = conn.query('SELECT * FROM spots;', ttl="10m")
+spot = st.selectbox('Spot', spots_df['spot_id'])
+n_days = st.slider('Dias de dados', min_value=1, max_value=90, value=30)
+repetitions = st.slider('Repetições', min_value=1, max_value=10, value=3)
+
+if st.button('Executar benchmark'):
+    spot_variables_df = conn.query(f'SELECT * FROM spot_{spot}_variables;', ttl="10m")
+    spot_variables_df = spot_variables_df[spot_variables_df['alarm_critical'].notna()]
+
+    results = []
+    for variable in spot_variables_df['global_data_id']:
+        last_timestamp_df = conn.query(f'SELECT MAX(timestamp) AS timestamp FROM spot_{spot}_var_{variable};')
+        end_timestamp = int(last_timestamp_df['timestamp'].iloc[0]) + 1
+        start_timestamp = end_timestamp - time_series_plot_builder.days_to_seconds(n_days)
+        query = time_series_plot_builder.query_interval_timestamps(spot_id=spot,
+                                                                   global_data_id=variable,
+                                                                   start_timestamp=start_timestamp,
+                                                                   end_timestamp=end_timestamp)
+        for repetition in range(repetitions):
+            # A distinct comment per run keeps st.connection from answering from its cache
+            start_time = time.time()
+            query_df = conn.query(f'{query} /* benchmark {time.time()} */')
+            query_elapsed_time = time.time() - start_time
+
+            start_time = time.time()
+            copy_df = bulk_fetch.df_from_copy(conn=conn, query=query)
+            copy_elapsed_time = time.time() - start_time
+
+            results.append({'variável': variable,
+                            'repetição': repetition + 1,
+                            'linhas': len(query_df),
+                            'conn.query (s)': query_elapsed_time,
+                            'COPY (s)': copy_elapsed_time,
+                            'ganho': query_elapsed_time / copy_elapsed_time,
+                            'resultados iguais': query_df.shape == copy_df.shape})
+
+    results_df = pd.DataFrame(results)
+    st.subheader(f'Dados das variáveis do spot {spot}')
+    st.dataframe(results_df, use_container_width=True)
+    st.write(f"Ganho mediano: {results_df['ganho'].median():.1f}x")